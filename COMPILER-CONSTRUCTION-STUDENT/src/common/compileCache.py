@@ -0,0 +1,163 @@
+"""
+A content-addressed cache for the results of genericCompiler.compileMain.
+
+The key of an entry is a hash of
+- the content of the source file,
+- the source code of the compiler: all modules of this repository imported, directly or
+  indirectly, by the compiler module and by genericCompiler (found by scanning their
+  import statements, so changes to an interpreter do not invalidate the cache),
+- the options of the compilation (see genericCompiler.Args) and the python version.
+
+An entry is a directory DIR/KEY holding meta.json (exit code, text printed to stderr,
+message of a compile error) and the files written by the compilation (.wasm and .wat).
+Entries are built in a temporary directory and renamed, so concurrent compilations (for
+example several test workers) never see a partial entry. Every hit updates the
+modification time of meta.json. After adding an entry, the least recently used entries
+are deleted until the size of the cache is at most maxSize bytes.
+"""
+from __future__ import annotations
+from typing import *
+from dataclasses import dataclass
+import common.log as log
+import ast
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+_SRC_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def moduleFile(name: str) -> Optional[str]:
+    """
+    Returns the source file of the module with the given name if it belongs to this
+    repository.
+    """
+    base = os.path.join(_SRC_ROOT, *name.split('.'))
+    for f in [base + '.py', os.path.join(base, '__init__.py')]:
+        if os.path.isfile(f):
+            return f
+    return None
+
+def importedModules(path: str) -> list[str]:
+    with open(path, 'r') as f:
+        tree = ast.parse(f.read(), path)
+    names: list[str] = []
+    for node in ast.walk(tree):
+        match node:
+            case ast.Import(aliases):
+                names.extend([a.name for a in aliases])
+            case ast.ImportFrom(mod, aliases, 0) if mod is not None:
+                names.append(mod)
+                names.extend([f'{mod}.{a.name}' for a in aliases])
+            case _:
+                pass
+    return names
+
+def sourceFiles(modules: list[str]) -> list[str]:
+    """
+    Returns the source files of the given modules and of all modules of this repository
+    they import, directly or indirectly.
+    """
+    todo = list(modules)
+    files: dict[str, None] = {}
+    seen: set[str] = set()
+    while todo:
+        name = todo.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        f = moduleFile(name)
+        if f is not None and f not in files:
+            files[f] = None
+            todo.extend(importedModules(f))
+    return sorted(files)
+
+_SOURCE_HASHES: dict[tuple[str, ...], str] = {}
+
+def sourceHash(modules: list[str]) -> str:
+    """
+    Hashes the sources of the given modules and their dependencies. The hash is computed
+    once per process: the modules are already loaded, so later changes to their files do
+    not change the compiler of this process.
+    """
+    k = tuple(modules)
+    if k not in _SOURCE_HASHES:
+        h = hashlib.sha256()
+        for f in sourceFiles(modules):
+            h.update(os.path.relpath(f, _SRC_ROOT).encode())
+            with open(f, 'rb') as fh:
+                h.update(hashlib.sha256(fh.read()).digest())
+        _SOURCE_HASHES[k] = h.hexdigest()
+    return _SOURCE_HASHES[k]
+
+def cacheKey(srcFile: str, modules: list[str], options: dict[str, Any]) -> str:
+    h = hashlib.sha256()
+    with open(srcFile, 'rb') as f:
+        h.update(hashlib.sha256(f.read()).digest())
+    h.update(sourceHash(modules).encode())
+    h.update(json.dumps(options, sort_keys=True).encode())
+    h.update(sys.version.encode())
+    return h.hexdigest()
+
+@dataclass(frozen=True)
+class Entry:
+    exitcode: int
+    stderr: str
+    error: Optional[str] # (the message of a compile error)
+    files: dict[str, str] # (maps the extension of an output file to the file in the cache)
+
+class CompileCache:
+    def __init__(self, dir: str, maxSize: int):
+        self.dir = dir
+        self.maxSize = maxSize
+
+    def lookup(self, key: str) -> Optional[Entry]:
+        entryDir = os.path.join(self.dir, key)
+        meta = os.path.join(entryDir, 'meta.json')
+        try:
+            with open(meta, 'r') as f:
+                d = json.load(f)
+            os.utime(meta)
+        except (OSError, ValueError):
+            return None
+        files = {ext: os.path.join(entryDir, 'out' + ext) for ext in d['files']}
+        log.info(f'Compile cache hit for key {key}')
+        return Entry(d['exitcode'], d['stderr'], d['error'], files)
+
+    def store(self, key: str, exitcode: int, stderr: str, error: Optional[str], files: dict[str, str]):
+        """
+        Adds an entry, files maps extensions to the output files to copy into the cache.
+        """
+        os.makedirs(self.dir, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=self.dir, prefix='.tmp-')
+        try:
+            for ext, f in files.items():
+                shutil.copyfile(f, os.path.join(tmp, 'out' + ext))
+            with open(os.path.join(tmp, 'meta.json'), 'w') as fh:
+                json.dump({'exitcode': exitcode, 'stderr': stderr, 'error': error,
+                           'files': sorted(files)}, fh)
+            os.rename(tmp, os.path.join(self.dir, key))
+        except OSError:
+            # Another process stored the same entry in the meantime.
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.evict()
+
+    def evict(self):
+        entries: list[tuple[float, int, str]] = []
+        for name in os.listdir(self.dir):
+            entryDir = os.path.join(self.dir, name)
+            try:
+                atime = os.path.getmtime(os.path.join(entryDir, 'meta.json'))
+                size = sum([os.path.getsize(os.path.join(entryDir, f)) for f in os.listdir(entryDir)])
+            except OSError:
+                continue
+            entries.append((atime, size, entryDir))
+        total = sum([size for (_, size, _) in entries])
+        for (_, size, entryDir) in sorted(entries):
+            if total <= self.maxSize:
+                break
+            shutil.rmtree(entryDir, ignore_errors=True)
+            total -= size
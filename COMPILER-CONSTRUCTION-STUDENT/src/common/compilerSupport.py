@@ -16,22 +16,46 @@ def wasmImports(maxMemSize: int) -> list[WasmImport]: return [
     WasmImport("env", "input_i64", WasmImportFunc(WasmId("$input_i64"), [], 'i64'))
 ]
 
+def calledFuncs(instrs: list[WasmInstr]) -> set[WasmId]:
+    """
+    Returns the functions called directly by instrs, including nested instructions.
+    """
+    result: set[WasmId] = set()
+    for i in instrs:
+        match i:
+            case WasmInstrCall(id):
+                result.add(id)
+            case WasmInstrIf(_, thenInstrs, elseInstrs):
+                result |= calledFuncs(thenInstrs) | calledFuncs(elseInstrs)
+            case WasmInstrLoop(_, body) | WasmInstrBlock(_, _, body):
+                result |= calledFuncs(body)
+            case _:
+                pass
+    return result
+
 class CompileError(Exception):
     def __init__(self, prefix: str, msg: str):
         super().__init__(prefix + ': ' + msg)
     @staticmethod
     def typeError(msg: str) -> CompileError:
         return CompileError('type error', msg)
-    def displayAndDie(self) -> Never:
+    def message(self) -> str:
         lines = traceback.format_exception(self)
-        msg = 'Compile error: ' + str(self) + '\n' + ''.join(lines)
-        log.error(msg)
+        return 'Compile error: ' + str(self) + '\n' + ''.join(lines)
+    def displayAndDie(self) -> Never:
+        log.error(self.message())
         sys.exit(constants.COMPILE_ERROR_EXIT_CODE)
 
 @dataclass(frozen=True)
 class CompilerConfig:
     maxMemSize: int   # (in pages of size 64kb)
     defaultMaxMemSize = (100 * 1024) // 64  # 100MB
+    pageSize = 64 * 1024
     maxArraySize: int # (in bytes)
     defaultMaxArraySize = 50 * 1024 * 1024 # 50MB
+    gc: bool = True   # (free unreachable arrays, only for languages with arrays)
+    inlineFastPath: bool = True # (inline allocations and bounds checks instead of calling
+                                # runtime functions, only for languages with arrays)
+    inlineCalls: bool = True # (inline calls of small functions, only for lang_fun)
+    tailCalls: bool = True # (turn self tail calls into loops, only for lang_fun)
 
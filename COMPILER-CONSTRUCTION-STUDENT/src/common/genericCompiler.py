@@ -1,29 +1,58 @@
 from __future__ import annotations
+import common.compileCache as compileCache
+import common.constants as constants
 import common.genericParser as parser
 import common.log as log
 from typing import *
 from dataclasses import dataclass
 from common.wasm import *
+import common.wasmBinary as wasmBinary
+import common.watWriter as watWriter
+import common.peephole as peephole
 import common.sexp as sexp
 import common.utils as utils
 from common.compilerSupport import CompilerConfig
 import common.compilerSupport as compilerSupport
+import dataclasses
 import shell
+import shutil
+import sys
 
 type CompileFun = Callable[[Any, CompilerConfig], WasmModule]
 
-def compileToWat(compileFun: CompileFun, astMod: Any, cfg: CompilerConfig,
-                 input: str, output: str) -> WasmModule:
+def compileToWasmModule(compileFun: CompileFun, astMod: Any, cfg: CompilerConfig, input: str,
+                        onError: Callable[[compilerSupport.CompileError], None] = lambda _: None
+                        ) -> WasmModule:
+    """
+    Parses and compiles input. A compile error is passed to onError and then displayed,
+    which terminates the program.
+    """
     ast = parser.parseFile(input, astMod)
     log.info(f'Compiling AST with {compileFun}')
     try:
-        wasmMod = compileFun(ast, cfg)
+        return compileFun(ast, cfg)
     except compilerSupport.CompileError as e:
+        onError(e)
         e.displayAndDie()
-    code = sexp.renderSExp(wasmMod.render())
-    utils.writeTextFile(output, code)
+
+def writeWat(wasmMod: WasmModule, output: str, pretty: bool = False):
+    """
+    Writes the textual representation of wasmMod. By default, the module is streamed
+    to the file with a fixed layout. With pretty=True, the layout is chosen by the
+    prettyprinter, which needs much more time and memory for large modules.
+    """
+    if pretty:
+        code = sexp.renderSExp(wasmMod.render())
+        utils.writeTextFile(output, code)
+    else:
+        with open(output, 'w') as f:
+            watWriter.writeModule(wasmMod, f)
     log.info(f'Wrote textual representation of wasm to {output}')
-    return wasmMod
+
+def writeWasm(wasmMod: WasmModule, output: str):
+    with open(output, 'wb') as f:
+        f.write(wasmBinary.encodeModule(wasmMod))
+    log.info(f'Wrote binary representation of wasm to {output}')
 
 def wat2wasm(wat2wasmCmd: str, input: str, output: str):
     cmd = [wat2wasmCmd, '--output=' + output, input]
@@ -37,24 +66,99 @@ def wat2wasm(wat2wasmCmd: str, input: str, output: str):
 class Args:
     input: str
     output: str
-    wat2wasm: str = 'wat2wasm'
+    wat2wasm: Optional[str] = None # use the builtin encoder if None
     maxMemSize: Optional[int] = None
     maxArraySize: Optional[int] = None
     maxRegisters: Optional[int] = None
+    gc: bool = True
+    inlineFastPath: bool = True
+    inlineCalls: bool = True
+    tailCalls: bool = True
+    emitWat: bool = True
+    prettyWat: bool = False
+    optLevel: int = peephole.defaultOptLevel
+    optStats: bool = False
+    compileCache: Optional[str] = None # (directory of the compile cache, None disables it)
+    compileCacheSize: int = 100 * 1024 * 1024 # (in bytes)
+
+def cacheOptions(args: Args, outputExt: str) -> dict[str, Any]:
+    """
+    The options that influence the result of compileMain, as part of the cache key.
+    """
+    d = dataclasses.asdict(args)
+    for k in ['input', 'output', 'compileCache', 'compileCacheSize']:
+        del d[k]
+    d['outputExt'] = outputExt
+    return d
 
-def compileMain(args: Args, compileFun: CompileFun, astMod: Any) -> WasmModule:
+def replayCacheEntry(entry: compileCache.Entry, outputBase: str) -> bool:
+    """
+    Writes the output files of entry and repeats its output on stderr and its exit
+    code. Returns False if the entry has been evicted in the meantime.
+    """
+    try:
+        for ext, f in entry.files.items():
+            shutil.copyfile(f, outputBase + ext)
+    except OSError:
+        return False
+    sys.stderr.write(entry.stderr)
+    if entry.error is not None:
+        log.error(entry.error)
+    if entry.exitcode != 0:
+        sys.exit(entry.exitcode)
+    return True
+
+def compileMain(args: Args, compileFun: CompileFun, astMod: Any) -> Optional[WasmModule]:
+    """
+    Compiles args.input, writes the output files and returns the compiled module. If
+    args.compileCache is given, the result of an earlier compilation with the same
+    source, compiler and options is reused if possible (see common.compileCache). The
+    module is then not built again, and None is returned. Compilations using an external
+    wat2wasm are not cached.
+    """
     output = args.output
     outputBase, outputExt = shell.splitExt(output)
     outputWat = outputBase + '.wat'
     if outputExt not in ['.wat', '.wasm', '.as']:
         utils.abort(f'Extension of output file must be .wat or .wasm or .as')
+    cache = None
+    key = ''
+    if args.compileCache and not args.wat2wasm:
+        cache = compileCache.CompileCache(args.compileCache, args.compileCacheSize)
+        modules = [compileFun.__module__, astMod.__name__, __name__]
+        key = compileCache.cacheKey(args.input, modules, cacheOptions(args, outputExt))
+        entry = cache.lookup(key)
+        if entry is not None and replayCacheEntry(entry, outputBase):
+            return None
     cfg = CompilerConfig(maxMemSize=args.maxMemSize or CompilerConfig.defaultMaxMemSize,
-                         maxArraySize=args.maxArraySize or CompilerConfig.defaultMaxArraySize)
-    wasmMod = compileToWat(compileFun, astMod, cfg, args.input, outputWat)
+                         maxArraySize=args.maxArraySize or CompilerConfig.defaultMaxArraySize,
+                         gc=args.gc, inlineFastPath=args.inlineFastPath,
+                         inlineCalls=args.inlineCalls, tailCalls=args.tailCalls)
+    def storeError(e: compilerSupport.CompileError):
+        if cache:
+            cache.store(key, constants.COMPILE_ERROR_EXIT_CODE, '', e.message(), {})
+    wasmMod = compileToWasmModule(compileFun, astMod, cfg, args.input, storeError)
+    stats = peephole.Stats()
+    wasmMod = peephole.optimizeModule(wasmMod, args.optLevel, stats)
+    stderr = ''
+    if args.optStats:
+        stderr = f'Peephole stats: {stats}\n'
+        sys.stderr.write(stderr)
+    written: dict[str, str] = {}
     if outputExt == '.wat':
-        return wasmMod
-    outputBin = outputBase + '.wasm'
-    wat2wasm(args.wat2wasm, outputWat, outputBin)
+        writeWat(wasmMod, outputWat, args.prettyWat)
+        written['.wat'] = outputWat
+    else:
+        outputBin = outputBase + '.wasm'
+        if args.wat2wasm:
+            writeWat(wasmMod, outputWat, args.prettyWat)
+            wat2wasm(args.wat2wasm, outputWat, outputBin)
+            return wasmMod
+        if args.emitWat:
+            writeWat(wasmMod, outputWat, args.prettyWat)
+            written['.wat'] = outputWat
+        writeWasm(wasmMod, outputBin)
+        written['.wasm'] = outputBin
+    if cache:
+        cache.store(key, 0, stderr, None, written)
     return wasmMod
-
-
@@ -8,15 +8,29 @@ from dataclasses import dataclass
 import traceback
 import sys
 
+@dataclass(frozen=True)
+class InterpConfig:
+    gcThreshold: Optional[int] = None # (in bytes, None disables the garbage collector)
+    defaultGcThreshold = 1024 * 1024 # 1MB
+    gcStats: bool = False
+    inlineCalls: bool = False # (only lang_fun)
+    tailCalls: bool = True # (only lang_fun)
+    memoize: bool = False # (only lang_fun)
+    memoSize: int = 10000 # (maximal number of cached results)
+    memoStats: bool = False
+
 @dataclass(frozen=True)
 class Args:
     filename: str
+    cfg: InterpConfig = InterpConfig()
+
+type InterpFun = Callable[[Any, InterpConfig], None]
 
-def interpMain(args: Args, interpFun: Callable[[Any], None], astMod: Any):
+def interpMain(args: Args, interpFun: InterpFun, astMod: Any):
     ast = parser.parseFile(args.filename, astMod)
     log.info(f'Interpreting AST with {interpFun} from file {inspect.getmodule(interpFun)}')
     try:
-        interpFun(ast)
+        interpFun(ast, args.cfg)
     except compilerSupport.CompileError as e:
         e.displayAndDie()
     except Exception:
@@ -0,0 +1,151 @@
+"""
+The store of the tree and closure interpreters of lang_array and lang_fun: the heap
+holding all arrays, with an optional mark-and-sweep garbage collector.
+"""
+from __future__ import annotations
+from typing import *
+from dataclasses import dataclass
+import common.log as log
+import array
+import sys
+
+def _noArithmetic(self: Address, *_: Any) -> NoReturn:
+    raise TypeError(f'{self!r} is not an int')
+
+class Address(int):
+    """
+    An address is the index of an array in Store.content. Subclassing int keeps
+    addresses cheap to create, compare and hash while still distinguishing them from
+    int values. Arithmetic and ordering raise a TypeError, so that an address is never
+    used as an int (python tries the reflected operator of the subclass first, so
+    this also holds for `1 + a`).
+    """
+    __add__ = __radd__ = __sub__ = __rsub__ = __mul__ = __rmul__ = _noArithmetic
+    __neg__ = __lt__ = __le__ = __gt__ = __ge__ = _noArithmetic
+    def __repr__(self):
+        return f'Address({int(self)})'
+
+type StoreValue[V] = array.array[int] | bytearray | list[V]
+
+def mkStoreValue[V](vals: list[V]) -> StoreValue[V]:
+    """
+    Returns the most compact representation of the given array: an array('q') for int
+    arrays, a bytearray for bool arrays, and a plain list otherwise. Int values are
+    unbounded in the interpreter, so int arrays with values beyond 64 bits remain lists.
+    """
+    if vals and type(vals[0]) is bool:
+        return bytearray(cast(list[bool], vals))
+    elif vals and type(vals[0]) is int:
+        try:
+            return array.array('q', cast(list[int], vals))
+        except OverflowError:
+            pass
+    return vals
+
+def mkFilledStoreValue[V](n: int, v: V) -> StoreValue[V]:
+    if type(v) is bool:
+        return bytearray([v]) * n
+    elif type(v) is int and -2**63 <= v < 2**63:
+        return array.array('q', [v]) * n
+    else:
+        return n * [v]
+
+def storeValueSize[V](v: StoreValue[V]) -> int:
+    """
+    Returns the size of the array in bytes: 1 byte per bool, 8 bytes per other value.
+    """
+    match v:
+        case array.array():
+            return len(v) * v.itemsize
+        case bytearray():
+            return len(v)
+        case _:
+            return 8 * len(v)
+
+@dataclass
+class GcStats:
+    collections: int = 0
+    bytesFreed: int = 0
+    peakLive: int = 0 # (in bytes)
+    def __str__(self):
+        return f'collections: {self.collections}, bytes freed: {self.bytesFreed}, ' \
+            f'peak live bytes: {self.peakLive}'
+
+class Store[V]:
+    """
+    Holds all arrays of the program, indexed by their address.
+
+    If a gcThreshold is given, collect() runs a mark-and-sweep garbage collection
+    whenever at least gcThreshold bytes have been allocated since the last collection.
+    The roots are the values returned by roots(), which the interpreters override.
+    Addresses of freed arrays are reused for new arrays.
+    """
+    def __init__(self, gcThreshold: Optional[int] = None):
+        self.content: list[Optional[StoreValue[V]]] = []
+        self.gcThreshold = gcThreshold if gcThreshold is not None else sys.maxsize
+        self.gcStats = GcStats()
+        self.allocatedSinceGc = 0
+        self.__live = 0
+        self.__free: list[int] = []
+    def __add(self, v: StoreValue[V]) -> Address:
+        size = storeValueSize(v)
+        self.allocatedSinceGc += size
+        self.__live += size
+        self.gcStats.peakLive = max(self.gcStats.peakLive, self.__live)
+        if self.__free:
+            a = self.__free.pop()
+            self.content[a] = v
+            return Address(a)
+        self.content.append(v)
+        return Address(len(self.content) - 1)
+    def alloc(self, vals: list[V]) -> Address:
+        return self.__add(mkStoreValue(vals))
+    def allocFilled(self, n: int, v: V) -> Address:
+        return self.__add(mkFilledStoreValue(n, v))
+    def resolve(self, a: Address) -> StoreValue[V]:
+        l = self.content[a]
+        assert l is not None
+        return l
+    def load(self, a: Address, i: int) -> V:
+        l: Any = self.resolve(a)
+        if type(l) is bytearray:
+            return cast(V, bool(l[i]))
+        return l[i]
+    def storeValue(self, a: Address, i: int, v: V):
+        l: Any = self.resolve(a)
+        try:
+            l[i] = v
+        except OverflowError:
+            # v does not fit into an array('q'), fall back to a list
+            l = list(l)
+            l[i] = v
+            self.content[a] = l
+    def roots(self) -> Iterable[V]:
+        return []
+    def maybeCollect(self):
+        if self.allocatedSinceGc >= self.gcThreshold:
+            self.collect()
+    def collect(self):
+        marked = bytearray(len(self.content))
+        todo = [v for v in self.roots() if type(v) is Address]
+        while todo:
+            a = todo.pop()
+            if marked[a]:
+                continue
+            marked[a] = 1
+            l = self.content[a]
+            if type(l) is list:
+                todo.extend([v for v in l if type(v) is Address])
+        freed = 0
+        for a, l in enumerate(self.content):
+            if l is not None and not marked[a]:
+                freed += storeValueSize(l)
+                self.content[a] = None
+                self.__free.append(a)
+        self.__live -= freed
+        self.allocatedSinceGc = 0
+        self.gcStats.collections += 1
+        self.gcStats.bytesFreed += freed
+        log.debug(f'Garbage collection freed {freed} bytes, {self.__live} bytes live')
+    def __repr__(self):
+        return f'Store({self.content})'
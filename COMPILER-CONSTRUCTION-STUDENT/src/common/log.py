@@ -39,8 +39,9 @@ def resolveLevelName(s: str) -> int:
 def removeAllHandlers(log: logging.Logger):
     for h in log.handlers[:]:
         log.removeHandler(h)
+        h.close()
 
-def init(level: int, filename: str):
+def init(level: int, filename: str|None):
     global _log
     if _log:
         removeAllHandlers(_log)
@@ -0,0 +1,265 @@
+"""
+Peephole optimizer for wasm code, running between code generation and writing the module.
+
+The optimizer slides over every instruction list of a function, including the bodies of
+if, loop and block. At each position, it tries the rules enabled for the optimization
+level in order. A rule looks at the instructions starting at the current position and
+either returns None or a pair (n, replacement), meaning that the next n instructions are
+replaced. After a replacement, the optimizer steps back a few instructions, so that rules
+can match on the result of other rules.
+
+Optimization levels:
+
+0: no optimizations
+1: rewrites that only change the shape of the code (local.tee, br_if, dead code)
+2: additionally constant folding and simplifications of arithmetic
+"""
+from __future__ import annotations
+from typing import *
+from dataclasses import dataclass
+from common.wasm import *
+
+type RuleMatch = Optional[tuple[int, list[WasmInstr]]]
+type RuleFun = Callable[[list[WasmInstr], int], RuleMatch]
+
+@dataclass(frozen=True)
+class Rule:
+    name: str
+    minLevel: int
+    apply: RuleFun
+
+defaultOptLevel = 1
+maxOptLevel = 2
+# A rule looks at no more than this number of instructions before the position where it matches.
+backtrack = 3
+
+class Stats:
+    """
+    Number of hits for each rule.
+    """
+    def __init__(self):
+        self.hits: dict[str, int] = {}
+    def hit(self, r: Rule):
+        self.hits[r.name] = self.hits.get(r.name, 0) + 1
+    def total(self) -> int:
+        return sum(self.hits.values())
+    def __str__(self):
+        if not self.hits:
+            return 'no rule applied'
+        return ', '.join([f'{r}: {n}' for r, n in sorted(self.hits.items())])
+
+def at(instrs: list[WasmInstr], i: int) -> Optional[WasmInstr]:
+    return instrs[i] if i < len(instrs) else None
+
+# Rules
+
+def setGetToTee(instrs: list[WasmInstr], i: int) -> RuleMatch:
+    """
+    local.set x; local.get x  ==>  local.tee x
+    """
+    match (instrs[i], at(instrs, i + 1)):
+        case (WasmInstrVarLocal('set', x), WasmInstrVarLocal('get', y)) if x == y:
+            return (2, [WasmInstrVarLocal('tee', x)])
+        case _:
+            return None
+
+def teeDropToSet(instrs: list[WasmInstr], i: int) -> RuleMatch:
+    """
+    local.tee x; drop  ==>  local.set x
+    """
+    match (instrs[i], at(instrs, i + 1)):
+        case (WasmInstrVarLocal('tee', x), WasmInstrDrop()):
+            return (2, [WasmInstrVarLocal('set', x)])
+        case _:
+            return None
+
+def pureDrop(instrs: list[WasmInstr], i: int) -> RuleMatch:
+    """
+    local.get x; drop  ==>  (nothing), same for constants and global.get
+    """
+    match (instrs[i], at(instrs, i + 1)):
+        case (WasmInstrVarLocal('get', _) | WasmInstrVarGlobal('get', _) | WasmInstrConst(),
+              WasmInstrDrop()):
+            return (2, [])
+        case _:
+            return None
+
+negatedRelOps: dict[str, WasmIntRelOp] = {
+    'eq': 'ne', 'ne': 'eq',
+    'lt_s': 'ge_s', 'ge_s': 'lt_s', 'gt_s': 'le_s', 'le_s': 'gt_s',
+    'lt_u': 'ge_u', 'ge_u': 'lt_u', 'gt_u': 'le_u', 'le_u': 'gt_u'
+}
+
+def ifToBrIf(instrs: list[WasmInstr], i: int) -> RuleMatch:
+    """
+    if br L else end  ==>  br_if L
+    c; if else br L end  ==>  (negation of c); br_if L
+    if else br L end  ==>  i32.const 0; i32.eq; br_if L
+    (the if has no result and no label, so L refers to the same block afterwards)
+    """
+    match (instrs[i], at(instrs, i + 1)):
+        case (WasmInstrIf(None, [WasmInstrBranch(l, False)], []), _):
+            return (1, [WasmInstrBranch(l, True)])
+        case (WasmInstrIntRelOp(ty, op), WasmInstrIf(None, [], [WasmInstrBranch(l, False)])):
+            return (2, [WasmInstrIntRelOp(ty, negatedRelOps[op]), WasmInstrBranch(l, True)])
+        case (WasmInstrIf(None, [], [WasmInstrBranch(l, False)]), _):
+            return (1, [WasmInstrConst('i32', 0), WasmInstrIntRelOp('i32', 'eq'),
+                        WasmInstrBranch(l, True)])
+        case _:
+            return None
+
+def deadCode(instrs: list[WasmInstr], i: int) -> RuleMatch:
+    """
+    Removes all instructions following unreachable, br or return in the same instruction list.
+    """
+    match instrs[i]:
+        case WasmInstrTrap() | WasmInstrReturn() | WasmInstrBranch(_, False) if i + 1 < len(instrs):
+            return (len(instrs) - i, [instrs[i]])
+        case _:
+            return None
+
+def wrap(ty: WasmValtype, n: int) -> int:
+    """
+    Wraps n to the range of the signed integer type ty.
+    """
+    bits = 32 if ty == 'i32' else 64
+    n &= (1 << bits) - 1
+    return n - (1 << bits) if n >= 1 << (bits - 1) else n
+
+def unsigned(ty: WasmValtype, n: int) -> int:
+    return n & ((1 << (32 if ty == 'i32' else 64)) - 1)
+
+def evalBinOp(ty: WasmValtype, op: str, x: int, y: int) -> int:
+    match op:
+        case 'add': return wrap(ty, x + y)
+        case 'sub': return wrap(ty, x - y)
+        case 'mul': return wrap(ty, x * y)
+        case 'and': return wrap(ty, x & y)
+        case 'xor': return wrap(ty, x ^ y)
+        case 'shl': return wrap(ty, x << (unsigned(ty, y) % (32 if ty == 'i32' else 64)))
+        case _: # shr_u
+            return wrap(ty, unsigned(ty, x) >> (unsigned(ty, y) % (32 if ty == 'i32' else 64)))
+
+def evalRelOp(ty: WasmValtype, op: str, x: int, y: int) -> bool:
+    if op.endswith('_u'):
+        (x, y) = (unsigned(ty, x), unsigned(ty, y))
+    match op[:2]:
+        case 'eq': return x == y
+        case 'ne': return x != y
+        case 'lt': return x < y
+        case 'le': return x <= y
+        case 'gt': return x > y
+        case _: return x >= y
+
+def foldConstants(instrs: list[WasmInstr], i: int) -> RuleMatch:
+    """
+    c1; c2; op  ==>  (c1 op c2) for integer constants and binary or relational operators
+    c; i32.wrap_i64  ==>  (wrapped c), same for extending c
+    """
+    a = instrs[i]
+    b = at(instrs, i + 1)
+    if not isinstance(a, WasmInstrConst) or not isinstance(a.val, int):
+        return None
+    x = a.val
+    match (b, at(instrs, i + 2)):
+        case (WasmInstrConst(ty, y), WasmInstrNumBinOp(ty2, op)) \
+                if ty == a.ty == ty2 and ty in ['i32', 'i64'] and isinstance(y, int):
+            return (3, [WasmInstrConst(ty, evalBinOp(ty, op, x, y))])
+        case (WasmInstrConst(ty, y), WasmInstrIntRelOp(ty2, op)) \
+                if ty == a.ty == ty2 and isinstance(y, int):
+            return (3, [WasmInstrConst('i32', int(evalRelOp(ty, op, x, y)))])
+        case (WasmInstrConvOp('i32.wrap_i64'), _) if a.ty == 'i64':
+            return (2, [WasmInstrConst('i32', wrap('i32', x))])
+        case (WasmInstrConvOp('i64.extend_i32_s'), _) if a.ty == 'i32':
+            return (2, [WasmInstrConst('i64', wrap('i32', x))])
+        case (WasmInstrConvOp('i64.extend_i32_u'), _) if a.ty == 'i32':
+            return (2, [WasmInstrConst('i64', unsigned('i32', x))])
+        case _:
+            return None
+
+def neutralOperand(instrs: list[WasmInstr], i: int) -> RuleMatch:
+    """
+    i32.const 0; i32.add  ==>  (nothing), same for sub, xor, shifts, and for mul with 1
+    """
+    match (instrs[i], at(instrs, i + 1)):
+        case (WasmInstrConst(ty, 0), WasmInstrNumBinOp(ty2, 'add' | 'sub' | 'xor' | 'shl' | 'shr_u')) \
+                if ty == ty2 and ty in ['i32', 'i64']:
+            return (2, [])
+        case (WasmInstrConst(ty, 1), WasmInstrNumBinOp(ty2, 'mul')) \
+                if ty == ty2 and ty in ['i32', 'i64']:
+            return (2, [])
+        case _:
+            return None
+
+def constantIf(instrs: list[WasmInstr], i: int) -> RuleMatch:
+    """
+    i32.const c; if A else B end  ==>  A if c is not 0, B otherwise
+    (the if has no label, so the branch targets in A and B are not affected)
+    """
+    match (instrs[i], at(instrs, i + 1)):
+        case (WasmInstrConst('i32', c), WasmInstrIf(_, thenInstrs, elseInstrs)) if isinstance(c, int):
+            return (2, thenInstrs if c != 0 else elseInstrs)
+        case _:
+            return None
+
+rules: list[Rule] = [
+    Rule('deadCode', 1, deadCode),
+    Rule('setGetToTee', 1, setGetToTee),
+    Rule('teeDropToSet', 1, teeDropToSet),
+    Rule('pureDrop', 1, pureDrop),
+    Rule('ifToBrIf', 1, ifToBrIf),
+    Rule('foldConstants', 2, foldConstants),
+    Rule('neutralOperand', 2, neutralOperand),
+    Rule('constantIf', 2, constantIf)
+]
+
+# Framework
+
+def optimizeInstrs(instrs: list[WasmInstr], rs: list[Rule], stats: Stats) -> list[WasmInstr]:
+    """
+    Applies the rules rs to instrs and to all nested instruction lists.
+    """
+    result: list[WasmInstr] = [optimizeNested(x, rs, stats) for x in instrs]
+    i = 0
+    while i < len(result):
+        for r in rs:
+            m = r.apply(result, i)
+            if m is not None:
+                (n, replacement) = m
+                stats.hit(r)
+                # replacements may contain nested lists that were optimized before
+                result[i:i+n] = replacement
+                i = max(0, i - backtrack)
+                break
+        else:
+            i += 1
+    return result
+
+def optimizeNested(instr: WasmInstr, rs: list[Rule], stats: Stats) -> WasmInstr:
+    match instr:
+        case WasmInstrIf(result, thenInstrs, elseInstrs):
+            return WasmInstrIf(result, optimizeInstrs(thenInstrs, rs, stats),
+                               optimizeInstrs(elseInstrs, rs, stats))
+        case WasmInstrLoop(label, body):
+            return WasmInstrLoop(label, optimizeInstrs(body, rs, stats))
+        case WasmInstrBlock(label, result, body):
+            return WasmInstrBlock(label, result, optimizeInstrs(body, rs, stats))
+        case _:
+            return instr
+
+def rulesForLevel(level: int) -> list[Rule]:
+    return [r for r in rules if r.minLevel <= level]
+
+def optimizeModule(m: WasmModule, level: int, stats: Optional[Stats] = None) -> WasmModule:
+    """
+    Returns the module with the peephole rules of the given optimization level applied to
+    all functions. The hits of the rules are counted in stats.
+    """
+    if stats is None:
+        stats = Stats()
+    rs = rulesForLevel(level)
+    if not rs:
+        return m
+    funcs = [WasmFunc(f.id, f.params, f.result, f.locals, optimizeInstrs(f.instrs, rs, stats))
+             for f in m.funcs]
+    return WasmModule(m.imports, m.exports, m.globals, m.data, m.funcTable, funcs)
@@ -0,0 +1,167 @@
+"""
+A server that runs commands of main.py in a single long-running process, so that the
+modules and parsers are imported only once for many compiles (`main.py serve`).
+
+The protocol consists of JSON lines. A request has the form
+
+    {"args": ["--lang=fun", "interp", "test_files/lang_fun/fib.py"], "input": "10\\n", "id": 1}
+
+where args are the command-line arguments of main.py (only some commands are allowed),
+input is the optional content of stdin, and id is an optional value copied into the
+response. The response has the form
+
+    {"id": 1, "exitcode": 0, "stdout": "...", "stderr": "..."}
+
+with the exit code, stdout and stderr the command would have had when run through the
+command line. Relative paths are resolved against the working directory of the server.
+
+Requests are handled one after the other, because the standard streams are replaced
+while a command runs. Run one server per worker to handle requests in parallel.
+Output of subprocesses (for example wat2wasm) is not captured, it goes to the stderr of
+the server.
+"""
+from typing import *
+import common.log as log
+import contextlib
+import io
+import json
+import os
+import select
+import shell
+import socket
+import socketserver
+import subprocess
+import sys
+import traceback
+
+type RunCommand = Callable[[list[str]], None]
+
+def runCaptured(run: Callable[[], None], input: str|None) -> shell.RunResult:
+    """
+    Calls run with stdin set to input and stdout and stderr captured. SystemExit becomes
+    the exit code, other exceptions print a traceback and yield exit code 1.
+    """
+    out = io.StringIO()
+    err = io.StringIO()
+    oldStdin = sys.stdin
+    sys.stdin = io.StringIO(input or '')
+    try:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            try:
+                run()
+                exitcode = 0
+            except SystemExit as e:
+                match e.code:
+                    case None:
+                        exitcode = 0
+                    case int(code):
+                        exitcode = code
+                    case msg:
+                        print(msg, file=sys.stderr)
+                        exitcode = 1
+            except Exception:
+                traceback.print_exc()
+                exitcode = 1
+    finally:
+        sys.stdin = oldStdin
+    return shell.RunResult(out.getvalue(), err.getvalue(), exitcode)
+
+def handleRequest(runCommand: RunCommand, line: str) -> str:
+    """
+    Handles a single request, returns the response (without a newline).
+    """
+    try:
+        req = json.loads(line)
+        argv = req['args']
+        input = req.get('input')
+        if not (isinstance(argv, list) and all([isinstance(a, str) for a in cast(list[Any], argv)])):
+            raise ValueError('args must be a list of strings')
+        if not (input is None or isinstance(input, str)):
+            raise ValueError('input must be a string')
+    except (ValueError, KeyError, TypeError) as e:
+        res = shell.RunResult('', f'ERROR: invalid request: {e}\n', 1)
+        return json.dumps({'id': None, 'exitcode': res.exitcode, 'stdout': res.stdout,
+                           'stderr': res.stderr})
+    res = runCaptured(lambda: runCommand(cast(list[str], argv)), input)
+    return json.dumps({'id': req.get('id'), 'exitcode': res.exitcode, 'stdout': res.stdout,
+                       'stderr': res.stderr})
+
+def serveStream(runCommand: RunCommand, rfile: IO[str], wfile: IO[str]):
+    """
+    Handles requests read from rfile until it is closed.
+    """
+    for line in rfile:
+        if not line.strip():
+            continue
+        wfile.write(handleRequest(runCommand, line) + '\n')
+        wfile.flush()
+
+def serveSocket(runCommand: RunCommand, path: str):
+    """
+    Listens on a unix socket, every connection may send any number of requests.
+    """
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            sock: socket.socket = self.request
+            with sock.makefile('r', encoding='utf-8') as rfile, \
+                    sock.makefile('w', encoding='utf-8') as wfile:
+                serveStream(runCommand, rfile, wfile)
+    if os.path.exists(path):
+        os.remove(path)
+    with socketserver.UnixStreamServer(path, Handler) as server:
+        log.info(f'Listening on {path}')
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(path)
+
+def serve(runCommand: RunCommand, socketPath: str|None):
+    if socketPath:
+        serveSocket(runCommand, socketPath)
+    else:
+        # Neither commands nor their subprocesses may write to the stream carrying the
+        # responses, so file descriptor 1 becomes a copy of stderr.
+        responses = os.fdopen(os.dup(1), 'w', encoding='utf-8')
+        sys.stdout.flush()
+        os.dup2(2, 1)
+        serveStream(runCommand, sys.stdin, responses)
+
+class Client:
+    """
+    Starts `main.py serve` as a subprocess and sends requests to it over stdin/stdout.
+    If a request takes longer than timeout seconds, the server is killed and restarted,
+    and the result has exit code 124 (like the timeout command).
+    """
+    def __init__(self, timeout: float|None = None):
+        self.timeout = timeout
+        self.proc: Optional[subprocess.Popen[str]] = None
+    def start(self) -> subprocess.Popen[str]:
+        if self.proc is None:
+            self.proc = subprocess.Popen([sys.executable, 'src/main.py', 'serve'],
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         text=True, encoding='utf-8')
+        return self.proc
+    def run(self, argv: list[str], input: str|None = None) -> shell.RunResult:
+        proc = self.start()
+        assert proc.stdin is not None and proc.stdout is not None
+        proc.stdin.write(json.dumps({'args': argv, 'input': input}) + '\n')
+        proc.stdin.flush()
+        (ready, _, _) = select.select([proc.stdout], [], [], self.timeout)
+        if not ready:
+            self.close()
+            return shell.RunResult('', f'Command {argv} timed out after {self.timeout}s\n', 124)
+        line = proc.stdout.readline()
+        if not line:
+            self.close()
+            raise Exception(f'Server terminated with exit code {proc.returncode}')
+        res = json.loads(line)
+        return shell.RunResult(res['stdout'], res['stderr'], res['exitcode'])
+    def close(self):
+        if self.proc is not None:
+            self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+    def __enter__(self):
+        return self
+    def __exit__(self, *_: Any):
+        self.close()
@@ -1,44 +1,112 @@
 import shell
 from typing import *
+from concurrent.futures import Future, ProcessPoolExecutor
+import contextlib
+import importlib
+import multiprocessing
 import os
+import signal
 import common.utils as utils
 import common.log as log
+import common.server as server
 import threading
 import common.constants as constants
 
 _CACHE_DIR = '.test_cache'
-_CACHE_LOCK = threading.Lock()
+# One lock per source file, so that golden outputs of different files can be computed
+# concurrently. _CACHE_LOCKS_LOCK only protects the dictionary.
+_CACHE_LOCKS: dict[str, threading.Lock] = {}
+_CACHE_LOCKS_LOCK = threading.Lock()
 
 # If IGNORE_HASH is True, the golden file from .test_cache is considered as the only
 # source if truth. This can be useful if you changed test cases but want to make sure
 # that their output is still the same
 IGNORE_HASH = False
 
-def getGolden(srcFile: str, input: str|None):
-    with _CACHE_LOCK:
-        base = shell.removeExt(srcFile)
-        srcMd5 = utils.md5(srcFile)
-        cacheFile = shell.pjoin(_CACHE_DIR, base + '.golden')
-        hashFile = shell.pjoin(_CACHE_DIR, base + '.hash')
-        shell.mkdirs(shell.dirname(cacheFile))
-        if IGNORE_HASH and shell.isFile(cacheFile):
+def cacheLock(srcFile: str) -> threading.Lock:
+    key = os.path.normpath(srcFile)
+    with _CACHE_LOCKS_LOCK:
+        return _CACHE_LOCKS.setdefault(key, threading.Lock())
+
+def cachedGolden(srcFile: str) -> str|None:
+    """
+    Returns the golden output of srcFile from the cache, or None if it is missing or
+    out-of-date.
+    """
+    base = shell.removeExt(srcFile)
+    cacheFile = shell.pjoin(_CACHE_DIR, base + '.golden')
+    hashFile = shell.pjoin(_CACHE_DIR, base + '.hash')
+    if IGNORE_HASH and shell.isFile(cacheFile):
+        return utils.readTextFile(cacheFile).strip()
+    if shell.isFile(cacheFile) and shell.isFile(hashFile):
+        haveMd5 = utils.readTextFile(hashFile).strip()
+        if utils.md5(srcFile) == haveMd5:
             return utils.readTextFile(cacheFile).strip()
-        if shell.isFile(cacheFile) and shell.isFile(hashFile):
-            haveMd5 = utils.readTextFile(hashFile).strip()
-            if srcMd5 == haveMd5:
-                return utils.readTextFile(cacheFile).strip()
+    return None
+
+def storeGolden(srcFile: str, srcMd5: str, golden: str):
+    """
+    Both files are replaced atomically, and the hash is written last. A concurrent reader
+    thus either sees the hash of an older source (and recomputes the output) or a golden
+    output belonging to the hash.
+    """
+    base = shell.removeExt(srcFile)
+    cacheFile = shell.pjoin(_CACHE_DIR, base + '.golden')
+    shell.mkdirs(shell.dirname(cacheFile))
+    utils.writeTextFileAtomic(cacheFile, golden)
+    utils.writeTextFileAtomic(shell.pjoin(_CACHE_DIR, base + '.hash'), srcMd5)
+
+def getGolden(srcFile: str, input: str|None):
+    with cacheLock(srcFile):
+        golden = cachedGolden(srcFile)
+        if golden is not None:
+            return golden
         # We do not have a cache file or it's out-of-date
-        # Be careful to avoid race conditions
+        srcMd5 = utils.md5(srcFile)
         cmd = ['timeout', '10s', 'python', 'src/main.py', 'pyrun', srcFile]
-        log.info('Running command: {" ".join(cmd)}')
+        log.info(f'Running command: {" ".join(cmd)}')
         res = shell.run(cmd, captureStdout=True, input=input, onError='ignore')
         if res.exitcode != 0:
             raise Exception(f'Running test file {srcFile} with python failed!')
         golden = res.stdout.strip()
-        utils.writeTextFile(cacheFile, golden)
-        utils.writeTextFile(hashFile, srcMd5)
+        storeGolden(srcFile, srcMd5, golden)
         return golden
 
+def runPython(srcFile: str, input: str|None) -> tuple[str, shell.RunResult]:
+    """
+    Runs srcFile with `main.py pyrun` in the current process. Returns the hash of the
+    source that was run and the result.
+    """
+    srcMd5 = utils.md5(srcFile)
+    return (srcMd5, runInProcess(['pyrun', srcFile], input, timeout=10))
+
+def regenGoldens(srcFiles: list[str], force: bool = False):
+    """
+    Computes the golden outputs of all srcFiles expecting no error in a pool of worker
+    processes (see testJobs), and stores them in the cache. Unless force is True, only
+    missing or out-of-date golden outputs are computed. Each program runs with its own
+    globals and with stdin redirected from its .in file. If a program fails, nothing is
+    stored, so that getGolden reports the failure for the test.
+    """
+    todo: list[tuple[str, str|None]] = []
+    for f in dict.fromkeys(srcFiles):
+        (hasErr, input, _) = testInputs(f)
+        if not hasErr and (force or cachedGolden(f) is None):
+            todo.append((f, input))
+    if not todo:
+        return
+    log.info(f'Computing {len(todo)} golden outputs with {testJobs()} jobs')
+    if testJobs() <= 1:
+        results = [runPython(f, input) for (f, input) in todo]
+    else:
+        warmUp()
+        with ProcessPoolExecutor(testJobs(), mp_context=multiprocessing.get_context('fork')) as pool:
+            results = list(pool.map(runPython, *utils.unzip(todo)))
+    for (f, _), (srcMd5, res) in zip(todo, results):
+        if res.exitcode == 0:
+            with cacheLock(f):
+                storeGolden(f, srcMd5, res.stdout.strip())
+
 type ErrorKind = Literal['type error', 'run error']
 
 def getExpectedError(srcFile: str) -> Optional[tuple[ErrorKind, str]]:
@@ -68,6 +136,18 @@ def readFileOpt(path: str) -> str|None:
     else:
         return None
 
+def testInputs(srcFile: str) -> tuple[bool, str|None, str|None]:
+    """
+    Returns the arguments runFileTest passes to its run function: whether srcFile expects
+    an error, the content of the .in file and the content of the .args file.
+    """
+    base = shell.removeExt(srcFile)
+    input = readFileOpt(base + ".in")
+    extraArgs = readFileOpt(base + ".args")
+    if extraArgs:
+        extraArgs = extraArgs.strip()
+    return (getExpectedError(srcFile) is not None, input, extraArgs)
+
 # strict: error message must match the one provide in the input file
 # lenient: error message must not match, but the test command must fail
 # skip: tests for errors are skipped
@@ -78,12 +158,7 @@ def runFileTest(srcFile: str,
                 errorMode: ErrorMode = 'strict'):
     if not shell.isFile(srcFile):
         raise Exception(f'Source file {srcFile} does not exist')
-    base = shell.removeExt(srcFile)
-    inFile = base + ".in"
-    input = readFileOpt(inFile)
-    extraArgs = readFileOpt(base + ".args")
-    if extraArgs:
-        extraArgs = extraArgs.strip()
+    (_, input, extraArgs) = testInputs(srcFile)
     err = getExpectedError(srcFile)
     hasErr = err is not None
     log.info(f'Running test on {srcFile}')
@@ -154,3 +229,83 @@ def collectTestFiles(baseDirs: list[str] = ['test_files'],
                 filteredResult.append((lang, file))
         result = filteredResult
     return result
+
+class Timeout(BaseException):
+    """
+    Raised by the alarm of runInProcess. Not an Exception, so that the handlers of the
+    compilers and interpreters do not catch it.
+    """
+    pass
+
+def runInProcess(argv: list[str], input: str|None, timeout: Optional[int] = None) -> shell.RunResult:
+    """
+    Runs src/main.py with the given arguments in the current process, with the same exit
+    code, stdout and stderr as a new process (see server.runCaptured). If the command takes
+    more than timeout seconds, the result has exit code 124, as for the timeout command.
+    """
+    import main
+    def onAlarm(_sig: int, _frame: Any):
+        raise Timeout()
+    oldHandler = signal.signal(signal.SIGALRM, onAlarm)
+    if timeout:
+        signal.alarm(timeout)
+    try:
+        return server.runCaptured(lambda: main.runCommand(main.parseArgs(argv)), input)
+    except Timeout:
+        return shell.RunResult('', f'Command timed out after {timeout}s\n', 124)
+    finally:
+        signal.alarm(0)
+        signal.signal(signal.SIGALRM, oldHandler)
+
+def testJobs() -> int:
+    """
+    The number of worker processes for running tests: the value of the environment
+    variable TEST_JOBS, or the number of cores.
+    """
+    return int(os.environ.get('TEST_JOBS') or os.cpu_count() or 1)
+
+def warmUp():
+    """
+    Imports all parsers, compilers and interpreters, so that processes forked afterwards
+    do not need to import them.
+    """
+    import main
+    for lang in constants.ALL_LANGUAGES:
+        for mod in [f'lang_{lang}.{lang}_ast', f'compilers.lang_{lang}.{lang}_compiler'] + \
+                [f'lang_{lang}.{lang}_{e}' for e in main.INTERP_ENGINES.values()]:
+            with contextlib.suppress(ModuleNotFoundError):
+                importlib.import_module(mod)
+
+type TestJob = tuple[Callable[..., shell.RunResult], tuple[Any, ...]]
+
+class TestPool:
+    """
+    Runs the commands of file tests in worker processes forked after warmUp. Calling
+    prefetch for all selected tests before they run (see conftest.py) lets the commands
+    run in parallel while pytest checks the results one test after the other. The jobs
+    must be module-level functions, so that they can be sent to the workers.
+    With a single job, commands run directly in the test process.
+    """
+    def __init__(self):
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.futures: dict[TestJob, Future[shell.RunResult]] = {}
+    def prefetch(self, fun: Callable[..., shell.RunResult], *args: Any):
+        jobs = testJobs()
+        if jobs <= 1 or (fun, args) in self.futures:
+            return
+        if self.pool is None:
+            warmUp()
+            self.pool = ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context('fork'))
+        self.futures[(fun, args)] = self.pool.submit(fun, *args)
+    def result(self, fun: Callable[..., shell.RunResult], *args: Any) -> shell.RunResult:
+        future = self.futures.pop((fun, args), None)
+        if future is None:
+            return fun(*args)
+        return future.result()
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+        self.futures = {}
+
+testPool = TestPool()
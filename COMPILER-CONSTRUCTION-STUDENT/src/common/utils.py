@@ -2,6 +2,8 @@ import sys
 from typing import *
 import hashlib
 import importlib
+import os
+import tempfile
 
 def abort(msg: str) -> Never:
     sys.stderr.write(f'ERROR: {msg}\nAborting!')
@@ -19,6 +21,21 @@ def writeTextFile(path: str, content: str):
     with open(path, 'w') as f:
         return f.write(content)
 
+def writeTextFileAtomic(path: str, content: str):
+    """
+    Writes content to a temporary file next to path and renames it to path, so that
+    readers see either the old or the new content, never a partially written file.
+    """
+    (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                 prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
 def inputInt(prompt: str) -> int:
     if sys.stdout.isatty():
         s = input(prompt)
@@ -5,6 +5,17 @@ from common.sexp import *
 
 type WasmValtype = Literal['i32', 'i64', 'f32', 'f64']
 
+type WasmIntRelOp = Literal['eq', 'ne', 'lt_s', 'lt_u', 'gt_s', 'gt_u', 'le_s', 'le_u', 'ge_s', 'ge_u']
+
+def watString(s: str | bytes) -> str:
+    """
+    Returns a string literal of the text format. Printable ASCII characters are kept,
+    all other bytes of the UTF-8 encoding are written as escapes such as \\0a.
+    """
+    data = s.encode('utf-8') if isinstance(s, str) else s
+    chars = [chr(b) if 0x20 <= b < 0x7f and b not in b'"\\' else f'\\{b:02x}' for b in data]
+    return '"' + ''.join(chars) + '"'
+
 def renderValtype(t: WasmValtype) -> SExp:
     return SExpId(t)
 
@@ -46,7 +57,8 @@ class WasmImport:
     name: str
     desc: WasmImportDesc
     def render(self):
-        return mkNamedSeq('import', SExpStr(self.module), SExpStr(self.name), self.desc.render())
+        return mkNamedSeq('import', SExpId(watString(self.module)), SExpId(watString(self.name)),
+                          self.desc.render())
 
 type WasmImportDesc = WasmImportMemory | WasmImportFunc
 
@@ -87,7 +99,7 @@ class WasmExport:
     name: str
     desc: WasmExportDesc
     def render(self) -> SExp:
-        return mkNamedSeq('export', SExpStr(self.name), self.desc.render())
+        return mkNamedSeq('export', SExpId(watString(self.name)), self.desc.render())
 
 type WasmExportDesc = WasmExportFunc
 
@@ -113,10 +125,22 @@ class WasmGlobal:
 
 @dataclass(frozen=True)
 class WasmData:
+    """
+    An active data segment, e.g. (data (i32.const 0) "Error"). Text is stored as UTF-8,
+    binary content (bytes) is written with escapes such as "\\01\\00".
+    """
     start: int
-    content: str
+    content: str | bytes
     def render(self) -> SExp:
-        return mkNamedSeq('data', SExpId(f'(i32.const {self.start})'), SExpStr(self.content))
+        return mkNamedSeq('data', SExpId(f'(i32.const {self.start})'), SExpId(self.contentText()))
+    def contentText(self) -> str:
+        if isinstance(self.content, str):
+            return watString(self.content)
+        return '"' + ''.join([f'\\{b:02x}' for b in self.content]) + '"'
+    def contentBytes(self) -> bytes:
+        if isinstance(self.content, str):
+            return self.content.encode('utf-8')
+        return self.content
 
 @dataclass(frozen=True)
 class WasmFuncTable:
@@ -165,14 +189,14 @@ class WasmInstrNumBinOp:
     Binary operators on numbers, e.g. i32.add
     """
     ty: WasmValtype
-    op: Literal['add', 'sub', 'mul', 'shr_u', 'shl', 'xor']
+    op: Literal['add', 'sub', 'mul', 'shr_u', 'shl', 'xor', 'and']
     def render(self) -> SExp:
         return SExpId(f'{self.ty}.{self.op}')
 
 @dataclass(frozen=True)
 class WasmInstrIntRelOp:
     ty: Literal['i32', 'i64']
-    op: Literal['eq', 'ne', 'lt_s', 'lt_u', 'gt_s', 'gt_u', 'le_s', 'le_u', 'ge_s', 'ge_u']
+    op: WasmIntRelOp
     def render(self) -> SExp:
         return SExpId(f'{self.ty}.{self.op}')
 
@@ -232,6 +256,16 @@ class WasmInstrMem:
     def render(self) -> SExp:
         return SExpId(f'{self.ty}.{self.op}')
 
+@dataclass(frozen=True)
+class WasmInstrBulkMem:
+    """
+    Bulk memory instructions (memory.fill and memory.copy). Both take the destination
+    address, the byte value or source address, and the number of bytes from the stack.
+    """
+    op: Literal['fill', 'copy']
+    def render(self) -> SExp:
+        return SExpId(f'memory.{self.op}')
+
 @dataclass(frozen=True)
 class WasmInstrBranch:
     """
@@ -294,11 +328,16 @@ class WasmInstrTrap:
     def render(self) -> SExp:
         return SExpId('unreachable')
 
+@dataclass(frozen=True)
+class WasmInstrReturn:
+    def render(self) -> SExp:
+        return SExpId('return')
+
 
 type WasmInstr = WasmInstrConst | WasmInstrNumBinOp | WasmInstrIntRelOp | WasmInstrConvOp \
                | WasmInstrCall | WasmInstrCallIndirect | WasmInstrVarLocal | WasmInstrVarGlobal \
                | WasmInstrBranch | WasmInstrIf | WasmInstrLoop | WasmInstrBlock | WasmInstrMem \
-               | WasmInstrComment | WasmInstrTrap | WasmInstrDrop
+               | WasmInstrBulkMem | WasmInstrComment | WasmInstrTrap | WasmInstrReturn | WasmInstrDrop
 
 # instructions used for loop and for compiling to assembly
 type WasmInstrL = WasmInstrConst | WasmInstrNumBinOp | WasmInstrIntRelOp \
@@ -0,0 +1,343 @@
+"""
+Encoder for the binary format of wasm modules, working directly on the dataclasses of
+common.wasm. See https://webassembly.github.io/spec/core/binary/index.html
+
+The result is the same module that wat2wasm produces from the textual representation:
+identifiers are resolved to indices, labels of branch instructions are resolved to
+relative depths, and function types are shared between all functions with the same
+signature. A name section with the function names is added, so that stack traces of
+wasm runtimes show the names of the functions.
+"""
+from __future__ import annotations
+from typing import *
+import struct
+from common.wasm import *
+
+type FuncType = tuple[tuple[WasmValtype, ...], tuple[WasmValtype, ...]]
+
+MAGIC = b'\x00asm'
+VERSION = b'\x01\x00\x00\x00'
+
+class SectionId:
+    custom = 0
+    type = 1
+    imprt = 2
+    func = 3
+    table = 4
+    glob = 6
+    export = 7
+    elem = 9
+    code = 10
+    data = 11
+
+valtypes: dict[str, int] = {
+    'i32': 0x7f,
+    'i64': 0x7e,
+    'f32': 0x7d,
+    'f64': 0x7c
+}
+
+numBinOps: dict[tuple[str, str], int] = {
+    ('i32', 'add'): 0x6a,
+    ('i32', 'sub'): 0x6b,
+    ('i32', 'mul'): 0x6c,
+    ('i32', 'and'): 0x71,
+    ('i32', 'xor'): 0x73,
+    ('i32', 'shl'): 0x74,
+    ('i32', 'shr_u'): 0x76,
+    ('i64', 'add'): 0x7c,
+    ('i64', 'sub'): 0x7d,
+    ('i64', 'mul'): 0x7e,
+    ('i64', 'and'): 0x83,
+    ('i64', 'xor'): 0x85,
+    ('i64', 'shl'): 0x86,
+    ('i64', 'shr_u'): 0x88,
+    ('f32', 'add'): 0x92,
+    ('f32', 'sub'): 0x93,
+    ('f32', 'mul'): 0x94,
+    ('f64', 'add'): 0xa0,
+    ('f64', 'sub'): 0xa1,
+    ('f64', 'mul'): 0xa2
+}
+
+intRelOps: dict[str, int] = {
+    'eq': 0, 'ne': 1, 'lt_s': 2, 'lt_u': 3, 'gt_s': 4,
+    'gt_u': 5, 'le_s': 6, 'le_u': 7, 'ge_s': 8, 'ge_u': 9
+}
+
+convOps: dict[str, int] = {
+    'i32.wrap_i64': 0xa7,
+    'i64.extend_i32_s': 0xac,
+    'i64.extend_i32_u': 0xad
+}
+
+loadOps: dict[str, int] = {'i32': 0x28, 'i64': 0x29, 'f32': 0x2a, 'f64': 0x2b}
+storeOps: dict[str, int] = {'i32': 0x36, 'i64': 0x37, 'f32': 0x38, 'f64': 0x39}
+# natural alignment (as log2 of the number of bytes), the default of the textual format
+memAlign: dict[str, int] = {'i32': 2, 'i64': 3, 'f32': 2, 'f64': 3}
+
+def uleb(n: int) -> bytes:
+    """
+    Unsigned LEB128 encoding of n.
+    """
+    if n < 0:
+        raise ValueError(f'Cannot encode negative number {n} as unsigned LEB128')
+    out = bytearray()
+    while True:
+        b = n & 0x7f
+        n >>= 7
+        if n == 0:
+            out.append(b)
+            return bytes(out)
+        out.append(b | 0x80)
+
+def sleb(n: int) -> bytes:
+    """
+    Signed LEB128 encoding of n.
+    """
+    out = bytearray()
+    while True:
+        b = n & 0x7f
+        n >>= 7 # arithmetic shift
+        if (n == 0 and b & 0x40 == 0) or (n == -1 and b & 0x40 != 0):
+            out.append(b)
+            return bytes(out)
+        out.append(b | 0x80)
+
+def signed(n: int, bits: int) -> int:
+    """
+    Interprets n as a two's complement number with the given number of bits. The
+    textual format accepts both signed and unsigned constants.
+    """
+    n &= (1 << bits) - 1
+    if n >= 1 << (bits - 1):
+        n -= 1 << bits
+    return n
+
+def name(s: str) -> bytes:
+    b = s.encode('utf-8')
+    return uleb(len(b)) + b
+
+def vec(items: list[bytes]) -> bytes:
+    return uleb(len(items)) + b''.join(items)
+
+def encodeFuncType(t: FuncType) -> bytes:
+    (params, results) = t
+    return b'\x60' + vec([bytes([valtypes[p]]) for p in params]) + \
+        vec([bytes([valtypes[r]]) for r in results])
+
+def mkFuncType(params: Iterable[WasmValtype], result: Optional[WasmValtype]) -> FuncType:
+    return (tuple(params), () if result is None else (result,))
+
+def encodeBlockType(t: Optional[WasmValtype]) -> bytes:
+    return b'\x40' if t is None else bytes([valtypes[t]])
+
+class Encoder:
+    """
+    Holds the index spaces of a module while encoding it.
+    """
+    def __init__(self, m: WasmModule):
+        self.types: dict[FuncType, int] = {}
+        self.funcs: dict[WasmId, int] = {}
+        self.globals: dict[WasmId, int] = {}
+        for i in m.imports:
+            match i.desc:
+                case WasmImportFunc(id, params, result):
+                    self.typeIndex(mkFuncType(params, result))
+                    self.funcs[id] = len(self.funcs)
+                case WasmImportMemory():
+                    pass
+        for f in m.funcs:
+            self.typeIndex(mkFuncType([t for (_, t) in f.params], f.result))
+            self.funcs[f.id] = len(self.funcs)
+        for g in m.globals:
+            self.globals[g.id] = len(self.globals)
+
+    def typeIndex(self, t: FuncType) -> int:
+        """
+        Returns the index of the function type t, adding t to the type section if necessary.
+        """
+        if t not in self.types:
+            self.types[t] = len(self.types)
+        return self.types[t]
+
+    def encodeInstrs(self, instrs: list[WasmInstr], locals: dict[WasmId, int],
+                     labels: list[Optional[WasmId]], out: bytearray):
+        for i in instrs:
+            self.encodeInstr(i, locals, labels, out)
+
+    def encodeInstr(self, instr: WasmInstr, locals: dict[WasmId, int],
+                    labels: list[Optional[WasmId]], out: bytearray):
+        match instr:
+            case WasmInstrConst('i32', val):
+                out.append(0x41)
+                out += sleb(signed(int(val), 32))
+            case WasmInstrConst('i64', val):
+                out.append(0x42)
+                out += sleb(signed(int(val), 64))
+            case WasmInstrConst('f32', val):
+                out.append(0x43)
+                out += struct.pack('<f', val)
+            case WasmInstrConst('f64', val):
+                out.append(0x44)
+                out += struct.pack('<d', val)
+            case WasmInstrDrop():
+                out.append(0x1a)
+            case WasmInstrNumBinOp(ty, op):
+                out.append(numBinOps[(ty, op)])
+            case WasmInstrIntRelOp(ty, op):
+                out.append((0x46 if ty == 'i32' else 0x51) + intRelOps[op])
+            case WasmInstrConvOp(op):
+                out.append(convOps[op])
+            case WasmInstrCall(id):
+                out.append(0x10)
+                out += uleb(self.funcs[id])
+            case WasmInstrCallIndirect(params, result):
+                out.append(0x11)
+                out += uleb(self.typeIndex(mkFuncType(params, result)))
+                out.append(0x00) # table index
+            case WasmInstrVarLocal(op, id):
+                out.append({'get': 0x20, 'set': 0x21, 'tee': 0x22}[op])
+                out += uleb(locals[id])
+            case WasmInstrVarGlobal(op, id):
+                out.append({'get': 0x23, 'set': 0x24}[op])
+                out += uleb(self.globals[id])
+            case WasmInstrMem(ty, op):
+                out.append(loadOps[ty] if op == 'load' else storeOps[ty])
+                out += uleb(memAlign[ty])
+                out += uleb(0) # offset
+            case WasmInstrBulkMem('fill'):
+                out += b'\xfc' + uleb(11) + b'\x00' # memory index
+            case WasmInstrBulkMem('copy'):
+                out += b'\xfc' + uleb(10) + b'\x00\x00' # destination and source memory
+            case WasmInstrBranch(target, conditional):
+                out.append(0x0d if conditional else 0x0c)
+                out += uleb(labelDepth(target, labels))
+            case WasmInstrIf(resultType, thenInstrs, elseInstrs):
+                out.append(0x04)
+                out += encodeBlockType(resultType)
+                self.encodeInstrs(thenInstrs, locals, labels + [None], out)
+                out.append(0x05)
+                self.encodeInstrs(elseInstrs, locals, labels + [None], out)
+                out.append(0x0b)
+            case WasmInstrLoop(label, body):
+                out.append(0x03)
+                out += encodeBlockType(None)
+                self.encodeInstrs(body, locals, labels + [label], out)
+                out.append(0x0b)
+            case WasmInstrBlock(label, result, body):
+                out.append(0x02)
+                out += encodeBlockType(result)
+                self.encodeInstrs(body, locals, labels + [label], out)
+                out.append(0x0b)
+            case WasmInstrComment():
+                pass
+            case WasmInstrTrap():
+                out.append(0x00)
+            case WasmInstrReturn():
+                out.append(0x0f)
+            case _:
+                raise ValueError(f'Cannot encode instruction {instr}')
+
+    def encodeExpr(self, instrs: list[WasmInstr], locals: dict[WasmId, int]) -> bytes:
+        out = bytearray()
+        self.encodeInstrs(instrs, locals, [], out)
+        out.append(0x0b)
+        return bytes(out)
+
+    def encodeFunc(self, f: WasmFunc) -> bytes:
+        locals: dict[WasmId, int] = {}
+        for (x, _) in f.params + f.locals:
+            locals[x] = len(locals)
+        # consecutive locals of the same type are declared together
+        groups: list[tuple[int, WasmValtype]] = []
+        for (_, t) in f.locals:
+            if groups and groups[-1][1] == t:
+                groups[-1] = (groups[-1][0] + 1, t)
+            else:
+                groups.append((1, t))
+        body = vec([uleb(n) + bytes([valtypes[t]]) for (n, t) in groups]) + \
+            self.encodeExpr(f.instrs, locals)
+        return uleb(len(body)) + body
+
+def labelDepth(target: WasmId, labels: list[Optional[WasmId]]) -> int:
+    """
+    Returns the relative depth of the innermost enclosing block or loop with the given label.
+    """
+    for depth, l in enumerate(reversed(labels)):
+        if l == target:
+            return depth
+    raise ValueError(f'Unknown branch target {target.id}')
+
+def encodeLimits(min: int, max: Optional[int]) -> bytes:
+    if max is None:
+        return b'\x00' + uleb(min)
+    return b'\x01' + uleb(min) + uleb(max)
+
+def encodeImport(i: WasmImport, enc: Encoder) -> bytes:
+    prefix = name(i.module) + name(i.name)
+    match i.desc:
+        case WasmImportFunc(_, params, result):
+            return prefix + b'\x00' + uleb(enc.typeIndex(mkFuncType(params, result)))
+        case WasmImportMemory(min, max):
+            return prefix + b'\x02' + encodeLimits(min, max)
+
+def encodeNames(enc: Encoder) -> bytes:
+    """
+    Returns the content of the custom name section, which only holds the function names.
+    """
+    names: list[bytes] = []
+    for (id, idx) in enc.funcs.items():
+        names.append(uleb(idx) + name(id.id[1:]))
+    funcNames = vec(names)
+    return name('name') + b'\x01' + uleb(len(funcNames)) + funcNames
+
+def section(id: int, items: list[bytes]) -> bytes:
+    """
+    Returns a section with the given items. As with wat2wasm, empty sections are omitted.
+    """
+    if not items:
+        return b''
+    content = vec(items)
+    return bytes([id]) + uleb(len(content)) + content
+
+def encodeModule(m: WasmModule) -> bytes:
+    """
+    Returns the binary representation of module m.
+    """
+    enc = Encoder(m)
+    # The code section must be encoded before the type section, because call_indirect
+    # instructions may add new function types.
+    code = [enc.encodeFunc(f) for f in m.funcs]
+    imports = [encodeImport(i, enc) for i in m.imports]
+    funcs = [uleb(enc.typeIndex(mkFuncType([t for (_, t) in f.params], f.result)))
+             for f in m.funcs]
+    # The textual representation always declares a table and its elements
+    n = len(m.funcTable.elems)
+    table = [b'\x70' + encodeLimits(n, n)]
+    # active segment (flags 2) for table 0 at offset 0, holding function indices (kind 0)
+    elems = [uleb(2) + uleb(0) + enc.encodeExpr([WasmInstrConst('i32', 0)], {}) + b'\x00' +
+             vec([uleb(enc.funcs[id]) for id in m.funcTable.elems])]
+    globals = [bytes([valtypes[g.ty], 1 if g.mutable else 0]) + enc.encodeExpr(g.init, {})
+               for g in m.globals]
+    exports: list[bytes] = []
+    for e in m.exports:
+        match e.desc:
+            case WasmExportFunc(id):
+                exports.append(name(e.name) + b'\x00' + uleb(enc.funcs[id]))
+    data = [uleb(0) + enc.encodeExpr([WasmInstrConst('i32', d.start)], {}) +
+            uleb(len(d.contentBytes())) + d.contentBytes()
+            for d in m.data]
+    types = [encodeFuncType(t) for t in enc.types]
+    names = encodeNames(enc)
+    return MAGIC + VERSION + \
+        section(SectionId.type, types) + \
+        section(SectionId.imprt, imports) + \
+        section(SectionId.func, funcs) + \
+        section(SectionId.table, table) + \
+        section(SectionId.glob, globals) + \
+        section(SectionId.export, exports) + \
+        section(SectionId.elem, elems) + \
+        section(SectionId.code, code) + \
+        section(SectionId.data, data) + \
+        bytes([SectionId.custom]) + uleb(len(names)) + names
@@ -0,0 +1,124 @@
+"""
+Writer for the textual representation of wasm modules.
+
+In contrast to rendering the module via common.sexp, which builds a document for the whole
+module and lets the prettyprinter choose a layout, this writer walks the dataclasses of
+common.wasm and writes every line directly to a file. The layout is fixed: every
+instruction is written in plain (non-folded) form on its own line, and the bodies of
+block, loop and if are indented by two spaces per nesting level. The only state is the
+current nesting depth.
+"""
+from __future__ import annotations
+from typing import *
+from common.wasm import *
+
+INDENT = '  '
+
+def valtypes(kind: str, tys: list[WasmValtype]) -> str:
+    if not tys:
+        return ''
+    return f' ({kind} {" ".join(tys)})'
+
+def resultType(t: Optional[WasmValtype]) -> str:
+    return '' if t is None else f' (result {t})'
+
+def instrText(instr: WasmInstr) -> str:
+    """
+    Returns the text of an instruction without nested instructions.
+    """
+    match instr:
+        case WasmInstrConst(ty, val):
+            return f'{ty}.const {val}'
+        case WasmInstrDrop():
+            return 'drop'
+        case WasmInstrNumBinOp(ty, op) | WasmInstrIntRelOp(ty, op) | WasmInstrMem(ty, op):
+            return f'{ty}.{op}'
+        case WasmInstrConvOp(op):
+            return op
+        case WasmInstrCall(id):
+            return f'call {id.id}'
+        case WasmInstrCallIndirect(params, result):
+            return 'call_indirect' + valtypes('param', params) + resultType(result)
+        case WasmInstrVarLocal(op, id):
+            return f'local.{op} {id.id}'
+        case WasmInstrVarGlobal(op, id):
+            return f'global.{op} {id.id}'
+        case WasmInstrBranch(target, conditional):
+            return f'{"br_if" if conditional else "br"} {target.id}'
+        case WasmInstrBulkMem(op):
+            return f'memory.{op}'
+        case WasmInstrComment(text):
+            return f'(;{text};)'
+        case WasmInstrTrap():
+            return 'unreachable'
+        case WasmInstrReturn():
+            return 'return'
+        case _:
+            raise ValueError(f'Instruction {instr} has nested instructions')
+
+def writeInstrs(instrs: list[WasmInstr], depth: int, out: TextIO):
+    for i in instrs:
+        writeInstr(i, depth, out)
+
+def writeInstr(instr: WasmInstr, depth: int, out: TextIO):
+    indent = INDENT * depth
+    match instr:
+        case WasmInstrIf(result, thenInstrs, elseInstrs):
+            out.write(f'{indent}if{resultType(result)}\n')
+            writeInstrs(thenInstrs, depth + 1, out)
+            out.write(f'{indent}else\n')
+            writeInstrs(elseInstrs, depth + 1, out)
+            out.write(f'{indent}end\n')
+        case WasmInstrLoop(label, body):
+            out.write(f'{indent}loop {label.id}\n')
+            writeInstrs(body, depth + 1, out)
+            out.write(f'{indent}end\n')
+        case WasmInstrBlock(label, result, body):
+            out.write(f'{indent}block {label.id}{resultType(result)}\n')
+            writeInstrs(body, depth + 1, out)
+            out.write(f'{indent}end\n')
+        case _:
+            out.write(f'{indent}{instrText(instr)}\n')
+
+def foldedInstrs(instrs: list[WasmInstr]) -> str:
+    """
+    Returns the instructions of a constant expression in folded form, e.g. (i32.const 0)
+    """
+    return ''.join([f' ({instrText(i)})' for i in instrs])
+
+def writeFunc(f: WasmFunc, out: TextIO):
+    params = ''.join([f' (param {x.id} {t})' for (x, t) in f.params])
+    out.write(f'{INDENT}(func {f.id.id}{params}{resultType(f.result)}\n')
+    for (x, t) in f.locals:
+        out.write(f'{INDENT * 2}(local {x.id} {t})\n')
+    writeInstrs(f.instrs, 2, out)
+    out.write(f'{INDENT})\n')
+
+def importDesc(d: WasmImportDesc) -> str:
+    match d:
+        case WasmImportMemory(min, max):
+            return f'(memory {min}{"" if max is None else f" {max}"})'
+        case WasmImportFunc(id, params, result):
+            return f'(func {id.id} (param{"".join([f" {t}" for t in params])}){resultType(result)})'
+
+def writeModule(m: WasmModule, out: TextIO):
+    """
+    Writes the textual representation of m to out.
+    """
+    out.write('(module\n')
+    for i in m.imports:
+        out.write(f'{INDENT}(import {watString(i.module)} {watString(i.name)} {importDesc(i.desc)})\n')
+    for e in m.exports:
+        match e.desc:
+            case WasmExportFunc(id):
+                out.write(f'{INDENT}(export {watString(e.name)} (func {id.id}))\n')
+    for g in m.globals:
+        t = f'(mut {g.ty})' if g.mutable else g.ty
+        out.write(f'{INDENT}(global {g.id.id} {t}{foldedInstrs(g.init)})\n')
+    for d in m.data:
+        out.write(f'{INDENT}(data (i32.const {d.start}) {d.contentText()})\n')
+    elems = ''.join([f' {x.id}' for x in m.funcTable.elems])
+    out.write(f'{INDENT}(table funcref (elem{elems}))\n')
+    for f in m.funcs:
+        writeFunc(f, out)
+    out.write(')\n')
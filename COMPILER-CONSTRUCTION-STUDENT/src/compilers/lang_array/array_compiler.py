@@ -6,13 +6,15 @@ from lang_array.array_astAtom import *
 import lang_array.array_ast as plainAst
 import lang_array.array_tychecker as array_tychecker
 import lang_array.array_transform as array_transform
+import lang_array.array_rangeAnalysis as array_rangeAnalysis
+import lang_array.array_localAlloc as array_localAlloc
 from lang_array.array_compilerSupport import *
 from common.compilerSupport import *
 
 def identToWasmId(identifier: ident) -> WasmId:
     return WasmId('$' + identifier.name)
 
-def compileStmts(stmts: list[stmt], cfg: CompilerConfig) -> list[WasmInstr]:
+def compileStmts(stmts: list[stmt], cfg: ArrayCompilerConfig) -> list[WasmInstr]:
     wasmInstructions: list[WasmInstr] = []
 
     for stmt in stmts:
@@ -56,9 +58,9 @@ def compileStmts(stmts: list[stmt], cfg: CompilerConfig) -> list[WasmInstr]:
                 wasmInstructions.extend(instructions)
 
             case SubscriptAssign(left, index, right):
-                wasmInstructions.extend(arrayOffsetInstrs(left, index, cfg))
+                wasmInstructions.extend(arrayOffsetInstrs(left, index, stmt, cfg))
                 wasmInstructions.extend(compileExpressions(right, cfg))
-                storeInstructions = "i64" if isinstance(right, AtomExp) else "i32"
+                storeInstructions = "i64" if isinstance(getTypeOfExp(right), Int) else "i32"
                 wasmInstructions.append(WasmInstrMem(storeInstructions, "store"))
 
 
@@ -67,7 +69,7 @@ def compileStmts(stmts: list[stmt], cfg: CompilerConfig) -> list[WasmInstr]:
 
 
 
-def compileExpressions(exp: exp, cfg: CompilerConfig) -> list[WasmInstr]:
+def compileExpressions(exp: exp, cfg: ArrayCompilerConfig) -> list[WasmInstr]:
     wasmInstructions: list[WasmInstr] = []
     match exp:
         case IntConst(value):
@@ -138,69 +140,39 @@ def compileExpressions(exp: exp, cfg: CompilerConfig) -> list[WasmInstr]:
             wasmInstructions.append(WasmInstrConst(ty='i32', val=int(value)))
         case AtomExp(e):
             wasmInstructions.extend(compileExpressions(e, cfg))
-        case ArrayInitStatic(elemInit):   
-            wasmInstructions = []
-            #inite
-            initArrayInstrs = compileInitArray(IntConst(len(elemInit)), getTypeOfAtomExp(elemInit[0]), cfg)
-            wasmInstructions.extend(initArrayInstrs)
-            wasmInstructions.append(WasmInstrVarLocal("tee", WasmId("$@tmp_i32")))
-            wasmInstructions.append(WasmInstrVarLocal("get", WasmId("$@tmp_i32")))
-            index_offset = 4
-            wasmInstructions.append(WasmInstrConst("i32", index_offset))
-            wasmInstructions.append(WasmInstrNumBinOp("i32", "add"))
-            #store,compile
-            firstElemInstrs = compileExpressions(elemInit[0], cfg)
-            wasmInstructions.extend(firstElemInstrs)
-            arg = getTypeOfAtomExp(elemInit[0])
-            storeInstr = WasmInstrMem("i64", "store") if isinstance(arg, Int) else WasmInstrMem("i32", "store")
-            wasmInstructions.append(storeInstr)
-            i = 1
-            while i < len(elemInit):
-                wasmInstructions.append(WasmInstrVarLocal("tee", WasmId("$@tmp_i32")))
-                wasmInstructions.append(WasmInstrVarLocal("get", WasmId("$@tmp_i32")))
-                e = elemInit[i]
-                if isinstance(e.ty, Int):
-                    index_offset += 8
-                elif isinstance(e.ty, (Bool, Array)):
-                    index_offset += 4
-                wasmInstructions.append(WasmInstrConst("i32", index_offset))
-                wasmInstructions.append(WasmInstrNumBinOp("i32", "add"))
-                elemInstrs = compileExpressions(e, cfg)
-                wasmInstructions.extend(elemInstrs)
-                storeInstr = WasmInstrMem("i64", "store") if isinstance(arg, Int) else WasmInstrMem("i32", "store")
-                wasmInstructions.append(storeInstr)
-                i += 1
+        case ArrayInitStatic(elemInit):
+            elemTy = getTypeOfAtomExp(elemInit[0])
+            wasmInstructions = compileInitArray(IntConst(len(elemInit)), elemTy, cfg)
+            wasmInstructions.append(WasmInstrVarLocal("tee", Locals.tmp_i32))
+            if id(exp) in cfg.staticArrays.addrs:
+                # All elements are constants, copy them from the data segment
+                wasmInstructions.extend([
+                    WasmInstrVarLocal("get", Locals.tmp_i32),
+                    WasmInstrConst("i32", 4),
+                    WasmInstrNumBinOp("i32", "add"),
+                    WasmInstrConst("i32", cfg.staticArrays.addrs[id(exp)]),
+                    WasmInstrConst("i32", len(elemInit) * get_element_size(elemTy)),
+                    WasmInstrBulkMem("copy")
+                ])
+            else:
+                storeInstr = WasmInstrMem("i64", "store") if isinstance(elemTy, Int) else WasmInstrMem("i32", "store")
+                index_offset = 4
+                for e in elemInit:
+                    # The memory of a new array is zero (see HeapLayout)
+                    if not isZero(e):
+                        wasmInstructions.append(WasmInstrVarLocal("get", Locals.tmp_i32))
+                        wasmInstructions.append(WasmInstrConst("i32", index_offset))
+                        wasmInstructions.append(WasmInstrNumBinOp("i32", "add"))
+                        wasmInstructions.extend(compileExpressions(e, cfg))
+                        wasmInstructions.append(storeInstr)
+                    index_offset += get_element_size(elemTy)
         case ArrayInitDyn(leng, elemInit):
             wasmInstructions = []
             wasmInstructions.extend(compileInitArray(leng, getTypeOfAtomExp(elemInit), cfg))
-            wasmInstructions.append(WasmInstrVarLocal("tee", WasmId("$@tmp_i32")))
-            wasmInstructions.append(WasmInstrVarLocal("get", WasmId("$@tmp_i32")))
-            wasmInstructions.append(WasmInstrConst("i32", 4))
-            wasmInstructions.append(WasmInstrNumBinOp("i32", "add"))
-            wasmInstructions.append(WasmInstrVarLocal("set", WasmId("$@tmp_i32")))
-            bod = []
-            bod.append(WasmInstrVarLocal("get", WasmId("$@tmp_i32")))
-            bod.extend(compileExpressions(elemInit, cfg))
-            if isinstance(elemInit.ty, Int):
-                bod.append(WasmInstrMem("i64", "store"))
-            else:
-                bod.append(WasmInstrMem("i32", "store"))
-            bod.append(WasmInstrVarLocal("get", WasmId("$@tmp_i32")))
-            bod.append(WasmInstrConst("i32", 8 if isinstance(elemInit.ty, Int) else 4))
-            bod.append(WasmInstrNumBinOp("i32", "add"))
-            bod.append(WasmInstrVarLocal("set", WasmId("$@tmp_i32")))
-            bod_ = []
-            bod_.append(WasmInstrVarLocal("get", WasmId("$@tmp_i32")))
-            bod_.append(WasmInstrVarGlobal('get', Globals.freePtr))
-            bod_.append(WasmInstrIntRelOp("i32", "lt_u"))
-            exit_loop = WasmInstrBranch(target=WasmId("$loop_exit"), conditional=False)
-            bod.extend(bod_)
-            bod.append(WasmInstrIf(None, thenInstrs=[], elseInstrs=[exit_loop]))
-            bod.append(WasmInstrBranch(target=WasmId("$loop_start"), conditional=False))
-            loop_instr = WasmInstrLoop(WasmId("$loop_start"), body=bod)
-            wasmInstructions.append(WasmInstrBlock(label=WasmId("$loop_exit"), body=[loop_instr], result=None))
+            wasmInstructions.append(WasmInstrVarLocal("tee", Locals.tmp_i32))
+            wasmInstructions.extend(fillArrayInstrs(leng, elemInit, cfg))
         case Subscript(array, index):
-            wasmInstructions.extend(arrayOffsetInstrs(array, index, cfg))
+            wasmInstructions.extend(arrayOffsetInstrs(array, index, exp, cfg))
             if isinstance(array.ty, Array):
                 if isinstance(array.ty.elemTy, Int):
                     wasmInstructions.append(WasmInstrMem("i64", "load"))
@@ -208,6 +180,30 @@ def compileExpressions(exp: exp, cfg: CompilerConfig) -> list[WasmInstr]:
                     wasmInstructions.append(WasmInstrMem("i32", "load"))
     return wasmInstructions
 
+def constBytes(e: atomExp) -> Optional[bytes]:
+    """
+    Returns the representation of e as an array element in memory if e is a constant.
+    """
+    match e:
+        case IntConst(v):
+            return (v % 2**64).to_bytes(8, 'little')
+        case BoolConst(b):
+            return int(b).to_bytes(4, 'little')
+        case _:
+            return None
+
+def isZero(e: atomExp) -> bool:
+    data = constBytes(e)
+    return data is not None and not any(data)
+
+def fillArrayInstrs(lenExp: atomExp, elemInit: atomExp, cfg: ArrayCompilerConfig) -> list[WasmInstr]:
+    """
+    Returns instructions filling all elements of the new array stored in $@tmp_i32 with
+    elemInit (see Arrays.fillInstrs).
+    """
+    return Arrays.fillInstrs(compileExpressions(lenExp, cfg), compileExpressions(elemInit, cfg),
+                             get_element_size(getTypeOfAtomExp(elemInit)), constBytes(elemInit))
+
 def compileCall(name, args, cfg) -> list[WasmInstr]:
     wasmInstructions = []
     # Collect
@@ -265,7 +261,7 @@ def compileModule(m: plainAst.mod, cfg: CompilerConfig) -> WasmModule:
     vars = array_tychecker.tycheckModule(m)
     ctx = array_transform.Ctx()
     atom_stmts = array_transform.transStmts(m.stmts, ctx)
-    instrs = compileStmts(atom_stmts, cfg)
+    (atom_stmts, temps) = array_localAlloc.coalesceTemporaries(atom_stmts, ctx.freshVars)
     idMain = WasmId('$main')
     locals_list_vars = [
         (identToWasmId(ident), 'i64' if isinstance(var_info.ty, Int) else 'i32')
@@ -273,150 +269,58 @@ def compileModule(m: plainAst.mod, cfg: CompilerConfig) -> WasmModule:
     ]
     local_list_fresh = [
         (identToWasmId(var_name), 'i64' if isinstance(var_info, Int) else 'i32')
-        for var_name, var_info in ctx.freshVars.items()
+        for var_name, var_info in temps.items()
     ]
+    # All local variables holding arrays are roots for the garbage collector
+    roots = [identToWasmId(ident) for ident, var_info in vars.items() if isinstance(var_info.ty, Array)]
+    roots += [identToWasmId(var_name) for var_name, var_info in temps.items()
+              if isinstance(var_info, Array)]
+    staticStart = HeapLayout.rootsStart + (4 * len(roots) if cfg.gc else 0)
+    statics = StaticArrays.layout(StaticArrays.collect(atom_stmts, ArrayInitStatic, constBytes),
+                                  staticStart)
+    heap = HeapLayout(roots, cfg.maxMemSize * CompilerConfig.pageSize, statics.size) if cfg.gc else None
+    safe = frozenset(array_rangeAnalysis.safeSubscripts(atom_stmts))
+    arrayCfg = ArrayCompilerConfig(cfg.maxMemSize, cfg.maxArraySize, cfg.gc, cfg.inlineFastPath,
+                                   heap=heap, safeSubscripts=safe, staticArrays=statics,
+                                   frame=Frame(roots))
+    instrs = compileStmts(atom_stmts, arrayCfg)
     list = []
     list.extend(locals_list_vars)
     list.extend(local_list_fresh)
     list.extend(Locals.decls())
 
-    return WasmModule(imports=wasmImports(cfg.maxMemSize),
+    return WasmModule(imports=wasmImports(heap.memPages if heap else cfg.maxMemSize),
                       exports=[WasmExport("main", WasmExportFunc(idMain))],
-                      globals=Globals.decls(),
-                      data=Errors.data(),
+                      globals=Globals.decls(heap, statics.size),
+                      data=Errors.data() + statics.data,
                       funcTable=WasmFuncTable([]),
-                      funcs=[WasmFunc(idMain, [], None, list, instrs)])
-
-
-
-def compileInitArray(lenExp: atomExp, elemTy: ty, cfg: CompilerConfig) -> list[WasmInstr]:
-    init_instr: list[WasmInstr] = []
-    array_len = compileExpressions(lenExp, cfg)
-
-    init_instr.extend(array_len)
-    init_instr.extend(checkArraySize(elemTy, cfg))
-    init_instr.extend(checkArrayLength(array_len))
-
-    init_instr.extend(computeHeader(array_len, elemTy))
-    init_instr.extend(moveFreePtr(array_len))
-    
-    return init_instr
-
-def checkArraySize(elemTy: ty, cfg: CompilerConfig) -> list[WasmInstr]:
-    size_instrs: list[WasmInstr] = []
-    size = 8 if isinstance(elemTy, Int) else 4
-    size_instrs.append(WasmInstrConst("i64", size))
-    size_instrs.append(WasmInstrNumBinOp("i64", "mul"))
-    size_instrs.append(WasmInstrConst("i64", cfg.maxArraySize))
-    size_instrs.append(WasmInstrIntRelOp("i64", "gt_s"))
-    
-    error_instrs = generateErrorInstrs()
-    size_instrs.append(WasmInstrIf(None, error_instrs, []))
-    
-    return size_instrs
-
-def checkArrayLength(array_len: list[WasmInstr]) -> list[WasmInstr]:
-    length_instrs: list[WasmInstr] = []
-    
-    length_instrs.extend(array_len)
-    length_instrs.append(WasmInstrConst("i64", 0))
-    length_instrs.append(WasmInstrIntRelOp("i64", "lt_s"))
-    
-    error_instrs = generateErrorInstrs()
-    length_instrs.append(WasmInstrIf(None, error_instrs, []))
-    
-    return length_instrs
-
-def computeHeader(array_len: list[WasmInstr], elemTy: ty) -> list[WasmInstr]:
-    header_instrs: list[WasmInstr] = []
-    
-    header_instrs.append(WasmInstrVarGlobal("get", WasmId("$@free_ptr")))
-    header_instrs.extend(array_len)
-    header_instrs.append(WasmInstrConvOp("i32.wrap_i64"))
-    header_instrs.append(WasmInstrConst("i32", 4))
-    header_instrs.append(WasmInstrNumBinOp("i32", "shl"))
-    header_flag = WasmInstrConst("i32", 3 if isinstance(elemTy, Array) else 1)
-    header_instrs.append(header_flag)
-    header_instrs.append(WasmInstrNumBinOp("i32", "xor"))
-    header_instrs.append(WasmInstrMem("i32", "store"))
-    
-    return header_instrs
-
-def moveFreePtr(array_len: list[WasmInstr]) -> list[WasmInstr]:
-    free_ptr_instrs: list[WasmInstr] = []
-    
-    free_ptr_instrs.append(WasmInstrVarGlobal("get", WasmId("$@free_ptr")))
-    free_ptr_instrs.extend(array_len)
-    free_ptr_instrs.append(WasmInstrConvOp("i32.wrap_i64"))
-    free_ptr_instrs.append(WasmInstrConst("i32", 8))
-    free_ptr_instrs.append(WasmInstrNumBinOp("i32", "mul"))
-    free_ptr_instrs.append(WasmInstrConst("i32", 4))
-    free_ptr_instrs.append(WasmInstrNumBinOp("i32", "add"))
-    free_ptr_instrs.append(WasmInstrVarGlobal("get", WasmId("$@free_ptr")))
-    free_ptr_instrs.append(WasmInstrNumBinOp("i32", "add"))
-    free_ptr_instrs.append(WasmInstrVarGlobal("set", WasmId("$@free_ptr")))
-    
-    return free_ptr_instrs
-
-def generateErrorInstrs() -> list[WasmInstr]:
-    return [
-        WasmInstrConst("i32", 0),
-        WasmInstrConst("i32", 14),
-        WasmInstrCall(WasmId("$print_err")),
-        WasmInstrTrap()
-    ]
+                      funcs=Runtime.link(heap, [WasmFunc(idMain, [], None, list, instrs)]) +
+                        (Gc.funcs(heap) if heap else []))
+
+
 
+def compileInitArray(lenExp: atomExp, elemTy: ty, cfg: ArrayCompilerConfig) -> list[WasmInstr]:
+    return Arrays.allocInstrs(compileExpressions(lenExp, cfg), get_element_size(elemTy),
+                              isinstance(elemTy, Array), cfg)
 
 def arrayLenInstrs() -> list[WasmInstr]:
-    array_len_instrs: list[WasmInstr] = [#
-        WasmInstrMem("i32","load"),
-        WasmInstrConst("i32", 4),
-        WasmInstrNumBinOp("i32","shr_u"),
-        WasmInstrConvOp("i64.extend_i32_u")
-    ]
-    return array_len_instrs
-
-def get_index_check_instructions(indexExp: atomExp,cfg: CompilerConfig) -> list[WasmInstr]:
-    instructions: list[WasmInstr] = []
-    instructions.extend(compileExpressions(indexExp, cfg))
-    instructions.extend(compileExpressions(indexExp, cfg))
-    instructions.append(WasmInstrConst("i64", 0))
-    instructions.append(WasmInstrIntRelOp("i64", "lt_s"))
-    thenInstructions: list[WasmInstr] = [
-        WasmInstrConst("i32", 14),
-        WasmInstrConst("i32", 10),
-        WasmInstrCall(WasmId("$print_err")),
-        WasmInstrTrap()
-    ]
-    instructions.append(WasmInstrIf(None, thenInstructions, []))
-    return instructions
+    return Arrays.lenInstrs()
+
+def indexCheckInstrs(arrayExp: atomExp, indexExp: atomExp, cfg: ArrayCompilerConfig) -> list[WasmInstr]:
+    return Arrays.checkIndexInstrs(compileExpressions(arrayExp, cfg),
+                                   compileExpressions(indexExp, cfg), cfg)
 
-def get_element_size(elem_ty: Type) -> int:
+def get_element_size(elem_ty: ty) -> int:
     return 8 if isinstance(elem_ty, Int) else 4
 
-def arrayOffsetInstrs(arrayExp: atomExp, indexExp: atomExp, cfg: CompilerConfig) -> list[WasmInstr]:
+def arrayOffsetInstrs(arrayExp: atomExp, indexExp: atomExp, node: exp | stmt,
+                      cfg: ArrayCompilerConfig) -> list[WasmInstr]:
 
     wasmInstructions: list[WasmInstr] = []
 
-    wasmInstructions.extend(get_index_check_instructions(indexExp,cfg))
-
-    wasmInstructions.extend(compileExpressions(arrayExp, cfg))
-    wasmInstructions.extend(arrayLenInstrs())
-    wasmInstructions.append(WasmInstrIntRelOp("i64", "ge_s"))
-    thenInstructions: list[WasmInstr] = [
-        WasmInstrConst("i32", 14),
-        WasmInstrConst("i32", 10),
-        WasmInstrCall(WasmId("$print_err")),
-        WasmInstrTrap()
-    ]
-    wasmInstructions.append(WasmInstrIf(None, thenInstructions, []))
-    wasmInstructions.extend(compileExpressions(arrayExp, cfg))
-    wasmInstructions.extend(compileExpressions(indexExp, cfg))
-    wasmInstructions.append(WasmInstrConvOp("i32.wrap_i64"))
+    if id(node) not in cfg.safeSubscripts:
+        wasmInstructions.extend(indexCheckInstrs(arrayExp, indexExp, cfg))
     elem_size = get_element_size(arrayExp.ty.elemTy) if isinstance(arrayExp.ty, Array) else 4
-    wasmInstructions.append(WasmInstrConst("i32", elem_size))
-    wasmInstructions.append(WasmInstrNumBinOp("i32", "mul"))
-    wasmInstructions.append(WasmInstrConst("i32", 4))
-    wasmInstructions.append(WasmInstrNumBinOp("i32", "add"))
-    wasmInstructions.append(WasmInstrNumBinOp("i32", "add"))
-    return wasmInstructions
\ No newline at end of file
+    wasmInstructions.extend(Arrays.elemAddrInstrs(compileExpressions(arrayExp, cfg),
+                                                  compileExpressions(indexExp, cfg), elem_size))
+    return wasmInstructions
@@ -0,0 +1,347 @@
+"""
+Compiler for lang_fun.
+
+Every user-defined function becomes a wasm function, the toplevel code becomes the
+exported function $main. Calls of user-defined functions by name are compiled to call.
+A function value is the index of the function in the function table of the module, so
+calls of all other function expressions go through call_indirect. Calls of small
+functions are inlined before, and self tail calls become loops (see lang_fun.fun_inline
+and lang_fun.fun_tailcall).
+
+Arrays are handled as in the array compiler (see lang_array.array_compilerSupport). With
+the garbage collector, a function whose local variables include arrays pushes a frame
+with a slot for each of them on the shadow stack. Before a call or a collection, the
+function spills its arrays to the frame, and reloads them afterwards.
+"""
+from __future__ import annotations
+from typing import *
+from dataclasses import dataclass, replace
+from common.wasm import *
+from lang_fun.fun_astAtom import *
+import lang_fun.fun_ast as plainAst
+import lang_fun.fun_tychecker as fun_tychecker
+import lang_fun.fun_transform as fun_transform
+import lang_fun.fun_devirtualize as fun_devirtualize
+import lang_fun.fun_inline as fun_inline
+import lang_fun.fun_tailcall as fun_tailcall
+from lang_array.array_compilerSupport import *
+from common.compilerSupport import *
+
+def identToWasmId(x: ident) -> WasmId:
+    return WasmId('$' + x.name)
+
+def funToWasmId(f: ident) -> WasmId:
+    # The prefix avoids clashes with $main and the imported and runtime functions
+    return WasmId('$fun_' + f.name)
+
+frameBase = WasmId('$@frame')
+
+def valtype(t: ty) -> Literal['i32', 'i64']:
+    match t:
+        case Int():
+            return 'i64'
+        case Bool() | Array() | Fun():
+            return 'i32'
+
+def resultValtype(r: resultTy) -> Optional[WasmValtype]:
+    match r:
+        case NotVoid(t):
+            return valtype(t)
+        case Void():
+            return None
+
+def elemSize(t: ty) -> int:
+    return 8 if isinstance(t, Int) else 4
+
+def tyOfExp(e: exp) -> ty:
+    match e.ty:
+        case NotVoid(t):
+            return t
+        case Void():
+            raise ValueError(f'Expression {e} has no value')
+
+@dataclass(frozen=True, kw_only=True)
+class FunCompilerConfig(ArrayCompilerConfig):
+    """
+    Configuration for compiling a function or the toplevel code. funIndices maps every
+    user-defined function to its index in the function table, epilogue pops the frame of
+    the function from the shadow stack.
+    """
+    funIndices: dict[ident, int]
+    epilogue: list[WasmInstr]
+
+def compileAtom(a: atomExp, cfg: FunCompilerConfig) -> list[WasmInstr]:
+    match a:
+        case IntConst(v):
+            return [WasmInstrConst('i64', v)]
+        case BoolConst(b):
+            return [WasmInstrConst('i32', int(b))]
+        case VarName(x):
+            return [WasmInstrVarLocal('get', identToWasmId(x))]
+        case FunName(f):
+            return [WasmInstrConst('i32', cfg.funIndices[f])]
+
+def compileCall(target: callTarget, args: list[exp], cfg: FunCompilerConfig) -> list[WasmInstr]:
+    argInstrs: list[WasmInstr] = []
+    for a in args:
+        argInstrs += compileExp(a, cfg)
+    match target:
+        case CallTargetBuiltin(Ident('print')):
+            printFun = '$print_i64' if isinstance(tyOfExp(args[0]), Int) else '$print_bool'
+            return argInstrs + [WasmInstrCall(WasmId(printFun))]
+        case CallTargetBuiltin(Ident('input_int')):
+            return [WasmInstrCall(WasmId('$input_i64'))]
+        case CallTargetBuiltin(Ident('len')):
+            return argInstrs + Arrays.lenInstrs()
+        case CallTargetBuiltin(f):
+            raise ValueError(f'Unknown builtin function {f.name}')
+        case CallTargetDirect(f):
+            call: list[WasmInstr] = [WasmInstrCall(funToWasmId(f))]
+        case CallTargetIndirect(x, params, result):
+            call = [WasmInstrVarLocal('get', identToWasmId(x)),
+                    WasmInstrCallIndirect([valtype(p) for p in params], resultValtype(result))]
+    # The callee might run a collection
+    if cfg.heap:
+        return cfg.frame.spillInstrs() + argInstrs + call + cfg.frame.reloadInstrs()
+    return argInstrs + call
+
+def compileInitArray(lenInstrs: list[WasmInstr], elemTy: ty, cfg: FunCompilerConfig) -> list[WasmInstr]:
+    """
+    Allocates an array and stores its address in $@tmp_i32, leaving it on the stack.
+    """
+    return Arrays.allocInstrs(lenInstrs, elemSize(elemTy), isinstance(elemTy, Array), cfg) + \
+        [WasmInstrVarLocal('tee', Locals.tmp_i32)]
+
+def constBytes(a: atomExp) -> Optional[bytes]:
+    """
+    Returns the representation of a as an array element in memory if a is a constant.
+    """
+    match a:
+        case IntConst(v):
+            return (v % 2**64).to_bytes(8, 'little')
+        case BoolConst(b):
+            return int(b).to_bytes(4, 'little')
+        case _:
+            return None
+
+def elemAddrInstrs(array: atomExp, index: atomExp, cfg: FunCompilerConfig) -> list[WasmInstr]:
+    arrayInstrs = compileAtom(array, cfg)
+    indexInstrs = compileAtom(index, cfg)
+    match array.ty:
+        case Array(elemTy):
+            size = elemSize(elemTy)
+        case t:
+            raise ValueError(f'Subscript of non-array type {t}')
+    return Arrays.checkIndexInstrs(arrayInstrs, indexInstrs, cfg) + \
+        Arrays.elemAddrInstrs(arrayInstrs, indexInstrs, size)
+
+def compileExp(e: exp, cfg: FunCompilerConfig) -> list[WasmInstr]:
+    match e:
+        case AtomExp(a):
+            return compileAtom(a, cfg)
+        case Call(target, args):
+            return compileCall(target, args, cfg)
+        case UnOp(op, sub):
+            match op:
+                case USub():
+                    return [WasmInstrConst('i64', 0)] + compileExp(sub, cfg) + \
+                        [WasmInstrNumBinOp('i64', 'sub')]
+                case Not():
+                    return compileExp(sub, cfg) + [WasmInstrConst('i32', 0),
+                                                   WasmInstrIntRelOp('i32', 'eq')]
+        case BinOp(left, And(), right):
+            return compileExp(left, cfg) + [WasmInstrIf('i32', compileExp(right, cfg),
+                                                         [WasmInstrConst('i32', 0)])]
+        case BinOp(left, Or(), right):
+            return compileExp(left, cfg) + [WasmInstrIf('i32', [WasmInstrConst('i32', 1)],
+                                                         compileExp(right, cfg))]
+        case BinOp(left, op, right):
+            instrs = compileExp(left, cfg) + compileExp(right, cfg)
+            ty = valtype(tyOfExp(left))
+            match op:
+                case Add():
+                    return instrs + [WasmInstrNumBinOp('i64', 'add')]
+                case Sub():
+                    return instrs + [WasmInstrNumBinOp('i64', 'sub')]
+                case Mul():
+                    return instrs + [WasmInstrNumBinOp('i64', 'mul')]
+                case Less():
+                    return instrs + [WasmInstrIntRelOp('i64', 'lt_s')]
+                case LessEq():
+                    return instrs + [WasmInstrIntRelOp('i64', 'le_s')]
+                case Greater():
+                    return instrs + [WasmInstrIntRelOp('i64', 'gt_s')]
+                case GreaterEq():
+                    return instrs + [WasmInstrIntRelOp('i64', 'ge_s')]
+                case Eq() | Is():
+                    return instrs + [WasmInstrIntRelOp(ty, 'eq')]
+                case NotEq():
+                    return instrs + [WasmInstrIntRelOp(ty, 'ne')]
+                case And() | Or():
+                    raise ValueError('unreachable')
+        case ArrayInitDyn(n, elemInit):
+            elemTy = elemInit.ty
+            return compileInitArray(compileAtom(n, cfg), elemTy, cfg) + \
+                Arrays.fillInstrs(compileAtom(n, cfg), compileAtom(elemInit, cfg),
+                                  elemSize(elemTy), constBytes(elemInit))
+        case ArrayInitStatic(elems):
+            elemTy = elems[0].ty
+            size = elemSize(elemTy)
+            instrs = compileInitArray([WasmInstrConst('i64', len(elems))], elemTy, cfg)
+            if id(e) in cfg.staticArrays.addrs:
+                # All elements are constants, copy them from the data segment
+                return instrs + [
+                    WasmInstrVarLocal('get', Locals.tmp_i32),
+                    WasmInstrConst('i32', 4),
+                    WasmInstrNumBinOp('i32', 'add'),
+                    WasmInstrConst('i32', cfg.staticArrays.addrs[id(e)]),
+                    WasmInstrConst('i32', len(elems) * size),
+                    WasmInstrBulkMem('copy')
+                ]
+            for i, a in enumerate(elems):
+                data = constBytes(a)
+                # The memory of a new array is zero (see HeapLayout)
+                if data is None or any(data):
+                    instrs += [WasmInstrVarLocal('get', Locals.tmp_i32),
+                               WasmInstrConst('i32', 4 + i * size),
+                               WasmInstrNumBinOp('i32', 'add'),
+                               *compileAtom(a, cfg),
+                               WasmInstrMem(valtype(elemTy), 'store')]
+            return instrs
+        case Subscript(array, index):
+            return elemAddrInstrs(array, index, cfg) + [WasmInstrMem(valtype(tyOfExp(e)), 'load')]
+
+def compileStmts(stmts: list[stmt], cfg: FunCompilerConfig) -> list[WasmInstr]:
+    instrs: list[WasmInstr] = []
+    for s in stmts:
+        match s:
+            case StmtExp(e):
+                instrs += compileExp(e, cfg)
+            case Assign(x, e):
+                instrs += compileExp(e, cfg) + [WasmInstrVarLocal('set', identToWasmId(x))]
+            case IfStmt(cond, thenBody, elseBody):
+                instrs += compileExp(cond, cfg) + \
+                    [WasmInstrIf(None, compileStmts(thenBody, cfg), compileStmts(elseBody, cfg))]
+            case WhileStmt(cond, body):
+                loopStart = WasmId('$loop_start')
+                loopEnd = WasmId('$loop_end')
+                instrs.append(WasmInstrBlock(loopEnd, None, [WasmInstrLoop(loopStart, [
+                    *compileExp(cond, cfg),
+                    WasmInstrIf(None, [], [WasmInstrBranch(loopEnd, False)]),
+                    *compileStmts(body, cfg),
+                    WasmInstrBranch(loopStart, False)
+                ])]))
+            case SubscriptAssign(array, index, right):
+                instrs += elemAddrInstrs(array, index, cfg) + compileExp(right, cfg) + \
+                    [WasmInstrMem(valtype(tyOfExp(right)), 'store')]
+            case Return(result):
+                if result is not None:
+                    instrs += compileExp(result, cfg)
+                instrs += cfg.epilogue + [WasmInstrReturn()]
+    return instrs
+
+@dataclass
+class FunBody:
+    """
+    A function (or the toplevel code) after the transformation to atomic expressions, with
+    the local variables besides the parameters.
+    """
+    id: WasmId
+    params: list[FunParam]
+    result: resultTy
+    locals: dict[ident, ty]
+    stmts: list[stmt]
+    def roots(self) -> list[WasmId]:
+        vars = [(p.var, p.ty) for p in self.params] + list(self.locals.items())
+        return [identToWasmId(x) for (x, t) in vars if isinstance(t, Array)]
+
+def transFun(id: WasmId, params: list[FunParam], result: resultTy,
+             locals: list[fun_tychecker.LocalVar], stmts: list[plainAst.stmt],
+             inliner: Optional[fun_inline.Inliner],
+             tailCallsOf: Optional[plainAst.FunDef] = None) -> FunBody:
+    ctx = fun_transform.funCtx(params, [v.name for v in locals])
+    if tailCallsOf:
+        stmts = fun_tailcall.eliminateTailCalls(tailCallsOf, ctx)
+    if inliner:
+        stmts = inliner.inlineFun(stmts, ctx)
+    atomStmts = fun_transform.transStmts(stmts, ctx)
+    allLocals = {v.name: v.ty for v in locals}
+    allLocals.update(ctx.freshVars)
+    return FunBody(id, params, result, allLocals, atomStmts)
+
+def compileFun(f: FunBody, cfg: FunCompilerConfig, toplevel: bool = False) -> WasmFunc:
+    params: list[tuple[WasmId, WasmValtype]] = [(identToWasmId(p.var), valtype(p.ty)) for p in f.params]
+    locals: list[tuple[WasmId, WasmValtype]] = [(identToWasmId(x), valtype(t)) for (x, t) in f.locals.items()]
+    locals += Locals.decls()
+    roots = f.roots()
+    prologue: list[WasmInstr] = []
+    heap = cfg.heap
+    if toplevel:
+        # The roots of the toplevel code have fixed slots
+        cfg = replace(cfg, frame=Frame(roots), epilogue=[])
+    elif heap and roots:
+        # Push the frame of the function on the shadow stack
+        cfg = replace(cfg, frame=Frame(roots, frameBase),
+                      epilogue=[WasmInstrVarLocal('get', frameBase),
+                                WasmInstrVarGlobal('set', Globals.stackPtr)])
+        locals.append((frameBase, 'i32'))
+        prologue = [
+            WasmInstrVarGlobal('get', Globals.stackPtr),
+            WasmInstrVarLocal('tee', frameBase),
+            WasmInstrConst('i32', 4 * len(roots)),
+            WasmInstrNumBinOp('i32', 'add'),
+            WasmInstrVarLocal('tee', Locals.tmp_i32),
+            WasmInstrVarGlobal('set', Globals.stackPtr),
+            WasmInstrVarLocal('get', Locals.tmp_i32),
+            WasmInstrConst('i32', heap.staticStart),
+            WasmInstrIntRelOp('i32', 'gt_u'),
+            WasmInstrIf(None, [WasmInstrCall(Runtime.trapRecursion)], [])
+        ]
+    else:
+        cfg = replace(cfg, frame=Frame([]), epilogue=[])
+    instrs = prologue + compileStmts(f.stmts, cfg)
+    result = resultValtype(f.result)
+    if result is None:
+        instrs += cfg.epilogue
+    else:
+        # The type checker ensures that the function returns on every path
+        instrs.append(WasmInstrTrap())
+    return WasmFunc(f.id, params, result, locals, instrs)
+
+def compileModule(m: plainAst.mod, cfg: CompilerConfig) -> WasmModule:
+    """
+    Compiles the given module to a wasm module.
+    """
+    vars = fun_tychecker.tycheckModule(m)
+    inliner = fun_inline.Inliner(m, vars) if cfg.inlineCalls else None
+    funs = [transFun(funToWasmId(f.name), f.params, f.result, vars.funLocals[f.name], f.body,
+                     inliner, f if cfg.tailCalls else None)
+            for f in m.funs]
+    idMain = WasmId('$main')
+    main = transFun(idMain, [], Void(), vars.toplevelLocals, m.stmts, inliner)
+    fun_devirtualize.devirtualize(
+        Module([FunDef(f.name, f.params, f.result, body.stmts) for (f, body) in zip(m.funs, funs)],
+               main.stmts))
+    memSize = cfg.maxMemSize * CompilerConfig.pageSize
+    stackSize = 0
+    if any([f.roots() for f in funs]):
+        stackSize = min(HeapLayout.maxStackSize, memSize // 64 * 8)
+    mainRoots = main.roots()
+    heap = HeapLayout(mainRoots, memSize, 0, stackSize) if cfg.gc else None
+    staticData = StaticArrays.collect([f.stmts for f in funs + [main]], ArrayInitStatic, constBytes)
+    statics = StaticArrays.layout(staticData, heap.staticStart if heap else HeapLayout.rootsStart)
+    if heap:
+        heap = replace(heap, staticSize=statics.size)
+    funCfg = FunCompilerConfig(cfg.maxMemSize, cfg.maxArraySize, cfg.gc, cfg.inlineFastPath,
+                               heap=heap, staticArrays=statics,
+                               funIndices={f.name: i for i, f in enumerate(m.funs)},
+                               epilogue=[])
+    wasmFuns = [compileFun(f, funCfg) for f in funs]
+    mainFun = compileFun(main, funCfg, toplevel=True)
+    return WasmModule(imports=wasmImports(heap.memPages if heap else cfg.maxMemSize),
+                      exports=[WasmExport('main', WasmExportFunc(idMain))],
+                      globals=Globals.decls(heap, statics.size),
+                      data=Errors.data() + statics.data,
+                      funcTable=WasmFuncTable([f.id for f in funs]),
+                      funcs=Runtime.link(heap, [mainFun] + wasmFuns) +
+                        (Gc.funcs(heap) if heap else []))
@@ -0,0 +1,186 @@
+"""
+Interpreter for lang_array that first compiles the type-checked AST into python closures.
+
+Every AST node is visited exactly once. The result is a tree of pre-specialized closures:
+operators are resolved to functions from the operator module, builtin functions are bound
+ahead of time, and constant operands are baked into the closures. Running the program then
+only calls closures, without any further pattern matching on the AST.
+
+Variables are resolved to slots before running the program: every variable in the symtab
+of the type checker gets a fixed index, and the environment is a list with one entry per
+slot. Looking up a variable is then an index operation instead of hashing an Ident.
+
+The semantics is the same as in array_interp, which remains the reference implementation.
+"""
+from lang_array.array_ast import *
+import lang_array.array_tychecker as array_tychecker
+from lang_array.array_interp import Store
+import common.utils as utils
+import common.log as log
+from common.genericInterp import InterpConfig
+from typing import *
+import operator
+
+type Env = list[Any]
+type ExpFun = Callable[[Env], Any]
+type StmtFun = Callable[[Env], None]
+
+binOps: dict[type, Callable[[Any, Any], Any]] = {
+    Add: operator.add,
+    Sub: operator.sub,
+    Mul: operator.mul,
+    Less: operator.lt,
+    LessEq: operator.le,
+    Greater: operator.gt,
+    GreaterEq: operator.ge,
+    Eq: operator.eq,
+    NotEq: operator.ne,
+    Is: operator.eq # compare Address values by ==
+}
+
+class Ctx:
+    """
+    Context for compiling a module: the store and the slot index of every variable.
+    """
+    def __init__(self, store: Store, slots: dict[Ident, int]):
+        self.store = store
+        self.slots = slots
+
+def slotsFromSymtab(st: array_tychecker.Symtab) -> dict[Ident, int]:
+    return {x: i for i, (x, _) in enumerate(st.types('var'))}
+
+def compileFuncall(id: ident, args: list[exp], ctx: Ctx) -> ExpFun:
+    match (id.name, args):
+        case ('input_int', []):
+            inputInt = utils.inputInt
+            return lambda env: inputInt('Enter some int: ')
+        case ('print', [e]):
+            f = compileExp(e, ctx)
+            def printFun(env: Env) -> None:
+                print(f(env))
+            return printFun
+        case ('len', [e]):
+            f = compileExp(e, ctx)
+            resolve = ctx.store.resolve
+            return lambda env: len(resolve(f(env)))
+        case _:
+            raise ValueError(f'Invalid function call of {id.name} with {len(args)} arguments')
+
+def compileBinOp(left: exp, op: binaryop, right: exp, ctx: Ctx) -> ExpFun:
+    l = compileExp(left, ctx)
+    r = compileExp(right, ctx)
+    match op:
+        case And():
+            return lambda env: l(env) and r(env)
+        case Or():
+            return lambda env: l(env) or r(env)
+        case _:
+            pass
+    fun = binOps[type(op)]
+    match (left, right):
+        case (Name(x), IntConst(c)):
+            i = ctx.slots[x]
+            return lambda env: fun(env[i], c)
+        case (Name(x), Name(y)):
+            i = ctx.slots[x]
+            j = ctx.slots[y]
+            return lambda env: fun(env[i], env[j])
+        case (_, IntConst(c)):
+            return lambda env: fun(l(env), c)
+        case _:
+            return lambda env: fun(l(env), r(env))
+
+def compileExp(e: exp, ctx: Ctx) -> ExpFun:
+    match e:
+        case IntConst(value):
+            return lambda env: value
+        case BoolConst(value):
+            return lambda env: value
+        case Call(id, args):
+            return compileFuncall(id, args, ctx)
+        case UnOp(op, sub):
+            f = compileExp(sub, ctx)
+            match op:
+                case USub(): return lambda env: -f(env)
+                case Not(): return lambda env: not f(env)
+        case BinOp(left, op, right):
+            return compileBinOp(left, op, right, ctx)
+        case Name(name):
+            slot = ctx.slots[name]
+            return lambda env: env[slot]
+        case ArrayInitDyn(lenExp, initExp):
+            n = compileExp(lenExp, ctx)
+            v = compileExp(initExp, ctx)
+            allocFilled = ctx.store.allocFilled
+            return lambda env: allocFilled(n(env), v(env))
+        case ArrayInitStatic(es):
+            fs = [compileExp(e, ctx) for e in es]
+            alloc = ctx.store.alloc
+            return lambda env: alloc([f(env) for f in fs])
+        case Subscript(arrayExp, indexExp):
+            a = compileExp(arrayExp, ctx)
+            i = compileExp(indexExp, ctx)
+            load = ctx.store.load
+            return lambda env: load(a(env), i(env))
+    raise Exception(f'No match for expression {e}')
+
+def compileStmt(s: stmt, ctx: Ctx) -> StmtFun:
+    match s:
+        case StmtExp(e):
+            return compileExp(e, ctx)
+        case Assign(x, e):
+            f = compileExp(e, ctx)
+            slot = ctx.slots[x]
+            def assign(env: Env) -> None:
+                env[slot] = f(env)
+            return assign
+        case IfStmt(cond, thenBody, elseBody):
+            c = compileExp(cond, ctx)
+            thenFun = compileStmts(thenBody, ctx)
+            elseFun = compileStmts(elseBody, ctx)
+            def ifStmt(env: Env) -> None:
+                if c(env):
+                    thenFun(env)
+                else:
+                    elseFun(env)
+            return ifStmt
+        case WhileStmt(cond, body):
+            c = compileExp(cond, ctx)
+            bodyFun = compileStmts(body, ctx)
+            def whileStmt(env: Env) -> None:
+                while c(env):
+                    bodyFun(env)
+            return whileStmt
+        case SubscriptAssign(leftExp, idxExp, rightExp):
+            i = compileExp(idxExp, ctx)
+            r = compileExp(rightExp, ctx)
+            a = compileExp(leftExp, ctx)
+            storeValue = ctx.store.storeValue
+            def subscriptAssign(env: Env) -> None:
+                idx = i(env)
+                v = r(env)
+                storeValue(a(env), idx, v)
+            return subscriptAssign
+
+def compileStmts(stmts: list[stmt], ctx: Ctx) -> StmtFun:
+    fs = [compileStmt(s, ctx) for s in stmts]
+    match fs:
+        case []:
+            return lambda env: None
+        case [f]:
+            return f
+        case _:
+            def seq(env: Env) -> None:
+                for f in fs:
+                    f(env)
+            return seq
+
+def interpModule(m: mod, cfg: InterpConfig = InterpConfig()):
+    utils.assertType(m, Module)
+    st = array_tychecker.tycheckModule(m)
+    store = Store()
+    ctx = Ctx(store, slotsFromSymtab(st))
+    env: Env = len(ctx.slots) * [None]
+    prog = compileStmts(m.stmts, ctx)
+    prog(env)
+    log.debug(f'After executing program.\nEnv: {env}\nStore: {store}')
@@ -1,5 +1,8 @@
+from __future__ import annotations
 from common.wasm import *
 from common.compilerSupport import *
+from dataclasses import replace
+import dataclasses
 import common.utils as utils
 
 class Errors:
@@ -8,7 +11,9 @@ class Errors:
     """
     arraySize = 'ArraySizeError'
     arrayIndexOutOfBounds = 'IndexError'
-    allErrors = [arraySize, arrayIndexOutOfBounds]
+    outOfMemory = 'MemoryError'
+    recursion = 'RecursionError'
+    allErrors = [arraySize, arrayIndexOutOfBounds, outOfMemory, recursion]
     @staticmethod
     def data() -> list[WasmData]:
         """
@@ -43,18 +48,703 @@ class Globals:
     Class giving access to the names of global variables.
     """
     freePtr = WasmId('$@free_ptr')
+    spaceEnd = WasmId('$@space_end')
+    otherSpace = WasmId('$@other_space')
+    stackPtr = WasmId('$@stack_ptr')
     @staticmethod
-    def decls() -> list[WasmGlobal]:
+    def decls(heap: Optional[HeapLayout] = None, staticSize: int = 0) -> list[WasmGlobal]:
         """
-        Returns a list of Wasm global declarations.
+        Returns a list of Wasm global declarations. Without a heap layout, arrays are
+        allocated by bumping $@free_ptr and never freed. They then start after the
+        staticSize bytes of static array data at HeapLayout.rootsStart.
         """
         errsLen = 0
         for e in Errors.allErrors:
             errsLen += len(e)
-        offset = 100 # must be 4-byte aligned
+        offset = HeapLayout.rootsStart # must be 4-byte aligned
         if errsLen > offset:
             utils.abort(f'Offset for free_ptr is {offset}, but error messages take {errsLen} bytes')
-        return [WasmGlobal(Globals.freePtr, 'i32', True, [WasmInstrConst('i32', 100)])]
+        if heap is None:
+            return [WasmGlobal(Globals.freePtr, 'i32', True,
+                               [WasmInstrConst('i32', arrayAlign(offset + staticSize))])]
+        secondSpace = heap.heapStart + heap.semispaceSize
+        res = [WasmGlobal(Globals.freePtr, 'i32', True, [WasmInstrConst('i32', heap.heapStart)]),
+               WasmGlobal(Globals.spaceEnd, 'i32', True, [WasmInstrConst('i32', secondSpace)]),
+               WasmGlobal(Globals.otherSpace, 'i32', True, [WasmInstrConst('i32', secondSpace)])]
+        if heap.stackSize > 0:
+            res.append(WasmGlobal(Globals.stackPtr, 'i32', True,
+                                  [WasmInstrConst('i32', heap.stackStart)]))
+        return res
+
+def arrayAlign(addr: int) -> int:
+    """
+    Arrays start at addresses 4 (mod 8), so that their i64 elements are 8-byte aligned.
+    Returns the first such address not below addr.
+    """
+    return addr + (4 - addr) % 8
+
+@dataclass(frozen=True)
+class HeapLayout:
+    """
+    Layout of the memory if the garbage collector is enabled:
+
+    0 .. rootsStart:             error messages
+    rootsStart .. stackStart:    one i32 slot for each root of the toplevel code
+    stackStart .. staticStart:   shadow stack of stackSize bytes
+    staticStart .. heapStart:    data of the static arrays (see StaticArrays)
+    heapStart .. end of memory:  two semispaces of size semispaceSize
+
+    The roots are the local variables holding arrays. They are spilled to their slots
+    before a collection and reloaded afterwards, because a collection moves arrays (see
+    Frame). Languages with functions push a frame with the slots for the roots of a
+    function on the shadow stack when calling the function. $@stack_ptr then points
+    to the end of the topmost frame; without functions, stackSize is 0.
+
+    The memory after $@free_ptr is always zero: wasm memory starts zeroed, and the
+    collector clears a semispace after copying the live arrays out of it. Hence,
+    arrays filled with 0 need no initialization.
+
+    memSize is the memory size requested by the user. A semispace is as large as the
+    heap of the allocator without garbage collection in memSize bytes, so enabling the
+    collector never reduces the memory available for live arrays. The memory of the
+    module (memPages) is larger than memSize to hold both semispaces. Both semispaces
+    must fit into the 4GiB addressable with i32, so for a memSize above 2GiB a semispace
+    is smaller than that heap.
+    """
+    roots: list[WasmId]
+    memSize: int # (in bytes)
+    staticSize: int = 0
+    stackSize: int = 0
+    rootsStart = 100
+    maxStackSize = 64 * 1024
+    addrSpaceSize = 2 ** 32
+    @property
+    def stackStart(self) -> int:
+        return HeapLayout.rootsStart + 4 * len(self.roots)
+    @property
+    def staticStart(self) -> int:
+        return self.stackStart + self.stackSize
+    @property
+    def heapStart(self) -> int:
+        return arrayAlign(self.staticStart + self.staticSize)
+    @property
+    def semispaceSize(self) -> int:
+        size = max(self.memSize - arrayAlign(HeapLayout.rootsStart + self.staticSize), 0)
+        maxSize = (HeapLayout.addrSpaceSize - self.heapStart) // 2 // 8 * 8
+        return min((size + 7) // 8 * 8, maxSize)
+    @property
+    def memPages(self) -> int:
+        end = self.heapStart + 2 * self.semispaceSize
+        return (end + CompilerConfig.pageSize - 1) // CompilerConfig.pageSize
+
+@dataclass(frozen=True)
+class StaticArrays:
+    """
+    Array literals whose elements are all constants. The header and the elements of such
+    an array are stored in a data segment, and evaluating the literal copies them into the
+    fresh array with memory.copy.
+    """
+    addrs: dict[int, int] # id of the ArrayInitStatic node -> address of its data
+    data: list[WasmData]
+    size: int # (in bytes)
+    @staticmethod
+    def collect(stmts: list[Any], arrayInitStatic: type,
+                constBytes: Callable[[Any], Optional[bytes]]) -> list[tuple[int, bytes]]:
+        """
+        Returns the ids and the elements in memory of all array literals (nodes of class
+        arrayInitStatic) in stmts whose elements are all constants. constBytes returns the
+        representation of an element in memory if it is a constant. The AST is traversed
+        through the fields of its dataclasses, so this works for the atomic AST of every
+        language with arrays.
+        """
+        result: list[tuple[int, bytes]] = []
+        def visit(x: Any):
+            if isinstance(x, list):
+                for y in cast(list[Any], x):
+                    visit(y)
+            elif isinstance(x, arrayInitStatic):
+                data = [constBytes(e) for e in getattr(x, 'elemInit')]
+                if None not in data:
+                    result.append((id(x), b''.join([d for d in data if d is not None])))
+            elif dataclasses.is_dataclass(x):
+                for f in dataclasses.fields(x):
+                    visit(getattr(x, f.name))
+        visit(stmts)
+        return result
+    @staticmethod
+    def layout(arrays: list[tuple[int, bytes]], start: int) -> StaticArrays:
+        """
+        Places the data of the given arrays (pairs of node id and content) one after
+        another, starting at address start.
+        """
+        addrs: dict[int, int] = {}
+        data: list[WasmData] = []
+        addr = start
+        for (nodeId, content) in arrays:
+            addrs[nodeId] = addr
+            data.append(WasmData(addr, content))
+            addr += len(content)
+        return StaticArrays(addrs, data, addr - start)
+
+@dataclass(frozen=True)
+class Frame:
+    """
+    The roots of the function being compiled and their slots. The slots of the toplevel
+    code start at HeapLayout.rootsStart. The slots of a function are in its frame on the
+    shadow stack, whose address is stored in the local variable base.
+    """
+    roots: list[WasmId]
+    base: Optional[WasmId] = None
+    def slotInstrs(self, i: int) -> list[WasmInstr]:
+        """
+        Returns instructions pushing the address of the slot of the i-th root.
+        """
+        if self.base is None:
+            return [WasmInstrConst('i32', HeapLayout.rootsStart + 4 * i)]
+        elif i == 0:
+            return [WasmInstrVarLocal('get', self.base)]
+        return [WasmInstrVarLocal('get', self.base), WasmInstrConst('i32', 4 * i),
+                WasmInstrNumBinOp('i32', 'add')]
+    def spillInstrs(self) -> list[WasmInstr]:
+        res: list[WasmInstr] = []
+        for i, x in enumerate(self.roots):
+            res += self.slotInstrs(i) + [WasmInstrVarLocal('get', x), WasmInstrMem('i32', 'store')]
+        return res
+    def reloadInstrs(self) -> list[WasmInstr]:
+        res: list[WasmInstr] = []
+        for i, x in enumerate(self.roots):
+            res += self.slotInstrs(i) + [WasmInstrMem('i32', 'load'), WasmInstrVarLocal('set', x)]
+        return res
+
+@dataclass(frozen=True)
+class ArrayCompilerConfig(CompilerConfig):
+    """
+    Configuration for compiling a module with arrays. The heap layout is None if the
+    garbage collector is disabled. safeSubscripts holds the ids of the subscripts that
+    do not need a bounds check (see lang_array.array_rangeAnalysis), staticArrays the
+    array literals that are copied from data segments, frame the roots of the function
+    being compiled.
+    """
+    heap: Optional[HeapLayout] = None
+    safeSubscripts: frozenset[int] = frozenset()
+    staticArrays: StaticArrays = StaticArrays({}, [], 0)
+    frame: Frame = Frame([])
+
+class Gc:
+    """
+    Semispace copying garbage collector (Cheney's algorithm) for arrays.
+
+    An array starts with an i32 header (len << 4) | flags, where bit 1 of the flags is set
+    if the elements are pointers to other arrays, and bit 2 if an element takes 4 instead
+    of 8 bytes (see Arrays.allocInstrs).
+    Bit 0 is always set for a header, so a header without bit 0 is a forwarding address
+    written by the collector after an array has been copied to the other semispace.
+    An array occupies 4 + len * elemSize bytes, rounded up to a multiple of 8 (see
+    sizeInstrs).
+    """
+    collect = WasmId('$@gc_collect')
+    forward = WasmId('$@gc_forward')
+    @staticmethod
+    def sizeInstrs(ty: WasmValtype, lenInstrs: list[WasmInstr],
+                   elemShiftInstrs: list[WasmInstr]) -> list[WasmInstr]:
+        """
+        Returns instructions pushing the number of bytes occupied by an array, given
+        instructions pushing its length and the log2 of its element size (all of type ty).
+        The size is rounded up to a multiple of 8, so that the next array also starts at
+        an address 4 (mod 8).
+        """
+        return lenInstrs + elemShiftInstrs + [
+            WasmInstrNumBinOp(ty, 'shl'),
+            WasmInstrConst(ty, 11), WasmInstrNumBinOp(ty, 'add'),
+            WasmInstrConst(ty, -8), WasmInstrNumBinOp(ty, 'and')
+        ]
+    @staticmethod
+    def headerSizeInstrs(h: WasmId) -> list[WasmInstr]:
+        """
+        Returns instructions pushing the size (an i32) of the array whose header is
+        stored in the local variable h.
+        """
+        return Gc.sizeInstrs('i32', [
+            WasmInstrVarLocal('get', h), WasmInstrConst('i32', 4),
+            WasmInstrNumBinOp('i32', 'shr_u')
+        ], [
+            WasmInstrConst('i32', 3),
+            WasmInstrVarLocal('get', h), WasmInstrConst('i32', 2),
+            WasmInstrNumBinOp('i32', 'shr_u'),
+            WasmInstrConst('i32', 1), WasmInstrNumBinOp('i32', 'and'),
+            WasmInstrNumBinOp('i32', 'sub')
+        ])
+    @staticmethod
+    def fitsInstrs(sizeInstrs: list[WasmInstr]) -> list[WasmInstr]:
+        """
+        Returns instructions pushing whether an array of the given size (an i64 in bytes)
+        fits into the current semispace. The size is compared in i64, so that it cannot
+        wrap around for a large maximal array size.
+        """
+        return [WasmInstrVarGlobal('get', Globals.freePtr),
+                WasmInstrConvOp('i64.extend_i32_u'),
+                *sizeInstrs,
+                WasmInstrNumBinOp('i64', 'add'),
+                WasmInstrVarGlobal('get', Globals.spaceEnd),
+                WasmInstrConvOp('i64.extend_i32_u'),
+                WasmInstrIntRelOp('i64', 'le_u')]
+    @staticmethod
+    def ensureSpace(sizeInstrs: list[WasmInstr], frame: Frame) -> list[WasmInstr]:
+        """
+        Returns instructions that run a collection if there is no room for an array
+        of the given size (an i64 in bytes) in the current semispace. The instructions
+        must be executed with an empty operand stack and before the array is allocated.
+        """
+        def fits() -> list[WasmInstr]:
+            return Gc.fitsInstrs(sizeInstrs)
+        return fits() + [
+            WasmInstrIf(None, [], Gc.collectInstrs(frame) + fits() +
+                        [WasmInstrIf(None, [], [WasmInstrCall(Runtime.trapOutOfMemory)])])
+        ]
+    @staticmethod
+    def collectInstrs(frame: Frame) -> list[WasmInstr]:
+        """
+        Returns instructions that run a collection. The roots are local variables of the
+        function executing the instructions, so they are spilled and reloaded around the
+        call of the collector.
+        """
+        return frame.spillInstrs() + [WasmInstrCall(Gc.collect)] + frame.reloadInstrs()
+    @staticmethod
+    def funcs(heap: HeapLayout) -> list[WasmFunc]:
+        """
+        Returns the definitions of the functions implementing the collector.
+        """
+        return [Gc.__forwardFunc(), Gc.__collectFunc(heap)]
+    @staticmethod
+    def __forwardFunc() -> WasmFunc:
+        # Copies the array at $p to the other semispace (unless this already happened)
+        # and returns its new address. The padding of an array is never written, so copying
+        # it keeps the memory after $@free_ptr zero.
+        p = WasmId('$p')
+        h = WasmId('$h')
+        size = WasmId('$size')
+        new = WasmId('$new')
+        copy: list[WasmInstr] = [
+            *Gc.headerSizeInstrs(h),
+            WasmInstrVarLocal('set', size),
+            WasmInstrVarGlobal('get', Globals.freePtr),
+            WasmInstrVarLocal('tee', new),
+            WasmInstrVarLocal('get', p),
+            WasmInstrVarLocal('get', size),
+            WasmInstrBulkMem('copy'),
+            WasmInstrVarGlobal('get', Globals.freePtr), WasmInstrVarLocal('get', size),
+            WasmInstrNumBinOp('i32', 'add'),
+            WasmInstrVarGlobal('set', Globals.freePtr),
+            WasmInstrVarLocal('get', p), WasmInstrVarLocal('get', new),
+            WasmInstrMem('i32', 'store'),
+            WasmInstrVarLocal('get', new)
+        ]
+        instrs: list[WasmInstr] = [
+            WasmInstrVarLocal('get', p),
+            WasmInstrConst('i32', 0), WasmInstrIntRelOp('i32', 'eq'),
+            WasmInstrIf('i32', [WasmInstrConst('i32', 0)], [
+                WasmInstrVarLocal('get', p), WasmInstrMem('i32', 'load'),
+                WasmInstrVarLocal('tee', h),
+                WasmInstrConst('i32', 1), WasmInstrNumBinOp('i32', 'and'),
+                WasmInstrIf('i32', copy, [WasmInstrVarLocal('get', h)])
+            ])
+        ]
+        return WasmFunc(Gc.forward, [(p, 'i32')], 'i32',
+                        [(h, 'i32'), (size, 'i32'), (new, 'i32')], instrs)
+    @staticmethod
+    def __forwardSlots(start: list[WasmInstr], end: list[WasmInstr], label: str) -> list[WasmInstr]:
+        # Forwards all pointers stored in the i32 slots from start (inclusive) to end (exclusive).
+        q = WasmId('$q')
+        qEnd = WasmId('$q_end')
+        done = WasmId(f'${label}_done')
+        loop = WasmId(f'${label}')
+        return start + [WasmInstrVarLocal('set', q)] + end + [WasmInstrVarLocal('set', qEnd)] + [
+            WasmInstrBlock(done, None, [WasmInstrLoop(loop, [
+                WasmInstrVarLocal('get', q), WasmInstrVarLocal('get', qEnd),
+                WasmInstrIntRelOp('i32', 'ge_u'),
+                WasmInstrBranch(done, True),
+                WasmInstrVarLocal('get', q),
+                WasmInstrVarLocal('get', q), WasmInstrMem('i32', 'load'),
+                WasmInstrCall(Gc.forward),
+                WasmInstrMem('i32', 'store'),
+                WasmInstrVarLocal('get', q), WasmInstrConst('i32', 4),
+                WasmInstrNumBinOp('i32', 'add'),
+                WasmInstrVarLocal('set', q),
+                WasmInstrBranch(loop, False)
+            ])])
+        ]
+    @staticmethod
+    def __collectFunc(heap: HeapLayout) -> WasmFunc:
+        scan = WasmId('$scan')
+        h = WasmId('$h')
+        # The roots of the toplevel code are followed by the frames on the shadow stack
+        if heap.stackSize > 0:
+            rootsEnd: list[WasmInstr] = [WasmInstrVarGlobal('get', Globals.stackPtr)]
+        else:
+            rootsEnd = [WasmInstrConst('i32', heap.stackStart)]
+        scanPointers = Gc.__forwardSlots(
+            [WasmInstrVarLocal('get', scan), WasmInstrConst('i32', 4), WasmInstrNumBinOp('i32', 'add')],
+            [WasmInstrVarLocal('get', scan), WasmInstrConst('i32', 4), WasmInstrNumBinOp('i32', 'add'),
+             WasmInstrVarLocal('get', h), WasmInstrConst('i32', 4), WasmInstrNumBinOp('i32', 'shr_u'),
+             WasmInstrConst('i32', 4), WasmInstrNumBinOp('i32', 'mul'),
+             WasmInstrNumBinOp('i32', 'add')],
+            'scan_elems')
+        scanLoop: list[WasmInstr] = [
+            WasmInstrVarLocal('get', scan), WasmInstrVarGlobal('get', Globals.freePtr),
+            WasmInstrIntRelOp('i32', 'ge_u'),
+            WasmInstrBranch(WasmId('$scan_done'), True),
+            WasmInstrVarLocal('get', scan), WasmInstrMem('i32', 'load'),
+            WasmInstrVarLocal('tee', h),
+            WasmInstrConst('i32', 2), WasmInstrNumBinOp('i32', 'and'),
+            WasmInstrIf(None, scanPointers, []),
+            WasmInstrVarLocal('get', scan),
+            *Gc.headerSizeInstrs(h),
+            WasmInstrNumBinOp('i32', 'add'),
+            WasmInstrVarLocal('set', scan),
+            WasmInstrBranch(WasmId('$scan'), False)
+        ]
+        instrs: list[WasmInstr] = [
+            # Copying starts at the beginning of the other semispace
+            WasmInstrVarGlobal('get', Globals.otherSpace),
+            WasmInstrVarLocal('tee', scan),
+            WasmInstrVarGlobal('set', Globals.freePtr),
+            *Gc.__forwardSlots([WasmInstrConst('i32', HeapLayout.rootsStart)],
+                               rootsEnd, 'roots'),
+            WasmInstrBlock(WasmId('$scan_done'), None, [WasmInstrLoop(WasmId('$scan'), scanLoop)]),
+            # Swap the semispaces: the start of the old one is the sum of both starts
+            # minus the start of the new one
+            WasmInstrConst('i32', 2 * heap.heapStart + heap.semispaceSize),
+            WasmInstrVarGlobal('get', Globals.otherSpace),
+            WasmInstrNumBinOp('i32', 'sub'),
+            WasmInstrVarGlobal('get', Globals.otherSpace),
+            WasmInstrConst('i32', heap.semispaceSize),
+            WasmInstrNumBinOp('i32', 'add'),
+            WasmInstrVarGlobal('set', Globals.spaceEnd),
+            WasmInstrVarGlobal('set', Globals.otherSpace),
+            # Clear the old semispace, so that all memory after $@free_ptr is zero
+            WasmInstrVarGlobal('get', Globals.otherSpace),
+            WasmInstrConst('i32', 0),
+            WasmInstrConst('i32', heap.semispaceSize),
+            WasmInstrBulkMem('fill')
+        ]
+        return WasmFunc(Gc.collect, [], None,
+                        [(scan, 'i32'), (h, 'i32'), (WasmId('$q'), 'i32'), (WasmId('$q_end'), 'i32')],
+                        instrs)
+
+class Runtime:
+    """
+    Runtime functions emitted once per module, so that the code for allocating arrays,
+    checking indices and reporting errors is not repeated at every use:
+
+    $rt_alloc (len i64, maxLen i64, flags i32) -> i32
+        Allocates an array of len elements with header flags (see Gc), which also give
+        the size of an element, and returns its address. The length must not exceed maxLen, the maximal array size divided by the
+        size of an element. With the garbage collector, $rt_alloc returns 0 if the array
+        does not fit into the current semispace.
+    $rt_check_index (arr i32, idx i64)
+        Traps unless 0 <= idx < len(arr).
+    $rt_trap_index, $rt_trap_size, $rt_trap_oom, $rt_trap_recursion
+        Print the error message and trap.
+
+    With CompilerConfig.inlineFastPath (the default), the compiler inlines allocations and
+    checks, and only calls the trap functions if a check fails. Calling $rt_alloc and
+    $rt_check_index gives smaller but slower code.
+
+    A trap function is only emitted if it is called at least minTrapCalls times. Otherwise
+    its body replaces the calls: an inlined trap takes 5 bytes more than a call, but
+    a trap function with its entry in the name section takes about 26 bytes.
+    """
+    alloc = WasmId('$rt_alloc')
+    checkIndex = WasmId('$rt_check_index')
+    trapIndex = WasmId('$rt_trap_index')
+    trapSize = WasmId('$rt_trap_size')
+    trapOutOfMemory = WasmId('$rt_trap_oom')
+    trapRecursion = WasmId('$rt_trap_recursion')
+    minTrapCalls = 6
+    @staticmethod
+    def allocInstrs(lenInstrs: list[WasmInstr], maxLen: int, flags: int,
+                    heap: Optional[HeapLayout], frame: Frame) -> list[WasmInstr]:
+        """
+        Returns instructions calling $rt_alloc, leaving the address of the new array on
+        the stack. With a heap layout, they run a collection if the array does not fit.
+        """
+        call: list[WasmInstr] = lenInstrs + [WasmInstrConst('i64', maxLen),
+                                             WasmInstrConst('i32', flags),
+                                             WasmInstrCall(Runtime.alloc)]
+        if heap is None:
+            return call
+        failed: list[WasmInstr] = [WasmInstrVarLocal('tee', Locals.tmp_i32),
+                                   WasmInstrConst('i32', 0),
+                                   WasmInstrIntRelOp('i32', 'eq')]
+        return call + failed + [
+            WasmInstrIf(None, Gc.collectInstrs(frame) + call + failed +
+                        [WasmInstrIf(None, [WasmInstrCall(Runtime.trapOutOfMemory)], [])], []),
+            WasmInstrVarLocal('get', Locals.tmp_i32)
+        ]
+    @staticmethod
+    def link(heap: Optional[HeapLayout], funcs: list[WasmFunc]) -> list[WasmFunc]:
+        """
+        Returns funcs followed by the definitions of the runtime functions they call,
+        directly or through other runtime functions. Calls of trap functions called less
+        than minTrapCalls times are replaced by the body of the trap function.
+        """
+        def trap(id: WasmId, error: str) -> WasmFunc:
+            return WasmFunc(id, [], None, [], Errors.outputError(error) + [WasmInstrTrap()])
+        traps = [trap(Runtime.trapIndex, Errors.arrayIndexOutOfBounds),
+                 trap(Runtime.trapSize, Errors.arraySize),
+                 trap(Runtime.trapOutOfMemory, Errors.outOfMemory),
+                 trap(Runtime.trapRecursion, Errors.recursion)]
+        trapIds = {f.id for f in traps}
+        # Callers come before the functions they call
+        allFuncs = [Runtime.__allocFunc(heap), Runtime.__checkIndexFunc()] + traps
+        calls: dict[WasmId, int] = {}
+        def countCalls(instrs: list[WasmInstr]):
+            for i in instrs:
+                match i:
+                    case WasmInstrCall(id):
+                        calls[id] = calls.get(id, 0) + 1
+                    case WasmInstrIf(_, thenInstrs, elseInstrs):
+                        countCalls(thenInstrs)
+                        countCalls(elseInstrs)
+                    case WasmInstrLoop(_, body) | WasmInstrBlock(_, _, body):
+                        countCalls(body)
+                    case _:
+                        pass
+        for f in funcs:
+            countCalls(f.instrs)
+        result = list(funcs)
+        inlined: dict[WasmId, list[WasmInstr]] = {}
+        for f in allFuncs:
+            n = calls.get(f.id, 0)
+            if f.id in trapIds and 0 < n < Runtime.minTrapCalls:
+                inlined[f.id] = f.instrs
+            elif n > 0:
+                result.append(f)
+                countCalls(f.instrs)
+        if not inlined:
+            return result
+        return [replace(f, instrs=inlineCalls(f.instrs, inlined)) for f in result]
+    @staticmethod
+    def __allocFunc(heap: Optional[HeapLayout]) -> WasmFunc:
+        n = WasmId('$len')
+        maxLen = WasmId('$max_len')
+        flags = WasmId('$flags')
+        size = WasmId('$size')
+        # A negative length is larger than maxLen when compared unsigned
+        instrs: list[WasmInstr] = [
+            WasmInstrVarLocal('get', n), WasmInstrVarLocal('get', maxLen),
+            WasmInstrIntRelOp('i64', 'gt_u'),
+            WasmInstrIf(None, [WasmInstrCall(Runtime.trapSize)], []),
+            *Gc.sizeInstrs('i64', [WasmInstrVarLocal('get', n)], [
+                WasmInstrConst('i64', 3),
+                WasmInstrVarLocal('get', flags), WasmInstrConst('i32', 2),
+                WasmInstrNumBinOp('i32', 'shr_u'),
+                WasmInstrConst('i32', 1), WasmInstrNumBinOp('i32', 'and'),
+                WasmInstrConvOp('i64.extend_i32_u'),
+                WasmInstrNumBinOp('i64', 'sub')
+            ]),
+            WasmInstrVarLocal('set', size)
+        ]
+        allocate: list[WasmInstr] = [
+            WasmInstrVarGlobal('get', Globals.freePtr),
+            WasmInstrVarLocal('get', n), WasmInstrConvOp('i32.wrap_i64'),
+            WasmInstrConst('i32', 4), WasmInstrNumBinOp('i32', 'shl'),
+            WasmInstrVarLocal('get', flags), WasmInstrNumBinOp('i32', 'xor'),
+            WasmInstrMem('i32', 'store'),
+            WasmInstrVarGlobal('get', Globals.freePtr),
+            WasmInstrVarGlobal('get', Globals.freePtr),
+            WasmInstrVarLocal('get', size), WasmInstrConvOp('i32.wrap_i64'),
+            WasmInstrNumBinOp('i32', 'add'),
+            WasmInstrVarGlobal('set', Globals.freePtr)
+        ]
+        if heap is None:
+            instrs += allocate
+        else:
+            instrs += [
+                *Gc.fitsInstrs([WasmInstrVarLocal('get', size)]),
+                WasmInstrIf('i32', allocate, [WasmInstrConst('i32', 0)])
+            ]
+        return WasmFunc(Runtime.alloc, [(n, 'i64'), (maxLen, 'i64'), (flags, 'i32')], 'i32',
+                        [(size, 'i64')], instrs)
+    @staticmethod
+    def __checkIndexFunc() -> WasmFunc:
+        arr = WasmId('$arr')
+        idx = WasmId('$idx')
+        return WasmFunc(Runtime.checkIndex, [(arr, 'i32'), (idx, 'i64')], None, [], [
+            WasmInstrVarLocal('get', idx),
+            WasmInstrVarLocal('get', arr), WasmInstrMem('i32', 'load'),
+            WasmInstrConst('i32', 4), WasmInstrNumBinOp('i32', 'shr_u'),
+            WasmInstrConvOp('i64.extend_i32_u'),
+            WasmInstrIntRelOp('i64', 'ge_u'),
+            WasmInstrIf(None, [WasmInstrCall(Runtime.trapIndex)], [])
+        ])
+
+def inlineCalls(instrs: list[WasmInstr], bodies: dict[WasmId, list[WasmInstr]]) -> list[WasmInstr]:
+    """
+    Replaces the calls of the functions in bodies, which have neither parameters nor
+    locals, by their bodies.
+    """
+    result: list[WasmInstr] = []
+    for i in instrs:
+        match i:
+            case WasmInstrCall(id) if id in bodies:
+                result += bodies[id]
+            case WasmInstrIf(ty, thenInstrs, elseInstrs):
+                result.append(WasmInstrIf(ty, inlineCalls(thenInstrs, bodies),
+                                          inlineCalls(elseInstrs, bodies)))
+            case WasmInstrLoop(label, body):
+                result.append(WasmInstrLoop(label, inlineCalls(body, bodies)))
+            case WasmInstrBlock(label, ty, body):
+                result.append(WasmInstrBlock(label, ty, inlineCalls(body, bodies)))
+            case _:
+                result.append(i)
+    return result
+
+class Arrays:
+    """
+    Instructions for allocating and accessing arrays, independent of the AST of a language.
+    Expressions are given as instructions pushing their values. An element takes elemSize
+    bytes: 8 for an int, 4 otherwise.
+    """
+    @staticmethod
+    def allocInstrs(lenInstrs: list[WasmInstr], elemSize: int, pointerElems: bool,
+                    cfg: ArrayCompilerConfig) -> list[WasmInstr]:
+        """
+        Returns instructions allocating an array of the given length, leaving its address
+        on the stack. The elements are zero. pointerElems must be True if the elements are
+        arrays (see Gc).
+        """
+        flags = 1 | (2 if pointerElems else 0) | (4 if elemSize == 4 else 0)
+        if not cfg.inlineFastPath:
+            return Runtime.allocInstrs(lenInstrs, cfg.maxArraySize // elemSize, flags,
+                                       cfg.heap, cfg.frame)
+        # A negative length is larger than the maximal length when compared unsigned
+        instrs: list[WasmInstr] = lenInstrs + [
+            WasmInstrConst('i64', cfg.maxArraySize // elemSize),
+            WasmInstrIntRelOp('i64', 'gt_u'),
+            WasmInstrIf(None, [WasmInstrCall(Runtime.trapSize)], [])
+        ]
+        size = Gc.sizeInstrs('i64', lenInstrs, [WasmInstrConst('i64', elemSize.bit_length() - 1)])
+        if cfg.heap:
+            instrs += Gc.ensureSpace(size, cfg.frame)
+        header: list[WasmInstr] = [
+            WasmInstrVarGlobal('get', Globals.freePtr),
+            *lenInstrs,
+            WasmInstrConvOp('i32.wrap_i64'),
+            WasmInstrConst('i32', 4), WasmInstrNumBinOp('i32', 'shl'),
+            WasmInstrConst('i32', flags), WasmInstrNumBinOp('i32', 'xor'),
+            WasmInstrMem('i32', 'store')
+        ]
+        moveFreePtr: list[WasmInstr] = [
+            WasmInstrVarGlobal('get', Globals.freePtr),
+            *size,
+            WasmInstrConvOp('i32.wrap_i64'),
+            WasmInstrVarGlobal('get', Globals.freePtr),
+            WasmInstrNumBinOp('i32', 'add'),
+            WasmInstrVarGlobal('set', Globals.freePtr)
+        ]
+        return instrs + header + moveFreePtr
+    @staticmethod
+    def fillInstrs(lenInstrs: list[WasmInstr], elemInstrs: list[WasmInstr], elemSize: int,
+                   data: Optional[bytes]) -> list[WasmInstr]:
+        """
+        Returns instructions filling all elements of the new array stored in $@tmp_i32 with
+        the value of elemInstrs. data is the representation of this value in memory if it
+        is a constant. New arrays are zero (see HeapLayout), so zero needs no filling. If
+        all bytes of the value are equal, memory.fill is used. Otherwise, the first element
+        is stored, and the filled prefix is repeatedly doubled with memory.copy.
+        """
+        if data is not None and not any(data):
+            return []
+        start = Locals.tmp_i32
+        size = lenInstrs + [
+            WasmInstrConvOp('i32.wrap_i64'),
+            WasmInstrConst('i32', elemSize),
+            WasmInstrNumBinOp('i32', 'mul')
+        ]
+        instrs: list[WasmInstr] = [
+            WasmInstrVarLocal('get', start),
+            WasmInstrConst('i32', 4),
+            WasmInstrNumBinOp('i32', 'add'),
+            WasmInstrVarLocal('set', start)
+        ]
+        if data is not None and len(set(data)) == 1:
+            return instrs + [WasmInstrVarLocal('get', start), WasmInstrConst('i32', data[0])] + \
+                size + [WasmInstrBulkMem('fill')]
+        done = Locals.fillDone
+        doubleLoop: list[WasmInstr] = [
+            WasmInstrVarLocal('get', done), WasmInstrConst('i32', 1),
+            WasmInstrNumBinOp('i32', 'shl'),
+            WasmInstrVarLocal('get', Locals.fillSize),
+            WasmInstrIntRelOp('i32', 'gt_u'),
+            WasmInstrBranch(WasmId('$fill_done'), True),
+            WasmInstrVarLocal('get', start), WasmInstrVarLocal('get', done),
+            WasmInstrNumBinOp('i32', 'add'),
+            WasmInstrVarLocal('get', start),
+            WasmInstrVarLocal('get', done),
+            WasmInstrBulkMem('copy'),
+            WasmInstrVarLocal('get', done), WasmInstrConst('i32', 1),
+            WasmInstrNumBinOp('i32', 'shl'),
+            WasmInstrVarLocal('set', done),
+            WasmInstrBranch(WasmId('$fill'), False)
+        ]
+        fill: list[WasmInstr] = [
+            WasmInstrVarLocal('get', start),
+            *elemInstrs,
+            WasmInstrMem('i64', 'store') if elemSize == 8 else WasmInstrMem('i32', 'store'),
+            WasmInstrConst('i32', elemSize),
+            WasmInstrVarLocal('set', done),
+            WasmInstrBlock(WasmId('$fill_done'), None, [WasmInstrLoop(WasmId('$fill'), doubleLoop)]),
+            # Less than half of the array is left
+            WasmInstrVarLocal('get', start), WasmInstrVarLocal('get', done),
+            WasmInstrNumBinOp('i32', 'add'),
+            WasmInstrVarLocal('get', start),
+            WasmInstrVarLocal('get', Locals.fillSize), WasmInstrVarLocal('get', done),
+            WasmInstrNumBinOp('i32', 'sub'),
+            WasmInstrBulkMem('copy')
+        ]
+        return instrs + size + [
+            WasmInstrVarLocal('tee', Locals.fillSize),
+            WasmInstrConst('i32', 0),
+            WasmInstrIntRelOp('i32', 'ne'),
+            WasmInstrIf(None, fill, [])
+        ]
+    @staticmethod
+    def lenInstrs() -> list[WasmInstr]:
+        """
+        Returns instructions replacing the address of an array on the stack by its length.
+        """
+        return [WasmInstrMem('i32', 'load'),
+                WasmInstrConst('i32', 4),
+                WasmInstrNumBinOp('i32', 'shr_u'),
+                WasmInstrConvOp('i64.extend_i32_u')]
+    @staticmethod
+    def checkIndexInstrs(arrayInstrs: list[WasmInstr], indexInstrs: list[WasmInstr],
+                         cfg: ArrayCompilerConfig) -> list[WasmInstr]:
+        """
+        Returns instructions trapping unless the index is valid for the array.
+        """
+        if not cfg.inlineFastPath:
+            return arrayInstrs + indexInstrs + [WasmInstrCall(Runtime.checkIndex)]
+        # A single unsigned comparison covers both index < 0 and index >= len
+        return indexInstrs + arrayInstrs + Arrays.lenInstrs() + [
+            WasmInstrIntRelOp('i64', 'ge_u'),
+            WasmInstrIf(None, [WasmInstrCall(Runtime.trapIndex)], [])
+        ]
+    @staticmethod
+    def elemAddrInstrs(arrayInstrs: list[WasmInstr], indexInstrs: list[WasmInstr],
+                       elemSize: int) -> list[WasmInstr]:
+        """
+        Returns instructions pushing the address of an element, without checking the index.
+        """
+        return arrayInstrs + indexInstrs + [
+            WasmInstrConvOp('i32.wrap_i64'),
+            WasmInstrConst('i32', elemSize),
+            WasmInstrNumBinOp('i32', 'mul'),
+            WasmInstrConst('i32', 4),
+            WasmInstrNumBinOp('i32', 'add'),
+            WasmInstrNumBinOp('i32', 'add')
+        ]
 
 class Locals:
     """
@@ -62,10 +752,14 @@ class Locals:
     """
     tmp_i32 = WasmId('$@tmp_i32')
     tmp_i64 = WasmId('$@tmp_i64')
+    fillDone = WasmId('$@fill_done') # bytes of an array already filled
+    fillSize = WasmId('$@fill_size') # bytes of all elements of an array
     @staticmethod
     def decls() -> list[tuple[WasmId, WasmValtype]]:
         """
         Returns a list of local variable declarations to be used in a function definition.
         """
         return [(Locals.tmp_i32, 'i32'),
-                (Locals.tmp_i64, 'i64')]
+                (Locals.tmp_i64, 'i64'),
+                (Locals.fillDone, 'i32'),
+                (Locals.fillSize, 'i32')]
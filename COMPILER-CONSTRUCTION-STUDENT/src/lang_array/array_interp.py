@@ -2,34 +2,26 @@ from lang_array.array_ast import *
 import lang_array.array_tychecker as array_tychecker
 import common.utils as utils
 import common.log as log
+from common.genericInterp import InterpConfig
+import common.interpStore as interpStore
+from common.interpStore import Address
 from typing import *
-
-@dataclass(frozen=True)
-class Address:
-    value: int
-    def __repr__(self):
-        return f'Address({self.value})'
+import sys
 
 type Env = dict[Ident, TyValue]
 type TyValue = int | bool | Address
-type StoreValue = list[TyValue]
 
-class Store:
-    def __init__(self):
-        self.content: dict[Address, StoreValue] = {}
-        self.__freshAddress = Address(0)
-    def alloc(self, val: StoreValue):
-        x = self.__freshAddress
-        self.__freshAddress = Address(x.value + 1)
-        self.content[x] = val
-        return x
-    def resolve(self, a: Address) -> StoreValue:
-        return self.content[a]
-    def storeValue(self, a: Address, i: int, v: TyValue):
-        l = self.content[a]
-        l[i] = v
-    def __repr__(self):
-        return f'Store({self.content})'
+class Store(interpStore.Store[TyValue]):
+    """
+    The store of lang_array (see common.interpStore). The roots of a garbage collection
+    are the environments in frames. Collections only happen between two statements,
+    where no array is referenced solely from the python stack of the interpreter.
+    """
+    def __init__(self, gcThreshold: Optional[int] = None):
+        super().__init__(gcThreshold)
+        self.frames: list[Env] = []
+    def roots(self) -> Iterable[TyValue]:
+        return [v for env in self.frames for v in env.values()]
 
 def interpFuncall(id: ident, args: list[exp], env: Env, store: Store) -> Optional[TyValue]:
     match (id.name, args):
@@ -46,7 +38,7 @@ def interpFuncall(id: ident, args: list[exp], env: Env, store: Store) -> Optiona
             raise ValueError(f'Invalid function call of {id.name} with {len(args)} arguments')
 
 def asInt(v: Optional[TyValue]) -> int:
-    assert isinstance(v, int)
+    assert isinstance(v, int) and type(v) is not Address
     return v
 
 def asBool(v: Optional[TyValue]) -> bool:
@@ -102,53 +94,50 @@ def interpExp(e: exp, env: Env, store: Store) -> Optional[TyValue]:
         case ArrayInitDyn(lenExp, initExp):
             n = asInt(interpExp(lenExp, env, store))
             v = asValue(interpExp(initExp, env, store))
-            return store.alloc(n * [v])
+            return store.allocFilled(n, v)
         case ArrayInitStatic(es):
             l = [asValue(interpExp(e, env, store)) for e in es]
             return store.alloc(l)
         case Subscript(arrayExp, indexExp):
             a = asAddress(interpExp(arrayExp, env, store))
             i = asInt(interpExp(indexExp, env, store))
-            l = store.resolve(a)
-            return l[i]
+            return store.load(a, i)
     raise Exception(f'No match for expression {e}')
 
-def interpStmt(s: stmt, env: Env, store: Store, cont: list[stmt]) -> None:
+def interpStmt(s: stmt, env: Env, store: Store) -> None:
     match s:
         case StmtExp(e):
             interpExp(e, env, store)
-            interpStmts(cont, env, store)
         case Assign(x, e):
             v: Any = interpExp(e, env, store)
             env[x] = v
-            interpStmts(cont, env, store)
         case IfStmt(cond, thenBody, elseBody):
             v = asBool(interpExp(cond, env, store))
             if v:
-                interpStmts(thenBody + cont, env, store)
+                interpStmts(thenBody, env, store)
             else:
-                interpStmts(elseBody + cont, env, store)
+                interpStmts(elseBody, env, store)
         case WhileStmt(cond, body):
-            v = asBool(interpExp(cond, env, store))
-            if v:
-                interpStmts(body + [s] + cont, env, store)
-            else:
-                interpStmts(cont, env, store)
+            while asBool(interpExp(cond, env, store)):
+                interpStmts(body, env, store)
         case SubscriptAssign(leftExp, idxExp, rightExp):
             idx = asInt(interpExp(idxExp, env, store))
             v = interpExp(rightExp, env, store)
             a = asAddress(interpExp(leftExp, env, store))
             store.storeValue(a, idx, v)
-            interpStmts(cont, env, store)
 
 def interpStmts(stmts: list[stmt], env: Env, store: Store) -> None:
-    if len(stmts) > 0:
-        interpStmt(stmts[0], env, store, stmts[1:])
+    for s in stmts:
+        store.maybeCollect()
+        interpStmt(s, env, store)
 
-def interpModule(m: mod):
+def interpModule(m: mod, cfg: InterpConfig = InterpConfig()):
     utils.assertType(m, Module)
     array_tychecker.tycheckModule(m)
     env: Env = {}
-    store = Store()
+    store = Store(cfg.gcThreshold)
+    store.frames.append(env)
     interpStmts(m.stmts, env, store)
     log.debug(f'After executing program.\nEnv: {env}\nStore: {store}')
+    if cfg.gcStats:
+        print(f'GC stats: {store.gcStats}', file=sys.stderr)
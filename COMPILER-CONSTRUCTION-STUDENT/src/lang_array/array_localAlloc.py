@@ -0,0 +1,172 @@
+"""
+Allocation of wasm locals for the temporaries introduced by array_transform.
+
+Every non-atomic subexpression gets its own temporary, but most temporaries are only live
+for a few statements. This pass computes liveness over the atom AST, builds an interference
+graph of the temporaries, and colors it greedily: temporaries that are never live at the
+same time share a local. Only temporaries of the same kind share a local: i64 (int), i32
+(bool), and arrays. Arrays are kept apart from bools, because every local holding an array
+is a root of the garbage collector and must never hold anything else.
+
+Variables of the source program keep their own locals.
+"""
+from __future__ import annotations
+from lang_array.array_astAtom import *
+from assembly.graph import Graph
+import common.log as log
+
+def usesAtom(a: atomExp) -> set[ident]:
+    match a:
+        case Name(x):
+            return {x}
+        case _:
+            return set()
+
+def usesExp(e: exp) -> set[ident]:
+    result: set[ident] = set()
+    match e:
+        case AtomExp(a):
+            return usesAtom(a)
+        case Call(_, args):
+            return result.union(*[usesExp(a) for a in args])
+        case UnOp(_, arg):
+            return usesExp(arg)
+        case BinOp(left, _, right):
+            return usesExp(left) | usesExp(right)
+        case ArrayInitDyn(n, elemInit):
+            return usesAtom(n) | usesAtom(elemInit)
+        case ArrayInitStatic(elemInit):
+            return result.union(*[usesAtom(a) for a in elemInit])
+        case Subscript(array, index):
+            return usesAtom(array) | usesAtom(index)
+
+class Interference:
+    """
+    Computes liveness backwards over statements and records which temporaries interfere.
+    A temporary interferes with all temporaries live after an assignment to it.
+    """
+    def __init__(self, temps: dict[ident, ty]):
+        self.temps = temps
+        self.graph: Graph[ident, ty] = Graph('undirected')
+        for x, t in temps.items():
+            self.graph.addVertex(x, t)
+
+    def define(self, x: ident, liveAfter: set[ident]):
+        if x not in self.temps:
+            return
+        for y in liveAfter:
+            if y != x and y in self.temps:
+                self.graph.addEdge(x, y)
+
+    def stmts(self, stmts: list[stmt], liveAfter: set[ident]) -> set[ident]:
+        """
+        Returns the variables live before stmts.
+        """
+        live = liveAfter
+        for s in reversed(stmts):
+            live = self.stmt(s, live)
+        return live
+
+    def stmt(self, s: stmt, liveAfter: set[ident]) -> set[ident]:
+        match s:
+            case StmtExp(e):
+                return liveAfter | usesExp(e)
+            case Assign(x, e):
+                self.define(x, liveAfter)
+                return (liveAfter - {x}) | usesExp(e)
+            case SubscriptAssign(array, index, right):
+                return liveAfter | usesAtom(array) | usesAtom(index) | usesExp(right)
+            case IfStmt(cond, thenBody, elseBody):
+                return usesExp(cond) | self.stmts(thenBody, liveAfter) | \
+                    self.stmts(elseBody, liveAfter)
+            case WhileStmt(cond, body):
+                # The condition is evaluated before every iteration and before leaving the
+                # loop. Iterate until the variables live at the condition are stable.
+                live = liveAfter | usesExp(cond)
+                while True:
+                    newLive = live | self.stmts(body, live)
+                    if newLive == live:
+                        return live
+                    live = newLive
+
+def localKind(t: ty) -> str:
+    match t:
+        case Int():
+            return 'i64'
+        case Bool():
+            return 'i32'
+        case Array():
+            return 'array'
+
+def colorTemporaries(g: Graph[ident, ty]) -> dict[ident, ident]:
+    """
+    Maps every temporary to the temporary whose local it uses. Temporaries are visited in
+    the order of creation, and each gets the first local of its kind that no neighbor uses.
+    """
+    slots: dict[str, list[ident]] = {}
+    assignment: dict[ident, ident] = {}
+    for x in g.vertices:
+        taken = set([assignment[y] for y in g.succs(x) if y in assignment])
+        kindSlots = slots.setdefault(localKind(g.getData(x)), [])
+        for slot in kindSlots:
+            if slot not in taken:
+                assignment[x] = slot
+                break
+        else:
+            kindSlots.append(x)
+            assignment[x] = x
+    return assignment
+
+def renameAtom(a: atomExp, m: dict[ident, ident]) -> atomExp:
+    match a:
+        case Name(x, t):
+            return Name(m.get(x, x), t)
+        case _:
+            return a
+
+def renameExp(e: exp, m: dict[ident, ident]) -> exp:
+    match e:
+        case AtomExp(a, t):
+            return AtomExp(renameAtom(a, m), t)
+        case Call(f, args, t):
+            return Call(f, [renameExp(a, m) for a in args], t)
+        case UnOp(op, arg, t):
+            return UnOp(op, renameExp(arg, m), t)
+        case BinOp(left, op, right, t):
+            return BinOp(renameExp(left, m), op, renameExp(right, m), t)
+        case ArrayInitDyn(n, elemInit, t):
+            return ArrayInitDyn(renameAtom(n, m), renameAtom(elemInit, m), t)
+        case ArrayInitStatic(elemInit, t):
+            return ArrayInitStatic([renameAtom(a, m) for a in elemInit], t)
+        case Subscript(array, index, t):
+            return Subscript(renameAtom(array, m), renameAtom(index, m), t)
+
+def renameStmts(stmts: list[stmt], m: dict[ident, ident]) -> list[stmt]:
+    result: list[stmt] = []
+    for s in stmts:
+        match s:
+            case StmtExp(e):
+                result.append(StmtExp(renameExp(e, m)))
+            case Assign(x, e):
+                result.append(Assign(m.get(x, x), renameExp(e, m)))
+            case SubscriptAssign(array, index, right):
+                result.append(SubscriptAssign(renameAtom(array, m), renameAtom(index, m),
+                                              renameExp(right, m)))
+            case IfStmt(cond, thenBody, elseBody):
+                result.append(IfStmt(renameExp(cond, m), renameStmts(thenBody, m),
+                                     renameStmts(elseBody, m)))
+            case WhileStmt(cond, body):
+                result.append(WhileStmt(renameExp(cond, m), renameStmts(body, m)))
+    return result
+
+def coalesceTemporaries(stmts: list[stmt], temps: dict[ident, ty]) -> tuple[list[stmt], dict[ident, ty]]:
+    """
+    Renames the temporaries in stmts such that temporaries with disjoint live ranges
+    share a name. Returns the new statements and the remaining temporaries.
+    """
+    interference = Interference(temps)
+    interference.stmts(stmts, set())
+    assignment = colorTemporaries(interference.graph)
+    remaining = {x: t for x, t in temps.items() if assignment[x] == x}
+    log.info(f'Coalesced {len(temps)} temporaries into {len(remaining)} locals')
+    return (renameStmts(stmts, assignment), remaining)
@@ -0,0 +1,117 @@
+"""
+Interpreter for lang_array that translates the type-checked AST into python source code
+and runs the result with exec. See lang_loop.loop_pyInterp for the general idea.
+
+Arrays are represented directly by python lists instead of going through a Store. The
+operator `is` only applies to arrays, so comparing lists by identity has the same meaning
+as comparing Address values in array_interp. Python evaluates the right-hand side of a
+subscript assignment first, so the index and the value are stored in temporaries to keep
+the evaluation order of array_interp.
+
+The semantics is the same as in array_interp, which remains the reference implementation.
+"""
+from lang_array.array_ast import *
+import lang_array.array_tychecker as array_tychecker
+import common.utils as utils
+import common.log as log
+from common.genericInterp import InterpConfig
+from typing import *
+
+MAIN_FUN = 'main'
+
+binOps: dict[type, str] = {
+    Add: '+',
+    Sub: '-',
+    Mul: '*',
+    Less: '<',
+    LessEq: '<=',
+    Greater: '>',
+    GreaterEq: '>=',
+    Eq: '==',
+    NotEq: '!=',
+    Is: 'is',
+    And: 'and',
+    Or: 'or'
+}
+
+def pyVar(x: ident) -> str:
+    return f'v_{x.name}'
+
+def transpileFuncall(id: ident, args: list[exp]) -> str:
+    match (id.name, args):
+        case ('input_int', []):
+            return 'input_int()'
+        case ('print', [e]):
+            return f'print({transpileExp(e)})'
+        case ('len', [e]):
+            return f'len({transpileExp(e)})'
+        case _:
+            raise ValueError(f'Invalid function call of {id.name} with {len(args)} arguments')
+
+def transpileExp(e: exp) -> str:
+    match e:
+        case IntConst(value):
+            return repr(value)
+        case BoolConst(value):
+            return repr(value)
+        case Call(id, args):
+            return transpileFuncall(id, args)
+        case UnOp(op, sub):
+            x = transpileExp(sub)
+            match op:
+                case USub(): return f'(-{x})'
+                case Not(): return f'(not {x})'
+        case BinOp(left, op, right):
+            return f'({transpileExp(left)} {binOps[type(op)]} {transpileExp(right)})'
+        case Name(name):
+            return pyVar(name)
+        case ArrayInitDyn(lenExp, initExp):
+            return f'({transpileExp(lenExp)} * [{transpileExp(initExp)}])'
+        case ArrayInitStatic(es):
+            return '[' + ', '.join([transpileExp(e) for e in es]) + ']'
+        case Subscript(arrayExp, indexExp):
+            return f'{transpileExp(arrayExp)}[{transpileExp(indexExp)}]'
+    raise Exception(f'No match for expression {e}')
+
+def transpileStmt(s: stmt, indent: str, out: list[str]):
+    match s:
+        case StmtExp(e):
+            out.append(f'{indent}{transpileExp(e)}')
+        case Assign(x, e):
+            out.append(f'{indent}{pyVar(x)} = {transpileExp(e)}')
+        case IfStmt(cond, thenBody, elseBody):
+            out.append(f'{indent}if {transpileExp(cond)}:')
+            transpileStmts(thenBody, indent + '    ', out)
+            out.append(f'{indent}else:')
+            transpileStmts(elseBody, indent + '    ', out)
+        case WhileStmt(cond, body):
+            out.append(f'{indent}while {transpileExp(cond)}:')
+            transpileStmts(body, indent + '    ', out)
+        case SubscriptAssign(leftExp, idxExp, rightExp):
+            out.append(f'{indent}t_idx = {transpileExp(idxExp)}')
+            out.append(f'{indent}t_val = {transpileExp(rightExp)}')
+            out.append(f'{indent}{transpileExp(leftExp)}[t_idx] = t_val')
+
+def transpileStmts(stmts: list[stmt], indent: str, out: list[str]):
+    if not stmts:
+        out.append(f'{indent}pass')
+    for s in stmts:
+        transpileStmt(s, indent, out)
+
+def transpileModule(m: Module) -> str:
+    """
+    Returns the python source code for the module. Calling the function MAIN_FUN
+    defined by the code runs the program.
+    """
+    out = [f'def {MAIN_FUN}():']
+    transpileStmts(m.stmts, '    ', out)
+    return '\n'.join(out) + '\n'
+
+def interpModule(m: mod, cfg: InterpConfig = InterpConfig()):
+    utils.assertType(m, Module)
+    array_tychecker.tycheckModule(m)
+    src = transpileModule(m)
+    log.debug(f'Generated python code:\n{src}')
+    globals: dict[str, Any] = {'input_int': lambda: utils.inputInt('Enter some int: ')}
+    exec(compile(src, '<lang_array>', 'exec'), globals)
+    globals[MAIN_FUN]()
@@ -0,0 +1,149 @@
+"""
+Range analysis for eliminating array bounds checks.
+
+The analysis finds subscripts a[i] (reading or writing) where i is a variable with
+0 <= i < len(a). Such subscripts do not need a bounds check.
+
+- A variable is non-negative if every assignment to it is a non-negative constant, a call
+  of len, another non-negative variable, or j + c where 0 <= j < len(a) holds at the
+  assignment and 0 <= c <= maxIncrement. The bound on j ensures that the addition cannot
+  wrap around in 64-bit arithmetic. Variables start with 0 in wasm, so this is a property
+  of the whole program. It is computed as a greatest fixpoint: first all variables are
+  assumed non-negative, then variables with other assignments are removed until nothing
+  changes.
+- Inside the body of `while i < len(a)` (also `len(a) > i`, or as the left operand of and),
+  i < len(a) holds until the body assigns to i or a. Arrays never change their length.
+"""
+from __future__ import annotations
+from lang_array.array_astAtom import *
+
+type Fact = tuple[ident, ident] # (i, a) means 0 <= i < len(a)
+
+# The length of an array is below 2^32, so j + c with j < len(a) and c <= maxIncrement
+# stays below 2^63.
+maxIncrement = 2**32
+
+def assignedVars(stmts: list[stmt]) -> set[ident]:
+    """
+    Returns all variables assigned somewhere in stmts.
+    """
+    result: set[ident] = set()
+    for s in stmts:
+        match s:
+            case Assign(x, _):
+                result.add(x)
+            case IfStmt(_, thenBody, elseBody):
+                result |= assignedVars(thenBody) | assignedVars(elseBody)
+            case WhileStmt(_, body):
+                result |= assignedVars(body)
+            case _:
+                pass
+    return result
+
+def condFacts(cond: exp, nonNeg: set[ident]) -> set[Fact]:
+    """
+    Returns the facts that hold if cond evaluates to True.
+    """
+    match cond:
+        case BinOp(AtomExp(Name(i)), Less(), Call(Ident('len'), [AtomExp(Name(a))])) | \
+             BinOp(Call(Ident('len'), [AtomExp(Name(a))]), Greater(), AtomExp(Name(i))) \
+                if i in nonNeg:
+            return {(i, a)}
+        case BinOp(left, And(), right):
+            return condFacts(left, nonNeg) | condFacts(right, nonNeg)
+        case _:
+            return set()
+
+def kill(facts: set[Fact], vars: set[ident]) -> set[Fact]:
+    return set([(i, a) for (i, a) in facts if i not in vars and a not in vars])
+
+class Analysis:
+    """
+    Analyses the statements assuming that the variables in nonNeg are never negative.
+    The variables with an assignment that may violate this assumption end up in
+    notNonNeg.
+    """
+    def __init__(self, nonNeg: set[ident]):
+        self.nonNeg = nonNeg
+        self.notNonNeg: set[ident] = set()
+        self.safe: set[int] = set()
+
+    def isNonNeg(self, e: exp | atomExp, facts: set[Fact]) -> bool:
+        match e:
+            case IntConst(v):
+                return 0 <= v < 2**63
+            case Name(x):
+                return x in self.nonNeg
+            case AtomExp(a):
+                return self.isNonNeg(a, facts)
+            case Call(Ident('len'), _):
+                return True
+            case BinOp(AtomExp(Name(x)), Add(), AtomExp(IntConst(v))) | \
+                 BinOp(AtomExp(IntConst(v)), Add(), AtomExp(Name(x))):
+                return 0 <= v <= maxIncrement and any([i == x for (i, _) in facts])
+            case _:
+                return False
+
+    def checkAccess(self, arr: atomExp, idx: atomExp, node: exp | stmt, facts: set[Fact]):
+        match (arr, idx):
+            case (Name(a), Name(i)) if (i, a) in facts:
+                self.safe.add(id(node))
+            case _:
+                pass
+
+    def exp(self, e: exp, facts: set[Fact]):
+        match e:
+            case Subscript(arr, idx):
+                self.checkAccess(arr, idx, e, facts)
+            case Call(_, args):
+                for a in args:
+                    self.exp(a, facts)
+            case UnOp(_, sub):
+                self.exp(sub, facts)
+            case BinOp(l, _, r):
+                self.exp(l, facts)
+                self.exp(r, facts)
+            case _:
+                pass
+
+    def stmts(self, stmts: list[stmt], facts: set[Fact]) -> set[Fact]:
+        """
+        Analyses stmts with the facts holding before stmts, returns the facts holding after stmts.
+        """
+        for s in stmts:
+            match s:
+                case StmtExp(e):
+                    self.exp(e, facts)
+                case Assign(x, e):
+                    self.exp(e, facts)
+                    if x in self.nonNeg and not self.isNonNeg(e, facts):
+                        self.notNonNeg.add(x)
+                    facts = kill(facts, {x})
+                case SubscriptAssign(arr, idx, right):
+                    self.exp(right, facts)
+                    self.checkAccess(arr, idx, s, facts)
+                case IfStmt(cond, thenBody, elseBody):
+                    self.exp(cond, facts)
+                    f1 = self.stmts(thenBody, facts)
+                    f2 = self.stmts(elseBody, facts)
+                    facts = f1 & f2
+                case WhileStmt(cond, body):
+                    # The facts before the loop only hold at the start of the body if the
+                    # body does not invalidate them.
+                    facts = kill(facts, assignedVars(body))
+                    self.exp(cond, facts)
+                    self.stmts(body, facts | condFacts(cond, self.nonNeg))
+        return facts
+
+def safeSubscripts(stmts: list[stmt]) -> set[int]:
+    """
+    Returns the ids of all Subscript expressions and SubscriptAssign statements in stmts
+    that do not need a bounds check.
+    """
+    nonNeg = assignedVars(stmts)
+    while True:
+        a = Analysis(nonNeg)
+        a.stmts(stmts, set())
+        if not a.notNonNeg:
+            return a.safe
+        nonNeg = nonNeg - a.notNonNeg
@@ -54,7 +54,7 @@ def atomic(needAtomic: bool, e: atom.exp, tmps: Temporaries, ctx: Ctx) -> tuple[
     else:
         return (e, tmps)
 
-def transExp(e: exp, needAtomic: bool, ctx: Ctx) -> tuple[atom.exp, Temporaries]:
+def transExp(e: exp, needAtomic: bool, ctx: Ctx, allocOk: bool = False) -> tuple[atom.exp, Temporaries]:
     """
     Translates expression e (of type array_ast.exp) to an expression of type
     array_astAtom.exp, together with a list of temporary variables used by
@@ -62,6 +62,10 @@ def transExp(e: exp, needAtomic: bool, ctx: Ctx) -> tuple[atom.exp, Temporaries]
 
     If the flag needAtomic is True, then the translated expression is an atomic expression,
     that is something of the form array_astAtom.AtomExp(...).
+
+    Allocating an array may trigger the garbage collector, which moves arrays. Hence,
+    an array allocation is turned into an atomic expression unless the flag allocOk is
+    True, so that no other array pointer can be on the wasm stack while allocating.
     """
     t = e.ty
     match e:
@@ -85,10 +89,10 @@ def transExp(e: exp, needAtomic: bool, ctx: Ctx) -> tuple[atom.exp, Temporaries]
         case ArrayInitDyn(lenExp, elemInit):
             (atomLen, tmps1) = transExpAtomic(lenExp, ctx)
             (atomElem, tmps2) = transExpAtomic(elemInit, ctx)
-            return atomic(needAtomic, atom.ArrayInitDyn(atomLen, atomElem, t), tmps1 + tmps2, ctx)
+            return atomic(needAtomic or not allocOk, atom.ArrayInitDyn(atomLen, atomElem, t), tmps1 + tmps2, ctx)
         case ArrayInitStatic(initExps):
             (atomArgs, tmps) = utils.unzip([transExpAtomic(i, ctx) for i in initExps])
-            return atomic(needAtomic, atom.ArrayInitStatic(atomArgs, t), utils.flatten(tmps), ctx)
+            return atomic(needAtomic or not allocOk, atom.ArrayInitStatic(atomArgs, t), utils.flatten(tmps), ctx)
         case Subscript(arrExp, indexExp):
             (atomArr, tmps1) = transExpAtomic(arrExp, ctx)
             (atomIndex, tmps2) = transExpAtomic(indexExp, ctx)
@@ -110,7 +114,7 @@ def transStmt(s: stmt, ctx: Ctx) -> list[atom.stmt]:
             (a, tmps) = transExp(e, False, ctx)
             return mkAssigns(tmps) + [atom.StmtExp(a)]
         case Assign(x, e):
-            (a, tmps) = transExp(e, False, ctx)
+            (a, tmps) = transExp(e, False, ctx, allocOk=True)
             return mkAssigns(tmps) + [atom.Assign(x, a)]
         case IfStmt(cond, thenBody, elseBody):
             (a, tmps1) = transExp(cond, False, ctx)
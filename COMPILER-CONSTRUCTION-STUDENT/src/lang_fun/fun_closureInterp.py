@@ -0,0 +1,259 @@
+"""
+Interpreter for lang_fun that first compiles the type-checked AST into python closures.
+
+See lang_array.array_closureInterp for the general idea. In addition, every function
+definition becomes a python function taking the argument values. Statement closures
+return None if execution continues normally and a one-element tuple holding the result
+value if a return statement was executed, so no exceptions are needed for returning.
+
+Variables are resolved to slots using the local variables computed by the type checker.
+The parameters of a function occupy the first slots of its frame, followed by the other
+local variables. A frame is a list of fixed size, so a call allocates exactly one list.
+"""
+from lang_fun.fun_ast import *
+import lang_fun.fun_tychecker as fun_tychecker
+import lang_fun.fun_inline as fun_inline
+import lang_fun.fun_tailcall as fun_tailcall
+from lang_fun.fun_interp import Store
+import common.utils as utils
+import common.log as log
+from common.genericInterp import InterpConfig
+from typing import *
+import operator
+
+type Env = list[Any]
+type ExpFun = Callable[[Env], Any]
+type Completion = tuple[Any] | None
+type StmtFun = Callable[[Env], Completion]
+type FunValue = Callable[..., Any]
+
+binOps: dict[type, Callable[[Any, Any], Any]] = {
+    Add: operator.add,
+    Sub: operator.sub,
+    Mul: operator.mul,
+    Less: operator.lt,
+    LessEq: operator.le,
+    Greater: operator.gt,
+    GreaterEq: operator.ge,
+    Eq: operator.eq,
+    NotEq: operator.ne,
+    Is: operator.eq # compare Address values by ==
+}
+
+class Ctx:
+    """
+    Context for compiling a function body or the top-level statements: the store,
+    the function values of all top-level functions and the slot index of every variable.
+    """
+    def __init__(self, store: Store, funs: dict[Ident, FunValue], slots: dict[Ident, int]):
+        self.store = store
+        self.funs = funs
+        self.slots = slots
+
+def slotsFromLocals(params: list[funParam], locals: list[fun_tychecker.LocalVar]) -> dict[Ident, int]:
+    xs = [p.var for p in params] + [v.name for v in locals]
+    return {x: i for i, x in enumerate(xs)}
+
+def compileBuiltinFuncall(fun: exp, args: list[exp], ctx: Ctx) -> Optional[ExpFun]:
+    match (fun, args):
+        case (Name(Ident('input_int'), BuiltinFun()), []):
+            inputInt = utils.inputInt
+            return lambda env: inputInt('Enter some int: ')
+        case (Name(Ident('print'), BuiltinFun()), [e]):
+            f = compileExp(e, ctx)
+            def printFun(env: Env) -> None:
+                print(f(env))
+            return printFun
+        case (Name(Ident('len'), BuiltinFun()), [e]):
+            f = compileExp(e, ctx)
+            resolve = ctx.store.resolve
+            return lambda env: len(resolve(f(env)))
+        case _:
+            return None
+
+def compileFuncall(fun: exp, args: list[exp], ctx: Ctx) -> ExpFun:
+    builtin = compileBuiltinFuncall(fun, args, ctx)
+    if builtin is not None:
+        return builtin
+    fs = [compileExp(a, ctx) for a in args]
+    match fun:
+        case Name(x, UserFun()):
+            fv = ctx.funs[x]
+            match fs:
+                case []:
+                    return lambda env: fv()
+                case [a]:
+                    return lambda env: fv(a(env))
+                case [a, b]:
+                    return lambda env: fv(a(env), b(env))
+                case _:
+                    return lambda env: fv(*[f(env) for f in fs])
+        case _:
+            t = compileExp(fun, ctx)
+            return lambda env: t(env)(*[f(env) for f in fs])
+
+def compileBinOp(left: exp, op: binaryop, right: exp, ctx: Ctx) -> ExpFun:
+    l = compileExp(left, ctx)
+    r = compileExp(right, ctx)
+    match op:
+        case And():
+            return lambda env: l(env) and r(env)
+        case Or():
+            return lambda env: l(env) or r(env)
+        case _:
+            pass
+    fun = binOps[type(op)]
+    match (left, right):
+        case (Name(x, Var()), IntConst(c)):
+            i = ctx.slots[x]
+            return lambda env: fun(env[i], c)
+        case (Name(x, Var()), Name(y, Var())):
+            i = ctx.slots[x]
+            j = ctx.slots[y]
+            return lambda env: fun(env[i], env[j])
+        case (_, IntConst(c)):
+            return lambda env: fun(l(env), c)
+        case _:
+            return lambda env: fun(l(env), r(env))
+
+def compileExp(e: exp, ctx: Ctx) -> ExpFun:
+    match e:
+        case IntConst(value):
+            return lambda env: value
+        case BoolConst(value):
+            return lambda env: value
+        case Call(fun, args):
+            return compileFuncall(fun, args, ctx)
+        case UnOp(op, sub):
+            f = compileExp(sub, ctx)
+            match op:
+                case USub(): return lambda env: -f(env)
+                case Not(): return lambda env: not f(env)
+        case BinOp(left, op, right):
+            return compileBinOp(left, op, right, ctx)
+        case Name(name, UserFun()):
+            fv = ctx.funs[name]
+            return lambda env: fv
+        case Name(name):
+            slot = ctx.slots[name]
+            return lambda env: env[slot]
+        case ArrayInitDyn(lenExp, initExp):
+            n = compileExp(lenExp, ctx)
+            v = compileExp(initExp, ctx)
+            allocFilled = ctx.store.allocFilled
+            return lambda env: allocFilled(n(env), v(env))
+        case ArrayInitStatic(es):
+            fs = [compileExp(e, ctx) for e in es]
+            alloc = ctx.store.alloc
+            return lambda env: alloc([f(env) for f in fs])
+        case Subscript(arrayExp, indexExp):
+            a = compileExp(arrayExp, ctx)
+            i = compileExp(indexExp, ctx)
+            load = ctx.store.load
+            return lambda env: load(a(env), i(env))
+    raise Exception(f'No match for expression {e}')
+
+def compileStmt(s: stmt, ctx: Ctx) -> StmtFun:
+    match s:
+        case StmtExp(e):
+            f = compileExp(e, ctx)
+            def stmtExp(env: Env) -> Completion:
+                f(env)
+                return None
+            return stmtExp
+        case Assign(x, e):
+            f = compileExp(e, ctx)
+            slot = ctx.slots[x]
+            def assign(env: Env) -> Completion:
+                env[slot] = f(env)
+                return None
+            return assign
+        case IfStmt(cond, thenBody, elseBody):
+            c = compileExp(cond, ctx)
+            thenFun = compileStmts(thenBody, ctx)
+            elseFun = compileStmts(elseBody, ctx)
+            def ifStmt(env: Env) -> Completion:
+                if c(env):
+                    return thenFun(env)
+                else:
+                    return elseFun(env)
+            return ifStmt
+        case WhileStmt(cond, body):
+            c = compileExp(cond, ctx)
+            bodyFun = compileStmts(body, ctx)
+            def whileStmt(env: Env) -> Completion:
+                while c(env):
+                    r = bodyFun(env)
+                    if r is not None:
+                        return r
+                return None
+            return whileStmt
+        case SubscriptAssign(leftExp, idxExp, rightExp):
+            i = compileExp(idxExp, ctx)
+            r = compileExp(rightExp, ctx)
+            a = compileExp(leftExp, ctx)
+            storeValue = ctx.store.storeValue
+            def subscriptAssign(env: Env) -> Completion:
+                idx = i(env)
+                v = r(env)
+                storeValue(a(env), idx, v)
+                return None
+            return subscriptAssign
+        case Return(e):
+            if e is None:
+                return lambda env: (None,)
+            f = compileExp(e, ctx)
+            return lambda env: (f(env),)
+
+def compileStmts(stmts: list[stmt], ctx: Ctx) -> StmtFun:
+    fs = [compileStmt(s, ctx) for s in stmts]
+    match fs:
+        case []:
+            return lambda env: None
+        case [f]:
+            return f
+        case _:
+            def seq(env: Env) -> Completion:
+                for f in fs:
+                    r = f(env)
+                    if r is not None:
+                        return r
+                return None
+            return seq
+
+def mkFunValue(f: FunDef, frameSize: int, body: list[StmtFun]) -> FunValue:
+    """
+    Returns the function value for f. The list body must contain the compiled body
+    of f before the function is called for the first time.
+    """
+    padding = (frameSize - len(f.params)) * [None]
+    def call(*args: Any) -> Any:
+        r = body[0]([*args, *padding])
+        if r is None:
+            return None
+        return r[0]
+    return call
+
+def interpModule(m: mod, cfg: InterpConfig = InterpConfig()):
+    utils.assertType(m, Module)
+    res = fun_tychecker.tycheckModule(m)
+    if cfg.tailCalls:
+        (m, res) = fun_tailcall.eliminateModule(m, res)
+    if cfg.inlineCalls:
+        (m, res) = fun_inline.inlineModule(m, res)
+    store = Store()
+    funs: dict[Ident, FunValue] = {}
+    funSlots = {f.name: slotsFromLocals(f.params, res.funLocals[f.name]) for f in m.funs}
+    bodies: dict[Ident, list[StmtFun]] = {}
+    for f in m.funs:
+        bodies[f.name] = []
+        funs[f.name] = mkFunValue(f, len(funSlots[f.name]), bodies[f.name])
+    # All function values must exist before compiling the bodies, so that calls
+    # can be bound directly to the function value.
+    for f in m.funs:
+        bodies[f.name].append(compileStmts(f.body, Ctx(store, funs, funSlots[f.name])))
+    ctx = Ctx(store, funs, slotsFromLocals([], res.toplevelLocals))
+    env: Env = len(ctx.slots) * [None]
+    prog = compileStmts(m.stmts, ctx)
+    prog(env)
+    log.debug(f'After executing program.\nEnv: {env}\nStore: {store}')
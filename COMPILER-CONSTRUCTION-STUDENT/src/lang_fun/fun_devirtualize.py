@@ -0,0 +1,205 @@
+"""
+Devirtualization: indirect calls through a variable that can only hold one function
+become direct calls.
+
+The analysis computes for every variable (including parameters) and for the result of
+every function the set of functions it may hold. It is flow-insensitive: a variable may
+hold every value assigned to it anywhere in its function.
+
+- A function name yields this function, a variable its set, a direct call the result set
+  of the callee, and an indirect call the union of the result sets of the possible callees.
+- Array elements are not tracked: reading a function from an array yields any function.
+- Calling a function adds the arguments to the sets of its parameters. An indirect call
+  through a variable that may hold any function may call every function of the right
+  type whose name is used as a value.
+
+The sets only grow, so the analysis iterates over the module until nothing changes.
+"""
+from __future__ import annotations
+from typing import *
+from dataclasses import dataclass
+from lang_fun.fun_astAtom import *
+import common.log as log
+
+@dataclass(frozen=True)
+class Targets:
+    """
+    The functions a value may be: those in funs, or any function if unknown is True.
+    """
+    funs: frozenset[ident] = frozenset()
+    unknown: bool = False
+    def join(self, other: Targets) -> Targets:
+        return Targets(self.funs | other.funs, self.unknown or other.unknown)
+    def single(self) -> Optional[ident]:
+        if not self.unknown and len(self.funs) == 1:
+            return next(iter(self.funs))
+        return None
+
+anyFun = Targets(unknown=True)
+
+type VarKey = tuple[Optional[ident], ident] # (enclosing function or None for the toplevel, variable)
+
+class Analysis:
+    def __init__(self, m: Module):
+        self.funs = {f.name: f for f in m.funs}
+        self.vars: dict[VarKey, Targets] = {}
+        self.results: dict[ident, Targets] = {}
+        # Functions whose names are used as values
+        self.addressTaken: set[ident] = set()
+        self.changed = False
+
+    def var(self, fun: Optional[ident], x: ident) -> Targets:
+        return self.vars.get((fun, x), Targets())
+
+    def addVar(self, fun: Optional[ident], x: ident, t: Targets):
+        old = self.var(fun, x)
+        new = old.join(t)
+        if new != old:
+            self.vars[(fun, x)] = new
+            self.changed = True
+
+    def addResult(self, fun: ident, t: Targets):
+        old = self.results.get(fun, Targets())
+        new = old.join(t)
+        if new != old:
+            self.results[fun] = new
+            self.changed = True
+
+    def callees(self, fun: Optional[ident], target: callTarget) -> set[ident]:
+        match target:
+            case CallTargetBuiltin():
+                return set()
+            case CallTargetDirect(f):
+                return {f}
+            case CallTargetIndirect(x, params, result):
+                t = self.var(fun, x)
+                if t.unknown:
+                    return set([g for g in self.addressTaken
+                                if [p.ty for p in self.funs[g].params] == params and
+                                   self.funs[g].result == result])
+                return set(t.funs)
+
+    def atom(self, fun: Optional[ident], a: atomExp) -> Targets:
+        match a:
+            case FunName(f):
+                if f not in self.addressTaken:
+                    self.addressTaken.add(f)
+                    self.changed = True
+                return Targets(frozenset([f]))
+            case VarName(x):
+                return self.var(fun, x)
+            case _:
+                return Targets()
+
+    def exp(self, fun: Optional[ident], e: exp) -> Targets:
+        """
+        Records the calls in e, returns the functions e may evaluate to.
+        """
+        match e:
+            case AtomExp(a):
+                return self.atom(fun, a)
+            case Call(target, args):
+                argTargets = [self.exp(fun, a) for a in args]
+                result = Targets()
+                for g in self.callees(fun, target):
+                    for p, t in zip(self.funs[g].params, argTargets):
+                        self.addVar(g, p.var, t)
+                    result = result.join(self.results.get(g, Targets()))
+                return result
+            case UnOp(_, arg):
+                self.exp(fun, arg)
+                return Targets()
+            case BinOp(left, _, right):
+                self.exp(fun, left)
+                self.exp(fun, right)
+                return Targets()
+            case Subscript(array, index):
+                self.atom(fun, array)
+                self.atom(fun, index)
+                return anyFun
+            case ArrayInitDyn(n, elemInit):
+                self.atom(fun, n)
+                self.atom(fun, elemInit)
+                return Targets()
+            case ArrayInitStatic(elems):
+                for x in elems:
+                    self.atom(fun, x)
+                return Targets()
+
+    def stmts(self, fun: Optional[ident], stmts: list[stmt]):
+        for s in stmts:
+            match s:
+                case StmtExp(e):
+                    self.exp(fun, e)
+                case Assign(x, e):
+                    self.addVar(fun, x, self.exp(fun, e))
+                case IfStmt(cond, thenBody, elseBody):
+                    self.exp(fun, cond)
+                    self.stmts(fun, thenBody)
+                    self.stmts(fun, elseBody)
+                case WhileStmt(cond, body):
+                    self.exp(fun, cond)
+                    self.stmts(fun, body)
+                case SubscriptAssign(array, index, right):
+                    self.atom(fun, array)
+                    self.atom(fun, index)
+                    self.exp(fun, right)
+                case Return(e):
+                    if e is not None and fun is not None:
+                        self.addResult(fun, self.exp(fun, e))
+
+    def module(self, m: Module):
+        self.changed = True
+        while self.changed:
+            self.changed = False
+            for f in m.funs:
+                self.stmts(f.name, f.body)
+            self.stmts(None, m.stmts)
+
+def rewriteExp(a: Analysis, fun: Optional[ident], e: exp) -> int:
+    match e:
+        case Call(CallTargetIndirect(x), args):
+            n = sum([rewriteExp(a, fun, arg) for arg in args])
+            g = a.var(fun, x).single()
+            if g is not None:
+                e.fun = CallTargetDirect(g)
+                n += 1
+            return n
+        case Call(_, args):
+            return sum([rewriteExp(a, fun, arg) for arg in args])
+        case UnOp(_, arg):
+            return rewriteExp(a, fun, arg)
+        case BinOp(left, _, right):
+            return rewriteExp(a, fun, left) + rewriteExp(a, fun, right)
+        case _:
+            return 0
+
+def rewriteStmts(a: Analysis, fun: Optional[ident], stmts: list[stmt]) -> int:
+    n = 0
+    for s in stmts:
+        match s:
+            case StmtExp(e) | Assign(_, e) | SubscriptAssign(_, _, e):
+                n += rewriteExp(a, fun, e)
+            case IfStmt(cond, thenBody, elseBody):
+                n += rewriteExp(a, fun, cond) + rewriteStmts(a, fun, thenBody) + \
+                    rewriteStmts(a, fun, elseBody)
+            case WhileStmt(cond, body):
+                n += rewriteExp(a, fun, cond) + rewriteStmts(a, fun, body)
+            case Return(e):
+                if e is not None:
+                    n += rewriteExp(a, fun, e)
+    return n
+
+def devirtualize(m: Module) -> int:
+    """
+    Replaces (in place) the targets of all indirect calls in m with only one possible
+    callee by direct calls. Returns the number of replaced calls.
+    """
+    a = Analysis(m)
+    a.module(m)
+    n = 0
+    for f in m.funs:
+        n += rewriteStmts(a, f.name, f.body)
+    n += rewriteStmts(a, None, m.stmts)
+    log.info(f'Devirtualized {n} indirect calls')
+    return n
@@ -0,0 +1,387 @@
+"""
+Inlining of calls of small functions on the type-checked AST. Used by the compiler and,
+with the --inline-calls flag, by the tree and closure interpreters.
+
+A call of a user-defined function f is replaced by the body of f if
+- f is not recursive, neither directly nor through other functions (functions passed
+  as values count as called),
+- every return statement of f is the last statement executed on its path, possibly after
+  moving the statements following an if into its branches (see tailForm), and
+- the body of f has at most Inliner.maxSize nodes and the caller has not yet grown by
+  more than Inliner.maxGrowth nodes.
+
+The parameters of f become fresh variables assigned to the arguments. Hence, an array
+passed as an argument is aliased exactly as for a call: writes to its elements are
+visible to the caller, assignments to the parameter are not. An argument that is a
+variable or a constant is substituted directly if f never assigns the parameter. This is
+safe because f cannot assign the variables of its caller, so the argument has the same
+value during the whole inlined body. The local variables of f are renamed to fresh
+variables of the caller, and the return statements assign the result.
+
+Only calls that are the whole expression of a statement are inlined. A call nested in an
+expression is first moved into an assignment to a fresh variable before the statement.
+This only happens if everything evaluated before the call is pure (constants, variables
+and operators), otherwise the order of side effects would change.
+"""
+from lang_fun.fun_ast import *
+from lang_fun.fun_tychecker import TycheckResult, LocalVar
+from lang_fun.fun_transform import Ctx, funCtx
+from typing import *
+from dataclasses import dataclass
+import common.log as log
+import copy
+
+type OnReturn = Callable[[Optional[exp]], list[stmt]]
+
+def subExps(e: exp) -> list[exp]:
+    match e:
+        case Call(f, args):
+            return [f] + args
+        case UnOp(_, arg):
+            return [arg]
+        case BinOp(left, _, right):
+            return [left, right]
+        case ArrayInitDyn(n, elemInit):
+            return [n, elemInit]
+        case ArrayInitStatic(elems):
+            return elems
+        case Subscript(array, index):
+            return [array, index]
+        case _:
+            return []
+
+def expTree(e: exp) -> Iterator[exp]:
+    """
+    Yields e and all its subexpressions.
+    """
+    yield e
+    for sub in subExps(e):
+        yield from expTree(sub)
+
+def stmtTree(stmts: list[stmt]) -> Iterator[stmt]:
+    """
+    Yields all statements in stmts, including nested ones.
+    """
+    for s in stmts:
+        yield s
+        match s:
+            case IfStmt(_, thenBody, elseBody):
+                yield from stmtTree(thenBody)
+                yield from stmtTree(elseBody)
+            case WhileStmt(_, body):
+                yield from stmtTree(body)
+            case _:
+                pass
+
+def stmtExps(s: stmt) -> list[exp]:
+    match s:
+        case StmtExp(e) | Assign(_, e) | Return(e) if e is not None:
+            return [e]
+        case IfStmt(cond) | WhileStmt(cond):
+            return [cond]
+        case SubscriptAssign(left, index, right):
+            return [left, index, right]
+        case _:
+            return []
+
+def allExps(stmts: list[stmt]) -> Iterator[exp]:
+    for s in stmtTree(stmts):
+        for e in stmtExps(s):
+            yield from expTree(e)
+
+def size(stmts: list[stmt]) -> int:
+    return len(list(stmtTree(stmts))) + len(list(allExps(stmts)))
+
+def funRefs(stmts: list[stmt]) -> set[ident]:
+    """
+    Returns the user-defined functions called or used as values in stmts.
+    """
+    return {e.var for e in allExps(stmts) if isinstance(e, Name) and isinstance(e.scope, UserFun)}
+
+def directCallee(e: exp) -> Optional[ident]:
+    match e:
+        case Call(Name(f, UserFun())):
+            return f
+        case _:
+            return None
+
+def isPure(e: exp) -> bool:
+    """
+    Returns True if evaluating e has no side effects, cannot fail and is not affected
+    by the side effects of a call.
+    """
+    return all([isinstance(x, IntConst | BoolConst | Name | UnOp | BinOp) for x in expTree(e)])
+
+def tailForm(stmts: list[stmt]) -> Optional[list[stmt]]:
+    """
+    Rewrites stmts such that every return statement is the last statement executed on
+    its path, or returns None if this is not possible because of a return inside a loop.
+    """
+    for i, s in enumerate(stmts):
+        match s:
+            case Return():
+                return stmts[:i+1]
+            case WhileStmt(_, body) if any([isinstance(x, Return) for x in stmtTree(body)]):
+                return None
+            case IfStmt(cond, thenBody, elseBody) if any([isinstance(x, Return) for x in stmtTree([s])]):
+                rest = stmts[i+1:]
+                newThen = tailForm(thenBody + rest)
+                newElse = tailForm(elseBody + copy.deepcopy(rest))
+                if newThen is None or newElse is None:
+                    return None
+                return stmts[:i] + [IfStmt(cond, newThen, newElse)]
+            case _:
+                pass
+    return stmts
+
+def substExp(e: exp, subst: dict[ident, exp]) -> exp:
+    """
+    Returns a copy of e with the variables in subst replaced.
+    """
+    match e:
+        case Name(x, Var()) if x in subst:
+            return copy.deepcopy(subst[x])
+        case Call(f, args, t):
+            return Call(substExp(f, subst), [substExp(a, subst) for a in args], t)
+        case UnOp(op, arg, t):
+            return UnOp(op, substExp(arg, subst), t)
+        case BinOp(left, op, right, t):
+            return BinOp(substExp(left, subst), op, substExp(right, subst), t)
+        case ArrayInitDyn(n, elemInit, t):
+            return ArrayInitDyn(substExp(n, subst), substExp(elemInit, subst), t)
+        case ArrayInitStatic(elems, t):
+            return ArrayInitStatic([substExp(x, subst) for x in elems], t)
+        case Subscript(array, index, t):
+            return Subscript(substExp(array, subst), substExp(index, subst), t)
+        case _:
+            return copy.deepcopy(e)
+
+def substVar(x: ident, subst: dict[ident, exp]) -> ident:
+    match subst.get(x):
+        case Name(y):
+            return y
+        case None:
+            return x
+        case e:
+            raise ValueError(f'Assigned variable {x} replaced by {e}')
+
+def substStmts(stmts: list[stmt], subst: dict[ident, exp], onReturn: OnReturn) -> list[stmt]:
+    """
+    Returns a copy of stmts with the variables in subst replaced and every return
+    statement replaced by the result of onReturn.
+    """
+    result: list[stmt] = []
+    for s in stmts:
+        match s:
+            case StmtExp(e):
+                result.append(StmtExp(substExp(e, subst)))
+            case Assign(x, e):
+                result.append(Assign(substVar(x, subst), substExp(e, subst)))
+            case IfStmt(cond, thenBody, elseBody):
+                result.append(IfStmt(substExp(cond, subst), substStmts(thenBody, subst, onReturn),
+                                     substStmts(elseBody, subst, onReturn)))
+            case WhileStmt(cond, body):
+                result.append(WhileStmt(substExp(cond, subst), substStmts(body, subst, onReturn)))
+            case SubscriptAssign(left, index, right):
+                result.append(SubscriptAssign(substExp(left, subst), substExp(index, subst),
+                                              substExp(right, subst)))
+            case Return(e):
+                result.extend(onReturn(None if e is None else substExp(e, subst)))
+    return result
+
+def assignResult(x: ident) -> OnReturn:
+    def f(e: Optional[exp]) -> list[stmt]:
+        assert e is not None
+        return [Assign(x, e)]
+    return f
+
+@dataclass(frozen=True)
+class Callee:
+    """
+    A function that may be inlined. body is the body in tail form, assigned the
+    variables assigned by the body.
+    """
+    fun: FunDef
+    body: list[stmt]
+    locals: list[LocalVar]
+    assigned: set[ident]
+    size: int
+
+def isRecursive(f: ident, refs: dict[ident, set[ident]]) -> bool:
+    """
+    Returns True if f might call itself. Functions used as values count as called.
+    """
+    seen: set[ident] = set()
+    todo = list(refs[f])
+    while todo:
+        g = todo.pop()
+        if g == f:
+            return True
+        if g not in seen:
+            seen.add(g)
+            todo.extend(refs[g])
+    return False
+
+class Inliner:
+    maxSize = 40 # (in AST nodes)
+    maxGrowth = 400 # (in AST nodes, per function)
+
+    def __init__(self, m: Module, vars: TycheckResult):
+        refs = {f.name: funRefs(f.body) for f in m.funs}
+        self.callees: dict[ident, Callee] = {}
+        for f in m.funs:
+            if size(f.body) > Inliner.maxSize or isRecursive(f.name, refs):
+                continue
+            body = tailForm(f.body)
+            if body is None or size(body) > Inliner.maxSize:
+                continue
+            assigned = {s.var for s in stmtTree(body) if isinstance(s, Assign)}
+            self.callees[f.name] = Callee(f, body, vars.funLocals[f.name], assigned, size(body))
+        self.budget = 0
+        self.inlined = 0 # (in the current function)
+
+    def inlineFun(self, stmts: list[stmt], ctx: Ctx) -> list[stmt]:
+        """
+        Returns stmts (the body of a function or the toplevel code) with calls inlined.
+        The fresh variables are taken from ctx.
+        """
+        self.budget = Inliner.maxGrowth
+        self.inlined = 0
+        result = self.stmts(stmts, ctx)
+        log.info(f'Inlined {self.inlined} calls')
+        return result
+
+    def stmts(self, stmts: list[stmt], ctx: Ctx) -> list[stmt]:
+        result: list[stmt] = []
+        for s in stmts:
+            result.extend(self.stmt(s, ctx))
+        return result
+
+    def callee(self, e: exp) -> Optional[Callee]:
+        f = directCallee(e)
+        if f is not None and f in self.callees and self.callees[f].size <= self.budget:
+            return self.callees[f]
+        return None
+
+    def inlineCall(self, e: exp, ctx: Ctx, onReturn: OnReturn) -> Optional[list[stmt]]:
+        """
+        Returns the inlined body if e is a call that should be inlined.
+        """
+        c = self.callee(e)
+        if c is None or not isinstance(e, Call):
+            return None
+        self.budget -= c.size
+        self.inlined += 1
+        subst: dict[ident, exp] = {}
+        bindings: list[stmt] = []
+        for p, arg in zip(c.fun.params, e.args):
+            if p.var not in c.assigned and isinstance(arg, IntConst | BoolConst | Name):
+                subst[p.var] = arg
+            else:
+                x = ctx.newVar(p.ty)
+                bindings.append(Assign(x, arg))
+                subst[p.var] = Name(x, Var(), NotVoid(p.ty))
+        for v in c.locals:
+            subst[v.name] = Name(ctx.newVar(v.ty), Var(), NotVoid(v.ty))
+        body = substStmts(c.body, subst, onReturn)
+        return self.stmts(bindings, ctx) + self.stmts(body, ctx)
+
+    def hoist(self, e: exp, safe: bool, pre: list[stmt], ctx: Ctx) -> tuple[exp, bool]:
+        """
+        Moves the calls in e that should be inlined into assignments appended to pre,
+        as long as everything evaluated before is pure (safe is True). Returns the
+        new expression and whether everything evaluated up to the end of e is pure.
+        """
+        if not safe:
+            return (e, False)
+        if self.callee(e) is not None and isinstance(e.ty, NotVoid):
+            x = ctx.newVar(e.ty.ty)
+            pre.extend(self.stmt(Assign(x, e), ctx))
+            return (Name(x, Var(), e.ty), True)
+        match e:
+            case Call(f, args, t):
+                newArgs: list[exp] = []
+                for a in args:
+                    (a, safe) = self.hoist(a, safe, pre, ctx)
+                    newArgs.append(a)
+                return (Call(f, newArgs, t), False)
+            case UnOp(op, arg, t):
+                (arg, safe) = self.hoist(arg, safe, pre, ctx)
+                return (UnOp(op, arg, t), safe)
+            case BinOp(left, And() | Or() as op, right, t):
+                # The right operand is not always evaluated
+                (left, safe) = self.hoist(left, safe, pre, ctx)
+                return (BinOp(left, op, right, t), safe and isPure(right))
+            case BinOp(left, op, right, t):
+                (left, safe) = self.hoist(left, safe, pre, ctx)
+                (right, safe) = self.hoist(right, safe, pre, ctx)
+                return (BinOp(left, op, right, t), safe)
+            case ArrayInitDyn(n, elemInit, t):
+                (n, safe) = self.hoist(n, safe, pre, ctx)
+                (elemInit, safe) = self.hoist(elemInit, safe, pre, ctx)
+                return (ArrayInitDyn(n, elemInit, t), False)
+            case ArrayInitStatic(elems, t):
+                newElems: list[exp] = []
+                for x in elems:
+                    (x, safe) = self.hoist(x, safe, pre, ctx)
+                    newElems.append(x)
+                return (ArrayInitStatic(newElems, t), False)
+            case Subscript(array, index, t):
+                (array, safe) = self.hoist(array, safe, pre, ctx)
+                (index, safe) = self.hoist(index, safe, pre, ctx)
+                return (Subscript(array, index, t), False)
+            case _:
+                return (e, True)
+
+    def stmt(self, s: stmt, ctx: Ctx) -> list[stmt]:
+        pre: list[stmt] = []
+        match s:
+            case StmtExp(e):
+                inlined = self.inlineCall(e, ctx, lambda _: [])
+                if inlined is not None:
+                    return inlined
+                (e, _) = self.hoist(e, True, pre, ctx)
+                return pre + [StmtExp(e)]
+            case Assign(x, e):
+                inlined = self.inlineCall(e, ctx, assignResult(x))
+                if inlined is not None:
+                    return inlined
+                (e, _) = self.hoist(e, True, pre, ctx)
+                return pre + [Assign(x, e)]
+            case IfStmt(cond, thenBody, elseBody):
+                (cond, _) = self.hoist(cond, True, pre, ctx)
+                return pre + [IfStmt(cond, self.stmts(thenBody, ctx), self.stmts(elseBody, ctx))]
+            case WhileStmt(cond, body):
+                (cond, _) = self.hoist(cond, True, pre, ctx)
+                # The condition is evaluated before every iteration
+                return pre + [WhileStmt(cond, self.stmts(body, ctx) + copy.deepcopy(pre))]
+            case SubscriptAssign(left, index, right):
+                # The index and the right-hand side are evaluated before the array
+                (index, safe) = self.hoist(index, True, pre, ctx)
+                (right, _) = self.hoist(right, safe, pre, ctx)
+                return pre + [SubscriptAssign(left, index, right)]
+            case Return(e):
+                if e is None:
+                    return [s]
+                inlined = self.inlineCall(e, ctx, lambda r: [Return(r)])
+                if inlined is not None:
+                    return inlined
+                (e, _) = self.hoist(e, True, pre, ctx)
+                return pre + [Return(e)]
+
+def inlineModule(m: Module, vars: TycheckResult) -> tuple[Module, TycheckResult]:
+    """
+    Inlines calls in all functions and the toplevel code of m. Returns the new module
+    and its local variables.
+    """
+    inliner = Inliner(m, vars)
+    funs: list[FunDef] = []
+    funLocals: dict[ident, list[LocalVar]] = {}
+    for f in m.funs:
+        ctx = funCtx(f.params, [v.name for v in vars.funLocals[f.name]])
+        funs.append(FunDef(f.name, f.params, f.result, inliner.inlineFun(f.body, ctx)))
+        funLocals[f.name] = vars.funLocals[f.name] + [LocalVar(x, t) for x, t in ctx.freshVars.items()]
+    ctx = funCtx([], [v.name for v in vars.toplevelLocals])
+    stmts = inliner.inlineFun(m.stmts, ctx)
+    toplevelLocals = vars.toplevelLocals + [LocalVar(x, t) for x, t in ctx.freshVars.items()]
+    return (Module(funs, stmts), TycheckResult(funLocals, toplevelLocals))
@@ -1,43 +1,87 @@
 from lang_fun.fun_ast import *
 import lang_fun.fun_tychecker as fun_tychecker
+import lang_fun.fun_inline as fun_inline
+import lang_fun.fun_tailcall as fun_tailcall
+import lang_fun.fun_purity as fun_purity
 import common.utils as utils
 import common.log as log
+from common.genericInterp import InterpConfig
+import common.interpStore as interpStore
+from common.interpStore import Address
 from typing import *
-
-@dataclass(frozen=True)
-class Address:
-    value: int
-    def __repr__(self):
-        return f'Address({self.value})'
+from collections import OrderedDict
+import sys
 
 type FunEnv = dict[Ident, FunDef]
 type Env = dict[Ident, TyValue]
 type TyValue = int | bool | Address | FunDef
-type StoreValue = list[TyValue]
 
-class ReturnException(Exception):
-    def __init__(self, value: TyValue | None):
-        self.value = value
+class Frame:
+    """
+    The frame of a call (or of the toplevel code): the environment holding the parameters
+    and local variables, and the result of the call once a return statement has been
+    executed. A statement signals that it executed a return by returning True, so that
+    returning does not need to raise and catch an exception.
+    """
+    __slots__ = ['env', 'result']
+    def __init__(self, env: Env):
+        self.env = env
+        self.result: Optional[TyValue] = None
+
+@dataclass
+class MemoStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    def __str__(self):
+        return f'hits: {self.hits}, misses: {self.misses}, evictions: {self.evictions}'
+
+class MemoCache:
+    """
+    Caches the results of calls of the functions in funs, which must be memoizable
+    (see lang_fun.fun_purity). The arguments of these functions are ints and bools, so
+    they can be used as keys directly. At most maxSize results are kept, the least
+    recently used result is evicted first.
+    """
+    def __init__(self, funs: set[Ident], maxSize: int):
+        self.funs = funs
+        self.maxSize = maxSize
+        self.results: OrderedDict[tuple[Ident, tuple[TyValue, ...]], TyValue] = OrderedDict()
+        self.stats = MemoStats()
+    def lookup(self, key: tuple[Ident, tuple[TyValue, ...]]) -> Optional[TyValue]:
+        v = self.results.get(key)
+        if v is None:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+            self.results.move_to_end(key)
+        return v
+    def add(self, key: tuple[Ident, tuple[TyValue, ...]], v: TyValue):
+        self.results[key] = v
+        if len(self.results) > self.maxSize:
+            self.results.popitem(last=False)
+            self.stats.evictions += 1
 
-class Store:
-    def __init__(self):
-        self.content: dict[Address, StoreValue] = {}
+class Store(interpStore.Store[TyValue]):
+    """
+    The store of lang_fun (see common.interpStore), also holding the top-level functions.
+
+    Collections only happen between two statements. The roots are the environments of
+    all active frames, and the values in pinned. An expression must pin every
+    value it still needs while evaluating a subexpression that might call a function,
+    because the statements of that function might trigger a collection.
+    """
+    def __init__(self, gcThreshold: Optional[int] = None, memo: Optional[MemoCache] = None):
+        super().__init__(gcThreshold)
         self.funEnv: FunEnv = {}
-        self.__freshAddress = Address(0)
-    def alloc(self, val: StoreValue):
-        x = self.__freshAddress
-        self.__freshAddress = Address(x.value + 1)
-        self.content[x] = val
-        return x
-    def resolve(self, a: Address) -> StoreValue:
-        return self.content[a]
-    def storeValue(self, a: Address, i: int, v: TyValue):
-        l = self.content[a]
-        l[i] = v
-    def __repr__(self):
-        return f'Store({self.content})'
+        self.memo = memo
+        self.frames: list[Frame] = []
+        self.pinned: list[list[TyValue]] = []
+    def roots(self) -> Iterable[TyValue]:
+        return [v for fr in self.frames for v in fr.env.values()] + \
+            [v for vs in self.pinned for v in vs]
 
-def interpFuncall(fun: exp, args: list[exp], env: Env, store: Store) -> Optional[TyValue]:
+def interpBuiltinFuncall(fun: exp, args: list[exp], env: Env, store: Store) -> Optional[TyValue]:
     match (fun, args):
         case (Name(Ident('input_int')), []):
             return int(utils.inputInt('Enter some int: '))
@@ -48,19 +92,49 @@ def interpFuncall(fun: exp, args: list[exp], env: Env, store: Store) -> Optional
         case (Name(Ident('len')), [e]):
             v = asAddress(interpExp(e, env, store))
             return len(store.resolve(v))
+        case _:
+            raise Exception(f'Invalid call of builtin function {fun}')
+
+def interpFuncall(fun: exp, args: list[exp], env: Env, store: Store) -> Optional[TyValue]:
+    match fun:
+        case Name(_, BuiltinFun()):
+            return interpBuiltinFuncall(fun, args, env, store)
+        case Name(g, UserFun()):
+            f = store.funEnv[g]
         case _:
             f = asFunDef(interpExp(fun, env, store))
-            xs = [p.var for p in f.params]
-            vs = [asValue(interpExp(a, env, store)) for a in args]
-            localEnv = cast(Env, store.funEnv.copy())
-            localEnv.update(zip(xs, vs))
-            try:
-                interpStmts(f.body, localEnv, store)
-            except ReturnException as e:
-                return e.value
+    vs: list[TyValue] = []
+    store.pinned.append(vs)
+    for a in args:
+        vs.append(asValue(interpExp(a, env, store)))
+    memo = store.memo
+    if memo is not None and f.name in memo.funs:
+        key = (f.name, tuple(vs))
+        v = memo.lookup(key)
+        if v is not None:
+            store.pinned.pop()
+            return v
+        v = asValue(callFun(f, vs, store))
+        memo.add(key, v)
+        return v
+    return callFun(f, vs, store)
+
+def callFun(f: FunDef, vs: list[TyValue], store: Store) -> Optional[TyValue]:
+    """
+    Runs the body of f with the given arguments, which must be pinned in store; unpins
+    them.
+    """
+    # Names of top-level functions are resolved through store.funEnv, so the
+    # environment of the call only needs to hold the parameters.
+    frame = Frame(dict(zip([p.var for p in f.params], vs)))
+    store.frames.append(frame)
+    store.pinned.pop()
+    interpStmts(f.body, frame, store)
+    store.frames.pop()
+    return frame.result
 
 def asInt(v: Optional[TyValue]) -> int:
-    assert isinstance(v, int)
+    assert isinstance(v, int) and type(v) is not Address
     return v
 
 def asBool(v: Optional[TyValue]) -> bool:
@@ -81,6 +155,13 @@ def asFunDef(v: Optional[TyValue]) -> FunDef:
 
 def interpExp(e: exp, env: Env, store: Store) -> Optional[TyValue]:
     match e:
+        case Name(name):
+            # Variables are the most frequent expressions, so they come first. A variable
+            # is never None, so a single lookup suffices.
+            v = env.get(name)
+            if v is None:
+                return store.funEnv[name]
+            return v
         case IntConst(value):
             return value
         case BoolConst(value):
@@ -104,7 +185,11 @@ def interpExp(e: exp, env: Env, store: Store) -> Optional[TyValue]:
                 case GreaterEq(): return x >= interpExp(right, env, store)
                 case Eq(): return x == interpExp(right, env, store)
                 case NotEq(): return x != interpExp(right, env, store)
-                case Is(): return x == interpExp(right, env, store) # compare Address values by ==
+                case Is():
+                    store.pinned.append([x])
+                    y = interpExp(right, env, store)
+                    store.pinned.pop()
+                    return x == y # compare Address values by ==
                 case And():
                     if x:
                         return interpExp(right, env, store)
@@ -115,69 +200,90 @@ def interpExp(e: exp, env: Env, store: Store) -> Optional[TyValue]:
                         return True
                     else:
                         return interpExp(right, env, store)
-        case Name(name):
-            if name in env:
-                return env[name]
-            else:
-                return store.funEnv[name]
         case ArrayInitDyn(lenExp, initExp):
             n = asInt(interpExp(lenExp, env, store))
             v = asValue(interpExp(initExp, env, store))
-            return store.alloc(n * [v])
+            return store.allocFilled(n, v)
         case ArrayInitStatic(es):
-            l = [asValue(interpExp(e, env, store)) for e in es]
+            l: list[TyValue] = []
+            store.pinned.append(l)
+            for e in es:
+                l.append(asValue(interpExp(e, env, store)))
+            store.pinned.pop()
             return store.alloc(l)
         case Subscript(arrayExp, indexExp):
             a = asAddress(interpExp(arrayExp, env, store))
+            store.pinned.append([a])
             i = asInt(interpExp(indexExp, env, store))
-            l = store.resolve(a)
-            return l[i]
+            store.pinned.pop()
+            return store.load(a, i)
     raise Exception(f'No match for expression {e}')
 
-def interpStmt(s: stmt, env: Env, store: Store, cont: list[stmt]) -> None:
+def interpStmt(s: stmt, frame: Frame, store: Store) -> bool:
+    """
+    Executes s, returns True if s executed a return statement.
+    """
+    env = frame.env
     match s:
         case StmtExp(e):
             interpExp(e, env, store)
-            interpStmts(cont, env, store)
         case Assign(x, e):
             v: Any = interpExp(e, env, store)
             env[x] = v
-            interpStmts(cont, env, store)
         case IfStmt(cond, thenBody, elseBody):
             v = asBool(interpExp(cond, env, store))
             if v:
-                interpStmts(thenBody + cont, env, store)
+                return interpStmts(thenBody, frame, store)
             else:
-                interpStmts(elseBody + cont, env, store)
+                return interpStmts(elseBody, frame, store)
         case WhileStmt(cond, body):
-            v = asBool(interpExp(cond, env, store))
-            if v:
-                interpStmts(body + [s] + cont, env, store)
-            else:
-                interpStmts(cont, env, store)
+            while asBool(interpExp(cond, env, store)):
+                if interpStmts(body, frame, store):
+                    return True
         case SubscriptAssign(leftExp, idxExp, rightExp):
             idx = asInt(interpExp(idxExp, env, store))
-            v = interpExp(rightExp, env, store)
+            v = asValue(interpExp(rightExp, env, store))
+            store.pinned.append([v])
             a = asAddress(interpExp(leftExp, env, store))
+            store.pinned.pop()
             store.storeValue(a, idx, v)
-            interpStmts(cont, env, store)
         case Return(e):
             if e is not None:
-                x = interpExp(e, env, store)
-            else:
-                x = None
-            raise ReturnException(x)
+                frame.result = interpExp(e, env, store)
+            return True
+    return False
 
-def interpStmts(stmts: list[stmt], env: Env, store: Store) -> None:
-    if len(stmts) > 0:
-        interpStmt(stmts[0], env, store, stmts[1:])
+def interpStmts(stmts: list[stmt], frame: Frame, store: Store) -> bool:
+    """
+    Executes stmts until a return statement, returns True if a return statement was
+    executed.
+    """
+    for s in stmts:
+        store.maybeCollect()
+        if interpStmt(s, frame, store):
+            return True
+    return False
 
-def interpModule(m: mod):
+def interpModule(m: mod, cfg: InterpConfig = InterpConfig()):
     utils.assertType(m, Module)
-    fun_tychecker.tycheckModule(m)
-    env: Env = {}
-    store = Store()
+    vars = fun_tychecker.tycheckModule(m)
+    if cfg.tailCalls:
+        (m, vars) = fun_tailcall.eliminateModule(m, vars)
+    if cfg.inlineCalls:
+        (m, _) = fun_inline.inlineModule(m, vars)
+    memo = None
+    if cfg.memoize:
+        funs = fun_purity.memoizableFuns(m)
+        log.info(f'Memoizing functions {", ".join(sorted([f.name for f in funs]))}')
+        memo = MemoCache(funs, cfg.memoSize)
+    frame = Frame({})
+    store = Store(cfg.gcThreshold, memo)
     for f in m.funs:
         store.funEnv[f.name] = f
-    interpStmts(m.stmts, env, store)
-    log.debug(f'After executing program.\nEnv: {env}\nStore: {store}')
+    store.frames.append(frame)
+    interpStmts(m.stmts, frame, store)
+    log.debug(f'After executing program.\nEnv: {frame.env}\nStore: {store}')
+    if cfg.gcStats:
+        print(f'GC stats: {store.gcStats}', file=sys.stderr)
+    if memo is not None and cfg.memoStats:
+        print(f'Memo stats: {memo.stats}', file=sys.stderr)
@@ -0,0 +1,72 @@
+"""
+Purity analysis on the type-checked AST. Used by the tree interpreter to decide which
+functions it may memoize (see the --memoize flag).
+
+A function is memoizable if its result depends only on its arguments and calling it has
+no effect besides returning the result:
+- all parameters are of type int or bool, and the result is of type int or bool,
+- the body does not write to an array element,
+- the body does not call print or input_int, and makes no indirect calls, and
+- every user-defined function called by the body is memoizable as well.
+
+Because a memoizable function has no array parameters, calls no function that has one
+and returns no array, it can only access arrays it allocated itself. These arrays are
+not visible after the call, so reading them is allowed.
+
+The analysis starts with all functions satisfying the conditions on the types and on
+the body, and then removes functions calling a removed function until nothing changes.
+"""
+from lang_fun.fun_ast import *
+from lang_fun.fun_inline import allExps, stmtTree
+from typing import *
+
+pureBuiltins = {'len'}
+
+def isScalar(t: ty) -> bool:
+    return isinstance(t, Int | Bool)
+
+def hasScalarSignature(f: FunDef) -> bool:
+    match f.result:
+        case NotVoid(t) if isScalar(t):
+            return all([isScalar(p.ty) for p in f.params])
+        case _:
+            return False
+
+def callees(f: FunDef) -> Optional[set[ident]]:
+    """
+    Returns the user-defined functions called by f, or None if the body of f writes to
+    an array or calls an impure builtin or an unknown function.
+    """
+    if any([isinstance(s, SubscriptAssign) for s in stmtTree(f.body)]):
+        return None
+    res: set[ident] = set()
+    for e in allExps(f.body):
+        match e:
+            case Call(Name(g, UserFun())):
+                res.add(g)
+            case Call(Name(g, BuiltinFun())) if g.name in pureBuiltins:
+                pass
+            case Call():
+                return None
+            case _:
+                pass
+    return res
+
+def memoizableFuns(m: Module) -> set[ident]:
+    """
+    Returns the names of the memoizable functions of m.
+    """
+    calls: dict[ident, set[ident]] = {}
+    for f in m.funs:
+        if hasScalarSignature(f):
+            cs = callees(f)
+            if cs is not None:
+                calls[f.name] = cs
+    changed = True
+    while changed:
+        changed = False
+        for f, cs in list(calls.items()):
+            if not cs.issubset(calls.keys()):
+                del calls[f]
+                changed = True
+    return set(calls.keys())
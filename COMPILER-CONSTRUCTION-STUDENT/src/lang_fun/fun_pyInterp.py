@@ -0,0 +1,136 @@
+"""
+Interpreter for lang_fun that translates the type-checked AST into python source code
+and runs the result with exec. See lang_loop.loop_pyInterp and lang_array.array_pyInterp
+for the general idea.
+
+Every function definition becomes a python function with prefix f_, so function values
+are python functions and calls reuse python's calling convention. As in fun_interp,
+the body of a function only sees its parameters, its local variables and the other
+top-level functions.
+
+The semantics is the same as in fun_interp, which remains the reference implementation.
+"""
+from lang_fun.fun_ast import *
+import lang_fun.fun_tychecker as fun_tychecker
+import common.utils as utils
+import common.log as log
+from common.genericInterp import InterpConfig
+from typing import *
+
+MAIN_FUN = 'main'
+
+binOps: dict[type, str] = {
+    Add: '+',
+    Sub: '-',
+    Mul: '*',
+    Less: '<',
+    LessEq: '<=',
+    Greater: '>',
+    GreaterEq: '>=',
+    Eq: '==',
+    NotEq: '!=',
+    Is: 'is',
+    And: 'and',
+    Or: 'or'
+}
+
+def pyVar(x: ident) -> str:
+    return f'v_{x.name}'
+
+def pyFun(x: ident) -> str:
+    return f'f_{x.name}'
+
+def transpileFuncall(fun: exp, args: list[exp]) -> str:
+    match (fun, args):
+        case (Name(Ident('input_int'), BuiltinFun()), []):
+            return 'input_int()'
+        case (Name(Ident('print'), BuiltinFun()), [e]):
+            return f'print({transpileExp(e)})'
+        case (Name(Ident('len'), BuiltinFun()), [e]):
+            return f'len({transpileExp(e)})'
+        case _:
+            argStrs = [transpileExp(a) for a in args]
+            return f'{transpileExp(fun)}({", ".join(argStrs)})'
+
+def transpileExp(e: exp) -> str:
+    match e:
+        case IntConst(value):
+            return repr(value)
+        case BoolConst(value):
+            return repr(value)
+        case Call(fun, args):
+            return transpileFuncall(fun, args)
+        case UnOp(op, sub):
+            x = transpileExp(sub)
+            match op:
+                case USub(): return f'(-{x})'
+                case Not(): return f'(not {x})'
+        case BinOp(left, op, right):
+            return f'({transpileExp(left)} {binOps[type(op)]} {transpileExp(right)})'
+        case Name(name, UserFun()):
+            return pyFun(name)
+        case Name(name):
+            return pyVar(name)
+        case ArrayInitDyn(lenExp, initExp):
+            return f'({transpileExp(lenExp)} * [{transpileExp(initExp)}])'
+        case ArrayInitStatic(es):
+            return '[' + ', '.join([transpileExp(e) for e in es]) + ']'
+        case Subscript(arrayExp, indexExp):
+            return f'{transpileExp(arrayExp)}[{transpileExp(indexExp)}]'
+    raise Exception(f'No match for expression {e}')
+
+def transpileStmt(s: stmt, indent: str, out: list[str]):
+    match s:
+        case StmtExp(e):
+            out.append(f'{indent}{transpileExp(e)}')
+        case Assign(x, e):
+            out.append(f'{indent}{pyVar(x)} = {transpileExp(e)}')
+        case IfStmt(cond, thenBody, elseBody):
+            out.append(f'{indent}if {transpileExp(cond)}:')
+            transpileStmts(thenBody, indent + '    ', out)
+            out.append(f'{indent}else:')
+            transpileStmts(elseBody, indent + '    ', out)
+        case WhileStmt(cond, body):
+            out.append(f'{indent}while {transpileExp(cond)}:')
+            transpileStmts(body, indent + '    ', out)
+        case SubscriptAssign(leftExp, idxExp, rightExp):
+            out.append(f'{indent}t_idx = {transpileExp(idxExp)}')
+            out.append(f'{indent}t_val = {transpileExp(rightExp)}')
+            out.append(f'{indent}{transpileExp(leftExp)}[t_idx] = t_val')
+        case Return(e):
+            if e is None:
+                out.append(f'{indent}return None')
+            else:
+                out.append(f'{indent}return {transpileExp(e)}')
+
+def transpileStmts(stmts: list[stmt], indent: str, out: list[str]):
+    if not stmts:
+        out.append(f'{indent}pass')
+    for s in stmts:
+        transpileStmt(s, indent, out)
+
+def transpileFun(f: FunDef, out: list[str]):
+    params = ', '.join([pyVar(p.var) for p in f.params])
+    out.append(f'def {pyFun(f.name)}({params}):')
+    transpileStmts(f.body, '    ', out)
+
+def transpileModule(m: Module) -> str:
+    """
+    Returns the python source code for the module. Calling the function MAIN_FUN
+    defined by the code runs the program.
+    """
+    out: list[str] = []
+    for f in m.funs:
+        transpileFun(f, out)
+    out.append(f'def {MAIN_FUN}():')
+    transpileStmts(m.stmts, '    ', out)
+    return '\n'.join(out) + '\n'
+
+def interpModule(m: mod, cfg: InterpConfig = InterpConfig()):
+    utils.assertType(m, Module)
+    fun_tychecker.tycheckModule(m)
+    src = transpileModule(m)
+    log.debug(f'Generated python code:\n{src}')
+    globals: dict[str, Any] = {'input_int': lambda: utils.inputInt('Enter some int: ')}
+    exec(compile(src, '<lang_fun>', 'exec'), globals)
+    globals[MAIN_FUN]()
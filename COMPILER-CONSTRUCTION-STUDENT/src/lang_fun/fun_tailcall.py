@@ -0,0 +1,112 @@
+"""
+Elimination of self tail calls on the type-checked AST. Used by the compiler and the
+tree and closure interpreters, so that deep tail recursion runs in constant stack space.
+
+A call of a function f inside f is a tail call if it is the last thing f does on its
+path: `return f(...)`, or a call of a void function f as the last statement of a path.
+If the body of f is in tail form (see lang_fun.fun_inline.tailForm), it becomes
+
+    while True:
+        body
+
+where every tail call assigns the arguments to the parameters (so the loop starts the
+next call), and every path without a return or a tail call ends with `return`. The other
+local variables keep their values from the previous iteration, but the type checker
+ensures that every variable is assigned before its use, so this is not observable.
+
+The arguments are evaluated in order before any parameter changes: an argument is stored
+in a fresh variable if a later argument reads the parameter it is assigned to.
+Mutual recursion and functions with a return inside a loop are left unchanged.
+"""
+from lang_fun.fun_ast import *
+from lang_fun.fun_tychecker import TycheckResult, LocalVar
+from lang_fun.fun_transform import Ctx, funCtx
+from lang_fun.fun_inline import tailForm, expTree
+from typing import *
+import common.log as log
+
+def selfCall(f: FunDef, e: exp) -> Optional[list[exp]]:
+    """
+    Returns the arguments if e is a call of f.
+    """
+    match e:
+        case Call(Name(g, UserFun()), args) if g == f.name:
+            return args
+        case _:
+            return None
+
+def reads(e: exp) -> set[ident]:
+    return {x.var for x in expTree(e) if isinstance(x, Name) and isinstance(x.scope, Var)}
+
+def nextCall(f: FunDef, args: list[exp], ctx: Ctx) -> list[stmt]:
+    """
+    Assigns the arguments of a tail call to the parameters of f.
+    """
+    stmts: list[stmt] = []
+    delayed: list[stmt] = []
+    for i, (p, arg) in enumerate(zip(f.params, args)):
+        match arg:
+            case Name(x, Var()) if x == p.var:
+                continue
+            case _:
+                pass
+        if any([p.var in reads(later) for later in args[i+1:]]):
+            tmp = ctx.newVar(p.ty)
+            stmts.append(Assign(tmp, arg))
+            delayed.append(Assign(p.var, Name(tmp, Var(), NotVoid(p.ty))))
+        else:
+            stmts.append(Assign(p.var, arg))
+    return stmts + delayed
+
+class Rewrite:
+    def __init__(self, f: FunDef, ctx: Ctx):
+        self.f = f
+        self.ctx = ctx
+        self.tailCalls = 0
+
+    def paths(self, stmts: list[stmt]) -> list[stmt]:
+        """
+        Rewrites the ends of all paths through stmts, which must be in tail form.
+        """
+        match stmts:
+            case [*init, Return(e)] if e is not None and (args := selfCall(self.f, e)) is not None:
+                self.tailCalls += 1
+                return init + nextCall(self.f, args, self.ctx)
+            case [*init, StmtExp(e)] | [*init, StmtExp(e), Return(None)] \
+                    if (args := selfCall(self.f, e)) is not None:
+                self.tailCalls += 1
+                return init + nextCall(self.f, args, self.ctx)
+            case [*_, Return()]:
+                return stmts
+            case [*init, IfStmt(cond, thenBody, elseBody)]:
+                return init + [IfStmt(cond, self.paths(thenBody), self.paths(elseBody))]
+            case _:
+                return stmts + [Return(None)]
+
+def eliminateTailCalls(f: FunDef, ctx: Ctx) -> list[stmt]:
+    """
+    Returns the body of f with self tail calls turned into a loop, or the unchanged body
+    if f has no self tail calls. The fresh variables are taken from ctx.
+    """
+    body = tailForm(f.body)
+    if body is None:
+        return f.body
+    r = Rewrite(f, ctx)
+    loopBody = r.paths(body)
+    if r.tailCalls == 0:
+        return f.body
+    log.info(f'Turned {r.tailCalls} tail calls of {f.name.name} into a loop')
+    return [WhileStmt(BoolConst(True, NotVoid(Bool())), loopBody)]
+
+def eliminateModule(m: Module, vars: TycheckResult) -> tuple[Module, TycheckResult]:
+    """
+    Eliminates the self tail calls of all functions in m. Returns the new module and
+    its local variables.
+    """
+    funs: list[FunDef] = []
+    funLocals: dict[ident, list[LocalVar]] = {}
+    for f in m.funs:
+        ctx = funCtx(f.params, [v.name for v in vars.funLocals[f.name]])
+        funs.append(FunDef(f.name, f.params, f.result, eliminateTailCalls(f, ctx)))
+        funLocals[f.name] = vars.funLocals[f.name] + [LocalVar(x, t) for x, t in ctx.freshVars.items()]
+    return (Module(funs, m.stmts), TycheckResult(funLocals, vars.toplevelLocals))
@@ -0,0 +1,221 @@
+from lang_fun.fun_ast import *
+import lang_fun.fun_astAtom as atom
+from common.compilerSupport import *
+import common.utils as utils
+from typing import *
+import copy
+
+# Statements computing the temporaries of an expression. Mostly assignments, but the
+# temporaries of the right operand of and/or are only computed if it is evaluated.
+type Temporaries = list[atom.stmt]
+
+class Ctx:
+    """
+    Context for getting fresh variable names. Every function has its own context.
+    The names in taken (the variables of the function) are never returned.
+    """
+    def __init__(self, taken: Iterable[ident] = ()):
+        self.freshVars: dict[ident, ty] = {}
+        self.taken = set(taken)
+        self.nextId = 0
+    def newVar(self, t: ty) -> ident:
+        """
+        Get a fresh variable of the given type.
+        """
+        x = Ident(f'tmp_{self.nextId}')
+        self.nextId += 1
+        while x in self.taken:
+            x = Ident(f'tmp_{self.nextId}')
+            self.nextId += 1
+        self.freshVars[x] = t
+        return x
+
+def funCtx(params: list[funParam], locals: Iterable[ident]) -> Ctx:
+    """
+    Returns a new context for a function with the given parameters and local variables.
+    """
+    return Ctx([p.var for p in params] + list(locals))
+
+def transExpAtomic(e: exp, ctx: Ctx) -> tuple[atom.atomExp, Temporaries]:
+    """
+    Translates e to an atomic expression. Essentially a shortcut for transExp(e, True, ctx).
+    """
+    (res, ts) = transExp(e, True, ctx)
+    match res:
+        case atom.AtomExp(a):
+            return (a, ts)
+        case _:
+            utils.abort(f'transExp with needAtom=True failed to return an atomic expression: {e}')
+
+def assertExpNotVoid(e: exp | atom.exp) -> ty:
+    """
+    Asserts that e is an expression of a non-void type.
+    """
+    match e.ty:
+        case None:
+            raise ValueError(f'type still None after type-checking. Expression: {e}')
+        case Void():
+            raise ValueError(f'type of {e} is Void after type-checking.')
+        case NotVoid(t):
+            return t
+
+def assertResultTy(e: exp) -> resultTy:
+    if e.ty is None:
+        raise ValueError(f'type still None after type-checking. Expression: {e}')
+    return e.ty
+
+def atomic(needAtomic: bool, e: atom.exp, tmps: Temporaries, ctx: Ctx) -> tuple[atom.exp, Temporaries]:
+    """
+    Converts e to an atomic expression if needAtomic is True.
+    """
+    if needAtomic and not isinstance(e, atom.AtomExp):
+        t = assertExpNotVoid(e)
+        tmp = ctx.newVar(t)
+        return (atom.AtomExp(atom.VarName(tmp, t), e.ty), tmps + [atom.Assign(tmp, e)])
+    else:
+        return (e, tmps)
+
+def transOperands(es: list[exp], ctx: Ctx) -> tuple[list[atom.exp], Temporaries]:
+    """
+    Translates the operands of an operator or a call, which are evaluated from left to
+    right. An operand followed by an operand with temporaries becomes atomic, so that it
+    is still evaluated before the temporaries of the later operand (which might call a
+    function with side effects).
+    """
+    translated = [transExp(e, False, ctx) for e in es]
+    results: list[atom.exp] = []
+    tmps: Temporaries = []
+    for i, (a, ts) in enumerate(translated):
+        laterTmps = any([later for (_, later) in translated[i+1:]])
+        (a, ts) = atomic(laterTmps, a, ts, ctx)
+        results.append(a)
+        tmps += ts
+    return (results, tmps)
+
+def transCallTarget(f: exp, ctx: Ctx) -> tuple[atom.callTarget, Temporaries]:
+    match f:
+        case Name(x, BuiltinFun()):
+            return (atom.CallTargetBuiltin(x), [])
+        case Name(x, UserFun()):
+            return (atom.CallTargetDirect(x), [])
+        case _:
+            match assertExpNotVoid(f):
+                case Fun(params, result):
+                    pass
+                case t:
+                    raise ValueError(f'Call of {f} with non-function type {t}')
+            (a, tmps) = transExpAtomic(f, ctx)
+            match a:
+                case atom.VarName(x):
+                    return (atom.CallTargetIndirect(x, params, result), tmps)
+                case _:
+                    utils.abort(f'Unexpected atomic expression {a} for a function value')
+
+def transExp(e: exp, needAtomic: bool, ctx: Ctx, allocOk: bool = False) -> tuple[atom.exp, Temporaries]:
+    """
+    Translates expression e (of type fun_ast.exp) to an expression of type
+    fun_astAtom.exp, together with the statements computing the temporary variables
+    used by the translated expression.
+
+    If the flag needAtomic is True, then the translated expression is an atomic expression,
+    that is something of the form fun_astAtom.AtomExp(...).
+
+    Allocating an array may trigger the garbage collector, which moves arrays. Hence,
+    an array allocation or a call of a user-defined function (which might allocate) is
+    turned into an atomic expression unless the flag allocOk is True, so that no other
+    array pointer can be on the wasm stack while allocating.
+    """
+    t = assertResultTy(e)
+    match e:
+        case IntConst(v):
+            return (atom.AtomExp(atom.IntConst(v, Int()), t), [])
+        case BoolConst(v):
+            return (atom.AtomExp(atom.BoolConst(v, Bool()), t), [])
+        case Name(x, UserFun()):
+            return (atom.AtomExp(atom.FunName(x, assertExpNotVoid(e)), t), [])
+        case Name(x):
+            return (atom.AtomExp(atom.VarName(x, assertExpNotVoid(e)), t), [])
+        case Call(f, args):
+            (target, tmps1) = transCallTarget(f, ctx)
+            (atomArgs, tmps2) = transOperands(args, ctx)
+            mayAllocate = not isinstance(target, atom.CallTargetBuiltin)
+            return atomic(needAtomic or (mayAllocate and not allocOk),
+                          atom.Call(target, atomArgs, t), tmps1 + tmps2, ctx)
+        case UnOp(op, sub):
+            (atomSub, tmps) = transExp(sub, False, ctx)
+            return atomic(needAtomic, atom.UnOp(op, atomSub, t), tmps, ctx)
+        case BinOp(left, And() | Or() as op, right):
+            (l, tmps1) = transExp(left, False, ctx)
+            (r, tmps2) = transExp(right, False, ctx)
+            if not tmps2:
+                return atomic(needAtomic, atom.BinOp(l, op, r, t), tmps1, ctx)
+            # The temporaries of the right operand must only be computed if it is evaluated
+            tmp = ctx.newVar(Bool())
+            tmpExp = atom.AtomExp(atom.VarName(tmp, Bool()), t)
+            evalRight = tmps2 + [atom.Assign(tmp, r)]
+            if isinstance(op, And):
+                cond = atom.IfStmt(tmpExp, evalRight, [])
+            else:
+                cond = atom.IfStmt(tmpExp, [], evalRight)
+            return (tmpExp, tmps1 + [atom.Assign(tmp, l), cond])
+        case BinOp(left, op, right):
+            ([l, r], tmps) = transOperands([left, right], ctx)
+            return atomic(needAtomic, atom.BinOp(l, op, r, t), tmps, ctx)
+        case ArrayInitDyn(lenExp, elemInit):
+            (atomLen, tmps1) = transExpAtomic(lenExp, ctx)
+            (atomElem, tmps2) = transExpAtomic(elemInit, ctx)
+            return atomic(needAtomic or not allocOk, atom.ArrayInitDyn(atomLen, atomElem, t), tmps1 + tmps2, ctx)
+        case ArrayInitStatic(initExps):
+            (atomArgs, tmps) = utils.unzip([transExpAtomic(i, ctx) for i in initExps])
+            return atomic(needAtomic or not allocOk, atom.ArrayInitStatic(atomArgs, t), utils.flatten(tmps), ctx)
+        case Subscript(arrExp, indexExp):
+            (atomArr, tmps1) = transExpAtomic(arrExp, ctx)
+            (atomIndex, tmps2) = transExpAtomic(indexExp, ctx)
+            return atomic(needAtomic, atom.Subscript(atomArr, atomIndex, t), tmps1 + tmps2, ctx)
+
+def transStmt(s: stmt, ctx: Ctx) -> list[atom.stmt]:
+    """
+    Translates statement s (of type fun_ast.stmt) to statements of type fun_astAtom.stmt.
+    """
+    match s:
+        case StmtExp(e):
+            (a, tmps) = transExp(e, False, ctx, allocOk=True)
+            return tmps + [atom.StmtExp(a)]
+        case Assign(x, e):
+            (a, tmps) = transExp(e, False, ctx, allocOk=True)
+            return tmps + [atom.Assign(x, a)]
+        case IfStmt(cond, thenBody, elseBody):
+            (a, tmps1) = transExp(cond, False, ctx)
+            stmts1 = transStmts(thenBody, ctx)
+            stmts2 = transStmts(elseBody, ctx)
+            return tmps1 + [atom.IfStmt(a, stmts1, stmts2)]
+        case WhileStmt(cond, body):
+            (a, tmps1) = transExp(cond, False, ctx)
+            stmts = transStmts(body, ctx)
+            # The condition is evaluated before every iteration, so its temporaries are
+            # computed again at the end of the body
+            return tmps1 + [atom.WhileStmt(a, stmts + copy.deepcopy(tmps1))]
+        case SubscriptAssign(leftExp, indexExp, rightExp):
+            # Like the interpreter, evaluate the index, then the right-hand side, then
+            # the array. The right-hand side must be atomic if the array has temporaries.
+            (i, tmps1) = transExpAtomic(indexExp, ctx)
+            (r, tmps2) = transExp(rightExp, False, ctx)
+            (l, tmps3) = transExpAtomic(leftExp, ctx)
+            if tmps3:
+                (r, tmps2) = atomic(True, r, tmps2, ctx)
+            return tmps1 + tmps2 + tmps3 + [atom.SubscriptAssign(l, i, r)]
+        case Return(e):
+            if e is None:
+                return [atom.Return(None)]
+            (a, tmps) = transExp(e, False, ctx, allocOk=True)
+            return tmps + [atom.Return(a)]
+
+def transStmts(stmts: list[stmt], ctx: Ctx) -> list[atom.stmt]:
+    """
+    Main entry point, transforming a list of statements (the body of a function or the
+    toplevel code). This function is called from compilers.fun_compiler.compileModule.
+    """
+    result: list[atom.stmt] = []
+    for s in stmts:
+        result.extend(transStmt(s, ctx))
+    return result
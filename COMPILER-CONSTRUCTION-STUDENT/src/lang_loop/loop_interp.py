@@ -1,6 +1,7 @@
 from lang_loop.loop_ast import *
 import lang_loop.loop_tychecker as loop_tychecker
 import common.utils as utils
+from common.genericInterp import InterpConfig
 from typing import *
 
 type Environ = dict[Ident, TyValue]
@@ -56,33 +57,33 @@ def interpExp(e: exp, env: Environ) -> Optional[TyValue]:
             return env[name]
     raise Exception(f'No match for expression {e}')
 
-def interpStmt(s: stmt, env: Environ, cont: list[stmt]) -> None:
+def interpStmt(s: stmt, env: Environ) -> None:
     match s:
         case StmtExp(e):
             interpExp(e, env)
-            interpStmts(cont, env)
         case Assign(x, e):
             v: Any = interpExp(e, env)
             env[x] = v
-            interpStmts(cont, env)
         case IfStmt(cond, thenBody, elseBody):
-            v: Any = interpExp(cond, env)
-            if v:
-                interpStmts(thenBody + cont, env)
+            c: Any = interpExp(cond, env)
+            if c:
+                interpStmts(thenBody, env)
             else:
-                interpStmts(elseBody + cont, env)
+                interpStmts(elseBody, env)
         case WhileStmt(cond, body):
-            v: Any = interpExp(cond, env)
-            if v:
-                interpStmts(body + [s] + cont, env)
-            else:
-                interpStmts(cont, env)
+            while interpExp(cond, env):
+                interpStmts(body, env)
 
 def interpStmts(stmts: list[stmt], env: Environ) -> None:
-    if len(stmts) > 0:
-        interpStmt(stmts[0], env, stmts[1:])
+    """
+    Executes the statements one after the other. Loops are run by a python while loop,
+    so the depth of the python stack only depends on the nesting of the statements
+    but not on the number of statements executed.
+    """
+    for s in stmts:
+        interpStmt(s, env)
 
-def interpModule(m: mod):
+def interpModule(m: mod, cfg: InterpConfig = InterpConfig()):
     utils.assertType(m, Module)
     loop_tychecker.tycheckModule(m)
     interpStmts(m.stmts, {})
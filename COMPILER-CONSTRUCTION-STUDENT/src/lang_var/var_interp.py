@@ -1,6 +1,7 @@
 from lang_var.var_ast import *
 import lang_var.var_tychecker as var_tychecker
 import common.utils as utils
+from common.genericInterp import InterpConfig
 from typing import *
 
 type Env = dict[Ident, TyValue]
@@ -49,7 +50,7 @@ def interpStmts(stmts: list[stmt], env: Env) -> None:
     for stmt in stmts:
         interpStmt(stmt, env)
 
-def interpModule(m: mod):
+def interpModule(m: mod, cfg: InterpConfig = InterpConfig()):
     utils.assertType(m, Module)
     var_tychecker.tycheckModule(m)
     interpStmts(m.stmts, {})
@@ -3,19 +3,32 @@ from typing import *
 import common.genericCompiler as genericCompiler
 import common.genericInterp as genericInterp
 import common.genericParser as genericParser
+import common.peephole as peephole
 import common.utils as utils
 import common.log as log
 import common.constants as constants
+import common.server as server
 import parsers.lang_simple.simple_parser as simple_parser
+from concurrent.futures import ProcessPoolExecutor
 import importlib
+import json
 import shell
 import sys
 import os
+import time
 import typing
 
 DEFAULT_OUTPUT = 'out.wasm'
+DEFAULT_COMPILE_CACHE = '.compile_cache'
+DEFAULT_MANIFEST = 'batch-results.json'
 
-def parseArgs():
+# Maps the name of an interpreter engine to the suffix of the module implementing it.
+INTERP_ENGINES = {'tree': 'interp', 'closure': 'closureInterp', 'python': 'pyInterp'}
+
+# The commands a server started with the serve command runs.
+SERVE_COMMANDS = ['compile', 'interp', 'pyrun']
+
+def parseArgs(argv: Optional[list[str]] = None):
     parser = argparse.ArgumentParser(description=f'Run the compiler or interpreter for some language')
     parser.add_argument('--lang', choices=['simple', 'var', 'loop', 'array', 'fun', 'tinyJson'],
                         help='The language (guessed from path of input file if not given)')
@@ -28,17 +41,74 @@ the format is textual or binary.
 Exit code {constants.COMPILE_ERROR_EXIT_CODE} for compile error (source program is faulty), all other
 exit codes signal a bug in the compiler itself.'''
     cp = subparsers.add_parser('compile', help=helpCompiler)
-    def addCompilerArgs(p: argparse.ArgumentParser):
-        p.add_argument('--wat2wasm', default='wat2wasm',
-                           help='Path to the wat2wasm tool')
-        p.add_argument('--output', default=DEFAULT_OUTPUT,
-                       help=f'Output file (.wat or .wasm). Default: {DEFAULT_OUTPUT}')
+    def addBatchArgs(p: argparse.ArgumentParser):
+        p.add_argument('--jobs', type=int, default=os.cpu_count(),
+                       help='Number of worker processes (default: number of cores)')
+        p.add_argument('--manifest', default=DEFAULT_MANIFEST,
+                       help='JSON file receiving the exit code, stdout and stderr of every ' \
+                           f'input file (default: {DEFAULT_MANIFEST}). The command exits with ' \
+                           'code 1 if any file has a non-zero exit code')
+        p.add_argument('inputs', nargs='+', metavar='input',
+                       help='Input files .py. If FILE.in exists, it is used as stdin for FILE.py')
+    def addCompilerArgs(p: argparse.ArgumentParser, batch: bool = False):
+        p.add_argument('--wat2wasm',
+                           help='Path to the wat2wasm tool. If given, .wasm files are produced ' \
+                               'by wat2wasm instead of the builtin binary encoder')
+        p.add_argument('--emit-wat', action=argparse.BooleanOptionalAction, default=True,
+                       help='Also write the textual representation (.wat) next to a .wasm output ' \
+                           'file (default: enabled)')
+        p.add_argument('--pretty-wat', action='store_true',
+                       help='Lay out the textual representation with the prettyprinter instead of ' \
+                           'writing it line by line (slow for large modules)')
+        p.add_argument('--opt-level', type=int, choices=range(peephole.maxOptLevel + 1),
+                       default=peephole.defaultOptLevel,
+                       help='Optimization level of the peephole optimizer, 0 disables it ' \
+                           f'(default: {peephole.defaultOptLevel})')
+        p.add_argument('--opt-stats', action='store_true',
+                       help='Print the number of hits of each peephole rule to stderr')
         p.add_argument('--max-mem-size', type=int,
-                       help="Max memory size in number of 64kB pages")
+                       help="Max memory size in number of 64kB pages. The garbage collector " \
+                           "needs about twice as many pages for the same arrays and allocates them, " \
+                           "but at most the 65536 pages addressable with i32")
         p.add_argument('--max-array-size', type=int,
                        help="Max size of an array in bytes")
-        p.add_argument('input', help='Input file .py')
+        p.add_argument('--gc', action=argparse.BooleanOptionalAction, default=True,
+                       help='Free unreachable arrays with a copying garbage collector, which ' \
+                           'doubles the memory of the module (default: enabled)')
+        p.add_argument('--inline-fast-path', action=argparse.BooleanOptionalAction, default=True,
+                       help='Inline array allocations and bounds checks, and only call runtime ' \
+                           'functions for errors. Without it, the code is smaller but slower ' \
+                           '(default: enabled)')
+        p.add_argument('--inline-calls', action=argparse.BooleanOptionalAction, default=True,
+                       help='Inline calls of small non-recursive functions (only lang_fun, ' \
+                           'default: enabled)')
+        p.add_argument('--tail-calls', action=argparse.BooleanOptionalAction, default=True,
+                       help='Turn self tail calls into loops (only lang_fun, default: enabled)')
+        p.add_argument('--compile-cache', action=argparse.BooleanOptionalAction, default=True,
+                       help='Reuse the output of an earlier compilation of the same source with ' \
+                           'the same compiler and options (not with --wat2wasm, default: enabled). ' \
+                           'Only the python modules of the compiler are part of the key, so use ' \
+                           '--no-compile-cache if the output may be stale, for example after ' \
+                           'changing a .lark grammar or an installed package')
+        p.add_argument('--compile-cache-dir', default=DEFAULT_COMPILE_CACHE,
+                       help=f'Directory of the compile cache (default: {DEFAULT_COMPILE_CACHE})')
+        p.add_argument('--compile-cache-size', type=int, default=100,
+                       help='Max size of the compile cache in MB, the least recently used ' \
+                           'entries are deleted (default: 100)')
+        if batch:
+            p.add_argument('--output-dir',
+                           help='Directory of the output files, DIR/FILE.py is compiled to ' \
+                               'OUTPUT_DIR/DIR/FILE.wasm (default: DIR/FILE.wasm)')
+            addBatchArgs(p)
+        else:
+            p.add_argument('--output', default=DEFAULT_OUTPUT,
+                           help=f'Output file (.wat or .wasm). Default: {DEFAULT_OUTPUT}')
+            p.add_argument('input', help='Input file .py')
     addCompilerArgs(cp)
+    cpBatch = subparsers.add_parser('compile-batch',
+                                    help='Compiles the given input files in parallel, see the ' \
+                                        'compile command for the options')
+    addCompilerArgs(cpBatch, batch=True)
     run = subparsers.add_parser('run', help='Compiles the given program and runs it with iwasm. Also see the ' \
         'compile command for help')
     run.add_argument('--run-wasm', default='wasm-support/run_iwasm',
@@ -46,8 +116,46 @@ exit codes signal a bug in the compiler itself.'''
     addCompilerArgs(run)
 
     interp = subparsers.add_parser('interp', help='Runs the given file through our own interpeter')
-    interp.add_argument('--level', help='The loglevel (debug, info, warn)')
-    interp.add_argument('input', help='Input file .py')
+    def addInterpArgs(p: argparse.ArgumentParser, batch: bool = False):
+        p.add_argument('--level', help='The loglevel (debug, info, warn)')
+        p.add_argument('--engine', choices=list(INTERP_ENGINES.keys()), default='tree',
+                       help='tree: walk the AST directly (default), closure: compile the AST ' \
+                           'to python closures before running it (only lang_array and lang_fun), ' \
+                           'python: translate the AST to python code and run it with exec ' \
+                           '(only lang_loop, lang_array and lang_fun)')
+        p.add_argument('--gc', action='store_true',
+                       help='Free unreachable arrays with a mark-and-sweep garbage collector ' \
+                           '(only tree engine for lang_array and lang_fun)')
+        p.add_argument('--gc-threshold', type=int, default=genericInterp.InterpConfig.defaultGcThreshold,
+                       help='Number of bytes allocated between two garbage collections ' \
+                           f'(default: {genericInterp.InterpConfig.defaultGcThreshold})')
+        p.add_argument('--gc-stats', action='store_true',
+                       help='Print statistics of the garbage collector to stderr')
+        p.add_argument('--inline-calls', action='store_true',
+                       help='Inline calls of small non-recursive functions before running ' \
+                           'the program (only tree and closure engine for lang_fun)')
+        p.add_argument('--tail-calls', action=argparse.BooleanOptionalAction, default=True,
+                       help='Turn self tail calls into loops, so that deep tail recursion does ' \
+                           'not exhaust the stack (only tree and closure engine for lang_fun, ' \
+                           'default: enabled)')
+        p.add_argument('--memoize', action='store_true',
+                       help='Cache the results of functions whose result only depends on their ' \
+                           'int and bool arguments (only tree engine for lang_fun)')
+        p.add_argument('--memo-size', type=int, default=genericInterp.InterpConfig.memoSize,
+                       help='Maximal number of cached results, the least recently used result ' \
+                           f'is evicted first (default: {genericInterp.InterpConfig.memoSize})')
+        p.add_argument('--memo-stats', action='store_true',
+                       help='Print statistics of the result cache to stderr')
+        if batch:
+            addBatchArgs(p)
+        else:
+            p.add_argument('input', help='Input file .py')
+    addInterpArgs(interp)
+    interpBatch = subparsers.add_parser('interp-batch',
+                                        help='Runs the given input files through our own ' \
+                                            'interpreter in parallel, see the interp command for ' \
+                                            'the options')
+    addInterpArgs(interpBatch, batch=True)
 
     tacInterp = subparsers.add_parser('tacInterp',
                                       help='Compiles the given file to wasm, generates TAC, and ' \
@@ -81,7 +189,18 @@ exit codes signal a bug in the compiler itself.'''
                    help='Optional .png for for parse tree visualization')
     p.add_argument('input', help='Input file .py')
 
-    args = parser.parse_args()
+    serve = subparsers.add_parser('serve',
+                                  help='Reads requests to run the commands ' \
+                                      f'{", ".join(SERVE_COMMANDS)} as JSON lines and answers ' \
+                                      'with their exit code, stdout and stderr (see ' \
+                                      'src/common/server.py). Avoids the startup time of a ' \
+                                      'new process for every command.')
+    serve.add_argument('--level', help='The loglevel (debug, info, warn)')
+    serve.add_argument('--socket', metavar='PATH',
+                       help='Listen on this unix socket instead of reading stdin and ' \
+                           'writing stdout')
+
+    args = parser.parse_args(argv)
     if args.cmd is None:
         utils.abort(f'No command given')
     if args.lang == 'simple' and args.cmd != 'parse':
@@ -103,6 +222,15 @@ def importModule(lang: str, kind: Literal['compile', 'interp', 'ast', 'parse']):
     m = importlib.import_module(modName)
     return m
 
+def importInterpModule(lang: str, engine: str):
+    modName = f'lang_{lang}.{lang}_{INTERP_ENGINES[engine]}'
+    try:
+        return importlib.import_module(modName)
+    except ModuleNotFoundError as e:
+        if e.name != modName:
+            raise e
+        utils.abort(f'Interpreter engine {engine} not available for language {lang}')
+
 def getFun(mod: Any, fun: str):
     try:
         return getattr(mod, fun)
@@ -127,10 +255,77 @@ PRELUDE_DICT = {
 
 def runWithPython(srcFile: str):
     src = utils.readTextFile(srcFile)
-    exec(src, PRELUDE_DICT)
+    exec(src, dict(PRELUDE_DICT))
+
+def runServeCommand(argv: list[str]):
+    args = parseArgs(argv)
+    if args.cmd not in SERVE_COMMANDS:
+        utils.abort(f'Command {args.cmd} not available in server mode')
+    runCommand(args)
+
+def runBatchItem(args: argparse.Namespace, input: str|None) -> dict[str, Any]:
+    start = time.perf_counter()
+    res = server.runCaptured(lambda: runCommand(args), input)
+    return {'input': args.input, 'output': getattr(args, 'output', None),
+            'exitcode': res.exitcode, 'stdout': res.stdout, 'stderr': res.stderr,
+            'seconds': round(time.perf_counter() - start, 3)}
+
+def batchOutput(input: str, outputDir: str|None) -> str:
+    """
+    Returns the output file for the input file of compile-batch. Inside outputDir, the
+    directories of the input file are recreated, so that input files with the same name
+    do not overwrite each other's output.
+    """
+    base = shell.removeExt(input)
+    if outputDir is None:
+        return base + '.wasm'
+    rel = os.path.normpath(base)
+    if os.path.isabs(rel) or rel.startswith('..'):
+        rel = os.path.relpath(os.path.abspath(rel), os.sep)
+    output = shell.pjoin(outputDir, rel + '.wasm')
+    shell.mkdirs(shell.dirname(output))
+    return output
+
+def runBatch(args: argparse.Namespace):
+    """
+    Runs compile or interp for every input file in a pool of worker processes and writes
+    the results to the manifest. The language is guessed for every file separately
+    (unless given with --lang). Exits with code 1 if any file failed.
+    """
+    cmd = args.cmd.removesuffix('-batch')
+    fileArgs: list[argparse.Namespace] = []
+    inputs: list[str|None] = []
+    for f in args.inputs:
+        a = argparse.Namespace(**vars(args))
+        a.cmd = cmd
+        a.input = f
+        if cmd == 'compile':
+            a.output = batchOutput(f, args.output_dir)
+        fileArgs.append(a)
+        inFile = shell.removeExt(f) + '.in'
+        inputs.append(utils.readTextFile(inFile) if shell.isFile(inFile) else None)
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(runBatchItem, fileArgs, inputs))
+    with open(args.manifest, 'w') as f:
+        json.dump({'command': cmd, 'results': results}, f, indent=2)
+    failed = len([r for r in results if r['exitcode'] != 0])
+    print(f'{cmd}: {len(results)} files, {failed} with non-zero exit code, results in {args.manifest}')
+    if failed > 0:
+        sys.exit(1)
 
 def main():
     args = parseArgs()
+    match args.cmd:
+        case 'serve':
+            level = log.resolveLevelName(args.level or 'warn')
+            log.init(level, None)
+            server.serve(runServeCommand, args.socket)
+        case 'compile-batch' | 'interp-batch':
+            runBatch(args)
+        case _:
+            runCommand(args)
+
+def runCommand(args: argparse.Namespace):
     level = log.resolveLevelName(args.level or 'warn')
     log.init(level, 'minipy.log')
     if args.lang:
@@ -154,15 +349,36 @@ def main():
             compilerMod = importModule(lang, 'compile')
             compileFun = getFun(compilerMod, 'compileModule')
             compileArgs = genericCompiler.Args(args.input, args.output, args.wat2wasm,
-                                                args.max_mem_size, args.max_array_size)
+                                                args.max_mem_size, args.max_array_size,
+                                                gc=args.gc, inlineFastPath=args.inline_fast_path,
+                                                inlineCalls=args.inline_calls,
+                                                tailCalls=args.tail_calls,
+                                                emitWat=args.emit_wat,
+                                                prettyWat=args.pretty_wat, optLevel=args.opt_level,
+                                                optStats=args.opt_stats,
+                                                compileCache=args.compile_cache_dir \
+                                                    if args.compile_cache else None,
+                                                compileCacheSize=args.compile_cache_size * 1024 * 1024)
             genericCompiler.compileMain(compileArgs, compileFun, ast)
             if args.cmd == "run":
                 runWasm(args.run_wasm, args.output)
         case "interp":
             ast = importModule(lang, 'ast')
-            interpMod = importModule(lang, 'interp')
+            interpMod = importInterpModule(lang, args.engine)
             interpFun = getFun(interpMod, 'interpModule')
-            interpArgs = genericInterp.Args(args.input)
+            if (args.gc or args.gc_stats) and (args.engine != 'tree' or lang not in ['array', 'fun']):
+                utils.abort('Garbage collection only available for the tree engine of lang_array and lang_fun')
+            if args.inline_calls and (args.engine == 'python' or lang != 'fun'):
+                utils.abort('Inlining only available for the tree and closure engine of lang_fun')
+            if (args.memoize or args.memo_stats) and (args.engine != 'tree' or lang != 'fun'):
+                utils.abort('Memoization only available for the tree engine of lang_fun')
+            gcThreshold = args.gc_threshold if args.gc else None
+            interpCfg = genericInterp.InterpConfig(gcThreshold=gcThreshold, gcStats=args.gc_stats,
+                                                   inlineCalls=args.inline_calls,
+                                                   tailCalls=args.tail_calls,
+                                                   memoize=args.memoize, memoSize=args.memo_size,
+                                                   memoStats=args.memo_stats)
+            interpArgs = genericInterp.Args(args.input, interpCfg)
             genericInterp.interpMain(interpArgs, interpFun, ast)
         case "pyrun":
             runWithPython(args.input)
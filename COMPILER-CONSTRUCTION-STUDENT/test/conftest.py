@@ -1,4 +1,11 @@
 import pytest
+from typing import *
+import common.testsupport as testsupport
+
+def pytest_addoption(parser: pytest.Parser):
+    parser.addoption('--regen-goldens', action='store_true',
+                     help='Recompute all golden outputs in .test_cache, not only missing or ' \
+                         'out-of-date ones')
 
 def pytest_configure(config: pytest.Config):
     config.addinivalue_line(
@@ -20,3 +27,26 @@ def pytest_itemcollected(item: pytest.Item):
     if found and not 'instructor' in item.extra_keyword_matches:
         print('adding kw')
         item.extra_keyword_matches.update('instructor')
+
+def pytest_collection_finish(session: pytest.Session):
+    """
+    Computes the missing golden outputs of all selected file tests in parallel. Then calls
+    the prefetch function of the test module for every selected parametrized test, so
+    that the commands of file tests run in parallel (see testsupport.TestPool).
+    """
+    if session.config.option.collectonly:
+        return
+    srcFiles: list[str] = []
+    for item in session.items:
+        callspec = getattr(item, 'callspec', None)
+        if callspec is not None and 'srcFile' in callspec.params:
+            srcFiles.append(callspec.params['srcFile'])
+    testsupport.regenGoldens(srcFiles, force=bool(session.config.getoption('regen_goldens')))
+    for item in session.items:
+        prefetch = getattr(getattr(item, 'module', None), 'prefetch', None)
+        callspec = getattr(item, 'callspec', None)
+        if prefetch is not None and callspec is not None:
+            prefetch(cast(pytest.Function, item).originalname, callspec.params)
+
+def pytest_sessionfinish(session: pytest.Session):
+    testsupport.testPool.shutdown()
@@ -0,0 +1,17 @@
+from common.wasm import *
+from common.compilerSupport import calledFuncs
+from lang_array.array_compilerSupport import Runtime
+
+def checks(n: int) -> list[WasmInstr]:
+    check: list[WasmInstr] = [WasmInstrConst('i32', 0),
+                              WasmInstrIf(None, [WasmInstrCall(Runtime.trapIndex)], [])]
+    return n * check
+
+def test_linkInlinesRareTraps():
+    rare = Runtime.link(None, [WasmFunc(WasmId('$main'), [], None, [], checks(1))])
+    assert [f.id for f in rare] == [WasmId('$main')]
+    assert calledFuncs(rare[0].instrs) == {WasmId('$print_err')}
+    n = Runtime.minTrapCalls
+    frequent = Runtime.link(None, [WasmFunc(WasmId('$main'), [], None, [], checks(n))])
+    assert [f.id for f in frequent] == [WasmId('$main'), Runtime.trapIndex]
+    assert calledFuncs(frequent[0].instrs) == {Runtime.trapIndex}
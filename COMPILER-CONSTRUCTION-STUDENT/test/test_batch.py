@@ -0,0 +1,46 @@
+import shell
+import json
+import common.utils as utils
+import common.constants as constants
+
+def writeFiles(tmp_path: str) -> list[str]:
+    files = [shell.pjoin(tmp_path, 'lang_var', 'a.py'), shell.pjoin(tmp_path, 'lang_fun', 'a.py'),
+             shell.pjoin(tmp_path, 'lang_loop', 'bad.py')]
+    for f in files:
+        shell.mkdirs(shell.dirname(f))
+    utils.writeTextFile(files[0], 'print(input_int() + 1)\n')
+    utils.writeTextFile(shell.pjoin(tmp_path, 'lang_var', 'a.in'), '41\n')
+    utils.writeTextFile(files[1], 'def f(x: int) -> int:\n    return 2 * x\nprint(f(21))\n')
+    utils.writeTextFile(files[2], 'x = 1\nx = True\n')
+    return files
+
+def runBatch(cmd: str, tmp_path: str, files: list[str], extraArgs: list[str] = [],
+             exitcode: int = 1) -> list[dict[str, object]]:
+    manifest = shell.pjoin(tmp_path, 'results.json')
+    res = shell.run(['python', 'src/main.py', cmd, '--jobs=2', f'--manifest={manifest}'] +
+                    extraArgs + files, captureStdout=True, onError='ignore')
+    # By default, the files of writeFiles are given, and the last one has a type error
+    assert res.exitcode == exitcode
+    return json.loads(utils.readTextFile(manifest))['results']
+
+def test_interpBatch(tmp_path: str):
+    files = writeFiles(tmp_path)
+    results = runBatch('interp-batch', tmp_path, files)
+    assert [r['input'] for r in results] == files
+    assert [r['exitcode'] for r in results] == [0, 0, constants.COMPILE_ERROR_EXIT_CODE]
+    assert [r['stdout'] for r in results][:2] == ['42\n', '42\n']
+
+def test_compileBatch(tmp_path: str):
+    files = writeFiles(tmp_path)
+    outDir = shell.pjoin(tmp_path, 'out')
+    results = runBatch('compile-batch', tmp_path, files, [f'--output-dir={outDir}'])
+    assert [r['exitcode'] for r in results] == [0, 0, constants.COMPILE_ERROR_EXIT_CODE]
+    outputs = [str(r['output']) for r in results]
+    assert len(set(outputs)) == 3
+    assert all([o.startswith(outDir) for o in outputs])
+    assert shell.isFile(outputs[0]) and shell.isFile(outputs[1])
+
+def test_batchSucceeds(tmp_path: str):
+    files = writeFiles(tmp_path)[:2]
+    results = runBatch('interp-batch', tmp_path, files, exitcode=0)
+    assert [r['exitcode'] for r in results] == [0, 0]
@@ -0,0 +1,45 @@
+import shell
+import os
+import common.utils as utils
+import common.constants as constants
+from common.compileCache import CompileCache
+
+def compile(tmp_path: str, src: str, output: str) -> shell.RunResult:
+    cacheDir = shell.pjoin(tmp_path, 'cache')
+    return shell.run(['python', 'src/main.py', '--lang=fun', 'compile', f'--output={output}',
+                      f'--compile-cache-dir={cacheDir}', src],
+                     captureStdout=True, captureStderr=True, onError='ignore')
+
+def test_compileCacheHit(tmp_path: str):
+    src = shell.pjoin(tmp_path, 'a.py')
+    utils.writeTextFile(src, 'def f(x: int) -> int:\n    return 2 * x\nprint(f(21))\n')
+    out1 = shell.pjoin(tmp_path, 'out1.wasm')
+    out2 = shell.pjoin(tmp_path, 'out2.wasm')
+    assert compile(tmp_path, src, out1).exitcode == 0
+    assert compile(tmp_path, src, out2).exitcode == 0
+    assert len(os.listdir(shell.pjoin(tmp_path, 'cache'))) == 1
+    with open(out1, 'rb') as f1, open(out2, 'rb') as f2:
+        assert f1.read() == f2.read()
+    # The .wat written next to the .wasm is cached as well
+    assert utils.readTextFile(shell.pjoin(tmp_path, 'out1.wat')) == \
+        utils.readTextFile(shell.pjoin(tmp_path, 'out2.wat'))
+
+def test_compileCacheError(tmp_path: str):
+    src = shell.pjoin(tmp_path, 'bad.py')
+    utils.writeTextFile(src, 'x = 1\nx = True\n')
+    out = shell.pjoin(tmp_path, 'out.wasm')
+    for _ in range(2):
+        res = compile(tmp_path, src, out)
+        assert res.exitcode == constants.COMPILE_ERROR_EXIT_CODE
+        assert 'Compile error' in res.stderr
+
+def test_compileCacheEvict(tmp_path: str):
+    out = shell.pjoin(tmp_path, 'out.wasm')
+    utils.writeTextFile(out, 'x' * 1000)
+    cache = CompileCache(shell.pjoin(tmp_path, 'cache'), 1500)
+    cache.store('a', 0, '', None, {'.wasm': out})
+    assert cache.lookup('a') is not None
+    cache.store('b', 0, '', None, {'.wasm': out})
+    assert cache.lookup('a') is None
+    entry = cache.lookup('b')
+    assert entry is not None and utils.readTextFile(entry.files['.wasm']) == 'x' * 1000
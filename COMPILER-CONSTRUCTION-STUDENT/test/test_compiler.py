@@ -3,6 +3,10 @@ import common.testsupport as testsupport
 import pytest
 import common.log as log
 import common.constants as constants
+from typing import *
+import shlex
+import sys
+import tempfile
 
 pytestmark = pytest.mark.instructor
 
@@ -16,25 +20,63 @@ def run(wasm: str, input: str|None) -> shell.RunResult:
 
 def runTest(lang: str, srcFile: str, tmp: str, captureErr: bool, input: str|None, extraArgs: str|None) -> shell.RunResult:
     output = shell.pjoin(tmp, 'out.wasm')
-    cmd = f'python src/main.py --lang={lang} compile --output={output}'
+    argv = [f'--lang={lang}', 'compile', f'--output={output}']
     if extraArgs:
-        cmd = cmd + ' ' + extraArgs
-    cmd = cmd + ' ' + srcFile
-    log.info(f'Running command {cmd}')
-    res = shell.run(cmd,
-                    captureStderr=captureErr, captureStdout=False, onError='ignore')
+        argv = argv + shlex.split(extraArgs)
+    argv = argv + [srcFile]
+    log.info(f'Running main.py {" ".join(argv)}')
+    res = testsupport.runInProcess(argv, None)
+    sys.stdout.write(res.stdout)
     if captureErr and res.stderr:
         log.info(f'Output on stderr: {res.stderr}')
+    elif res.stderr:
+        sys.stderr.write(res.stderr)
     if res.exitcode == 0:
         return run(shell.pjoin(tmp, 'out.wasm'), input)
     else:
         return res
 
+def runTestInTmpDir(lang: str, srcFile: str, captureErr: bool, input: str|None,
+                    extraArgs: str|None) -> shell.RunResult:
+    with tempfile.TemporaryDirectory() as tmp:
+        return runTest(lang, srcFile, tmp, captureErr, input, extraArgs)
+
+def prefetch(test: str, params: dict[str, Any]):
+    """
+    Starts compiling and running a selected test before the test runs, see conftest.py.
+    """
+    if test == 'test_compiler':
+        testsupport.testPool.prefetch(runTestInTmpDir, params['lang'], params['srcFile'],
+                                      *testsupport.testInputs(params['srcFile']))
+
 @pytest.mark.parametrize("lang, srcFile", testsupport.collectTestFiles())
-def test_compiler(lang: str, srcFile: str, tmp_path: str):
+def test_compiler(lang: str, srcFile: str):
     testsupport.runFileTest(
         srcFile,
         lambda captureErr, input, extraArgs: \
-            runTest(lang, srcFile, tmp_path, captureErr, input, extraArgs)
+            testsupport.testPool.result(runTestInTmpDir, lang, srcFile, captureErr, input, extraArgs)
     )
 
+
+def test_compilerDeepTailRecursion(tmp_path: str):
+    # Self tail calls become loops, so a tail recursion of depth 10^6 neither exhausts
+    # the wasm stack nor the shadow stack.
+    n = 1000000
+    srcFile = shell.pjoin(tmp_path, 'tail_recursion.py')
+    with open(srcFile, 'w') as f:
+        f.write('def fill(xs: list[int], i: int, n: int) -> list[int]:\n    if i == n:\n' \
+                '        return xs\n    xs[0] = i\n    return fill(xs, i + 1, n)\n' \
+                f'print(fill([0], 0, {n})[0])\n')
+    res = runTest('fun', srcFile, str(tmp_path), True, None, None)
+    assert res.exitcode == 0
+    assert res.stdout.strip() == str(n - 1)
+
+def test_compilerLargeMaxMemSize(tmp_path: str):
+    # Twice 40000 pages exceed the 65536 pages addressable with i32, so the semispaces
+    # of the garbage collector must shrink to let the runtime load the module.
+    srcFile = shell.pjoin(tmp_path, 'large_mem.py')
+    with open(srcFile, 'w') as f:
+        f.write('xs = 1000 * [1]\nxs[999] = 42\nprint(xs[999])\n')
+    res = runTest('array', srcFile, str(tmp_path), True, None, '--max-mem-size=40000')
+    assert res.exitcode == 0
+    assert res.stdout.strip() == '42'
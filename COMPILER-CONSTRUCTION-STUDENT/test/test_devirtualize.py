@@ -0,0 +1,32 @@
+from lang_fun.fun_astAtom import *
+from lang_fun.fun_devirtualize import devirtualize
+
+intFun = Fun([Int()], NotVoid(Int()))
+
+def funDef(name: str) -> FunDef:
+    return FunDef(Ident(name), [FunParam(Ident('x'), Int())], NotVoid(Int()),
+                  [Return(AtomExp(VarName(Ident('x'), Int()), NotVoid(Int())))])
+
+def callF() -> Call:
+    return Call(CallTargetIndirect(Ident('f'), [Int()], NotVoid(Int())),
+                [AtomExp(IntConst(1, Int()), NotVoid(Int()))], NotVoid(Int()))
+
+def apply(callsF: Call) -> FunDef:
+    return FunDef(Ident('apply'), [FunParam(Ident('f'), intFun)], NotVoid(Int()),
+                  [Return(callsF)])
+
+def callApply(name: str) -> StmtExp:
+    arg = AtomExp(FunName(Ident(name), intFun), NotVoid(intFun))
+    return StmtExp(Call(CallTargetDirect(Ident('apply')), [arg], NotVoid(Int())))
+
+def test_singleTargetBecomesDirect():
+    call = callF()
+    m = Module([apply(call), funDef('inc')], [callApply('inc'), callApply('inc')])
+    assert devirtualize(m) == 1
+    assert call.fun == CallTargetDirect(Ident('inc'))
+
+def test_severalTargetsStayIndirect():
+    call = callF()
+    m = Module([apply(call), funDef('inc'), funDef('dec')], [callApply('inc'), callApply('dec')])
+    assert devirtualize(m) == 0
+    assert isinstance(call.fun, CallTargetIndirect)
@@ -0,0 +1,40 @@
+from lang_fun.fun_ast import *
+import lang_fun.fun_ast as fun_ast
+import lang_fun.fun_tychecker as fun_tychecker
+from lang_fun.fun_inline import inlineModule, allExps
+import common.genericParser as genericParser
+from pathlib import Path
+
+helpers = '''
+def max(x: int, y: int) -> int:
+    if x > y:
+        return x
+    return y
+
+def fact(n: int) -> int:
+    if n <= 1:
+        return 1
+    return n * fact(n - 1)
+'''
+
+def inline(tmp_path: Path, src: str) -> Module:
+    f = tmp_path / 'prog.py'
+    f.write_text(helpers + src)
+    m = genericParser.parseFile(str(f), fun_ast)
+    (res, _) = inlineModule(m, fun_tychecker.tycheckModule(m))
+    return res
+
+def callees(stmts: list[stmt]) -> list[str]:
+    return [e.fun.var.name for e in allExps(stmts) if isinstance(e, Call) and isinstance(e.fun, Name)]
+
+def test_callReplacedByBody(tmp_path: Path):
+    m = inline(tmp_path, 'print(max(1, 2) + max(3, 4))')
+    assert callees(m.stmts) == ['print']
+
+def test_recursiveFunctionNotInlined(tmp_path: Path):
+    m = inline(tmp_path, 'print(fact(max(1, 2)))')
+    assert callees(m.stmts) == ['print', 'fact']
+
+def test_callAfterSideEffectNotMoved(tmp_path: Path):
+    m = inline(tmp_path, 'print(input_int() + max(1, 2))')
+    assert callees(m.stmts) == ['print', 'input_int', 'max']
@@ -2,18 +2,140 @@ import shell
 import common.testsupport as testsupport
 import common.log as log
 import pytest
+import common.utils as utils
+from common.interpStore import Address
+import lang_array.array_ast as ast
+import lang_array.array_interp as array_interp
+from typing import *
 
-def runTest(lang: str, srcFile: str, input: str|None):
-    cmd = ['timeout', '10s', 'python', 'src/main.py', f'--lang={lang}', 'interp', srcFile]
-    log.info(f'Running command {" ".join(cmd)}')
-    res = shell.run(cmd, input=input, captureStdout=True, captureStderr=True, onError='ignore')
-    return res
+def runTest(lang: str, srcFile: str, input: str|None, engine: str = 'tree',
+            extraArgs: list[str] = []):
+    argv = [f'--lang={lang}', 'interp', f'--engine={engine}'] + extraArgs + [srcFile]
+    log.info(f'Running main.py {" ".join(argv)}')
+    return testsupport.runInProcess(argv, input, timeout=10)
+
+def prefetch(test: str, params: dict[str, Any]):
+    """
+    Starts the interpreter for a selected test before the test runs, see conftest.py.
+    """
+    match test:
+        case 'test_interp':
+            (_, input, _) = testsupport.testInputs(params['srcFile'])
+            testsupport.testPool.prefetch(runTest, params['lang'], params['srcFile'], input)
+        case 'test_interpEngine':
+            (_, input, _) = testsupport.testInputs(params['srcFile'])
+            testsupport.testPool.prefetch(runTest, params['lang'], params['srcFile'], input,
+                                          params['engine'])
+        case _:
+            pass
 
 @pytest.mark.parametrize("lang, srcFile", testsupport.collectTestFiles())
 def test_interp(lang: str, srcFile: str):
     testsupport.runFileTest(
         srcFile,
-        lambda captureErr, input, _extraArgs: runTest(lang, srcFile, input),
+        lambda captureErr, input, _extraArgs: testsupport.testPool.result(runTest, lang, srcFile, input),
         errorMode='lenient'
     )
 
+# Alternative interpreter engines and the languages they support
+ENGINES = {'closure': ['array', 'fun'], 'python': ['loop', 'array', 'fun']}
+
+def engineParams() -> list[tuple[str, str, str]]:
+    return [(engine, lang, src) for engine, langs in ENGINES.items()
+            for (lang, src) in testsupport.collectTestFiles(langOnly=langs)]
+
+@pytest.mark.parametrize("engine, lang, srcFile", engineParams())
+def test_interpEngine(engine: str, lang: str, srcFile: str):
+    testsupport.runFileTest(
+        srcFile,
+        lambda captureErr, input, _extraArgs: \
+            testsupport.testPool.result(runTest, lang, srcFile, input, engine),
+        errorMode='lenient'
+    )
+
+@pytest.mark.parametrize("lang", ['loop', 'array', 'fun'])
+def test_interpLongLoop(lang: str, tmp_path: str):
+    # The interpreter must neither run into python's recursion limit nor take
+    # quadratic time for long-running loops.
+    n = 100000
+    srcFile = shell.pjoin(tmp_path, 'long_loop.py')
+    utils.writeTextFile(srcFile, f'i = 0\ns = 0\nwhile i < {n}:\n    s = s + i\n    i = i + 1\nprint(s)\n')
+    res = runTest(lang, srcFile, None)
+    assert res.exitcode == 0
+    assert res.stdout.strip() == str(n * (n - 1) // 2)
+
+@pytest.mark.parametrize("lang", ['array', 'fun'])
+def test_interpCompactArrays(lang: str, tmp_path: str):
+    # Int and bool arrays are stored compactly, but must still hold bools and ints
+    # exceeding 64 bits.
+    srcFile = shell.pjoin(tmp_path, 'compact_arrays.py')
+    utils.writeTextFile(srcFile, 'a = 3 * [0]\nb = 3 * [True]\nc = [1, 2]\n' \
+        'a[1] = 9223372036854775807 * 2\nb[2] = False\nc[0] = c[1] - 9223372036854775807 * 4\n' \
+        'print(a[1])\nprint(b[0])\nprint(b[2])\nprint(c[0])\nprint(len(a))\n')
+    for engine in ['tree'] + [e for e, langs in ENGINES.items() if lang in langs]:
+        res = runTest(lang, srcFile, None, engine)
+        assert res.exitcode == 0
+        assert res.stdout.split() == ['18446744073709551614', 'True', 'False',
+                                      '-36893488147419103226', '3']
+
+def test_interpGc(tmp_path: str):
+    # Arrays allocated in a loop become garbage; nested arrays, function arguments and
+    # return values must survive collections.
+    srcFile = shell.pjoin(tmp_path, 'gc.py')
+    utils.writeTextFile(srcFile, 'def mk(n: int) -> list[list[int]]:\n' \
+        '    a = n * [[0]]\n    i = 0\n    while i < n:\n        a[i] = [i, 2 * i]\n' \
+        '        i = i + 1\n    return a\n' \
+        'def get(a: list[list[int]], b: list[list[int]]) -> int:\n    return a[3][1] + b[1][0]\n' \
+        'keep = mk(3)\ni = 0\ns = 0\nwhile i < 1000:\n' \
+        '    s = s + get(mk(5), [[1], mk(2)[1]])\n    i = i + 1\nprint(s)\nprint(keep[2][1])\n')
+    res = runTest('fun', srcFile, None, extraArgs=['--gc', '--gc-threshold=100', '--gc-stats'])
+    assert res.exitcode == 0
+    assert res.stdout.split() == ['7000', '4']
+    stats = dict(kv.split(': ') for kv in res.stderr.strip().removeprefix('GC stats: ').split(', '))
+    assert int(stats['collections']) > 0
+    assert int(stats['peak live bytes']) < 1000
+
+@pytest.mark.parametrize("engine", ['tree', 'closure'])
+def test_interpDeepTailRecursion(engine: str, tmp_path: str):
+    # Self tail calls become loops, so the depth of a tail recursion is not limited by
+    # python's recursion limit.
+    n = 100000
+    srcFile = shell.pjoin(tmp_path, 'tail_recursion.py')
+    utils.writeTextFile(srcFile, 'def sum(n: int, acc: int) -> int:\n    if n == 0:\n' \
+        f'        return acc\n    return sum(n - 1, acc + n)\nprint(sum({n}, 0))\n')
+    res = runTest('fun', srcFile, None, engine)
+    assert res.exitcode == 0
+    assert res.stdout.strip() == str(n * (n + 1) // 2)
+
+def test_interpMemoize(tmp_path: str):
+    # fib is memoized; noisy prints and bump writes to its argument, so their calls
+    # must not be cached.
+    srcFile = shell.pjoin(tmp_path, 'memo.py')
+    utils.writeTextFile(srcFile, 'def fib(n: int) -> int:\n    if n < 2:\n        return n\n' \
+        '    return fib(n - 1) + fib(n - 2)\n' \
+        'def noisy(n: int) -> int:\n    print(n)\n    return n\n' \
+        'def bump(xs: list[int]) -> int:\n    xs[0] = xs[0] + 1\n    return xs[0]\n' \
+        'print(fib(60))\nprint(noisy(1) + noisy(1))\na = [0]\nprint(bump(a) + bump(a))\n')
+    res = runTest('fun', srcFile, None, extraArgs=['--memoize', '--memo-stats'])
+    assert res.exitcode == 0
+    assert res.stdout.split() == ['1548008755920', '1', '1', '2', '3']
+    stats = dict(kv.split(': ') for kv in res.stderr.strip().removeprefix('Memo stats: ').split(', '))
+    assert int(stats['misses']) == 61
+    assert int(stats['hits']) == 58
+
+def test_interpAddressIsNotInt():
+    # Addresses are ints internally, but must never be used as int values.
+    a = Address(0)
+    for op in [lambda: a + 1, lambda: 1 + a, lambda: a - a, lambda: 2 * a, lambda: -a,
+               lambda: a < 1, lambda: 1 <= a]:
+        with pytest.raises(TypeError):
+            op()
+    with pytest.raises(AssertionError):
+        array_interp.asInt(a)
+    store = array_interp.Store()
+    env: array_interp.Env = {ast.Ident('a'): store.alloc([1, 2])}
+    with pytest.raises(TypeError):
+        array_interp.interpExp(ast.BinOp(ast.Name(ast.Ident('a')), ast.Add(), ast.IntConst(1)),
+                               env, store)
+    with pytest.raises(AssertionError):
+        array_interp.interpFuncall(ast.Ident('print'), [ast.Name(ast.Ident('a'))], env, store)
@@ -0,0 +1,45 @@
+from lang_array.array_astAtom import *
+from lang_array.array_localAlloc import coalesceTemporaries
+
+def name(x: str) -> AtomExp:
+    return AtomExp(Name(Ident(x)))
+
+def add(x: str, y: str) -> BinOp:
+    return BinOp(name(x), Add(), name(y))
+
+def test_disjointTemporariesShareLocal():
+    temps: dict[ident, ty] = {Ident('tmp_0'): Int(), Ident('tmp_1'): Int(), Ident('tmp_2'): Int()}
+    stmts: list[stmt] = [
+        Assign(Ident('tmp_0'), add('x', 'x')),
+        Assign(Ident('y'), add('tmp_0', 'x')),
+        Assign(Ident('tmp_1'), add('y', 'y')),
+        Assign(Ident('tmp_2'), add('y', 'x')),
+        Assign(Ident('z'), add('tmp_1', 'tmp_2'))
+    ]
+    (res, remaining) = coalesceTemporaries(stmts, temps)
+    assert list(remaining) == [Ident('tmp_0'), Ident('tmp_2')]
+    assert res[2] == Assign(Ident('tmp_0'), add('y', 'y'))
+    assert res[4] == Assign(Ident('z'), add('tmp_0', 'tmp_2'))
+
+def test_loopConditionKeepsTemporaryLive():
+    temps: dict[ident, ty] = {Ident('tmp_0'): Int(), Ident('tmp_1'): Int()}
+    stmts: list[stmt] = [
+        Assign(Ident('tmp_0'), add('x', 'x')),
+        WhileStmt(BinOp(name('i'), Less(), name('tmp_0')), [
+            Assign(Ident('tmp_1'), add('i', 'x')),
+            Assign(Ident('i'), AtomExp(Name(Ident('tmp_1'))))
+        ])
+    ]
+    (_, remaining) = coalesceTemporaries(stmts, temps)
+    assert len(remaining) == 2
+
+def test_arraysAndBoolsUseDifferentLocals():
+    temps: dict[ident, ty] = {Ident('tmp_0'): Bool(), Ident('tmp_1'): Array(Int())}
+    stmts: list[stmt] = [
+        Assign(Ident('tmp_0'), BinOp(name('x'), Less(), name('y'))),
+        Assign(Ident('b'), AtomExp(Name(Ident('tmp_0')))),
+        Assign(Ident('tmp_1'), ArrayInitDyn(Name(Ident('x')), IntConst(0))),
+        Assign(Ident('a'), AtomExp(Name(Ident('tmp_1'))))
+    ]
+    (_, remaining) = coalesceTemporaries(stmts, temps)
+    assert len(remaining) == 2
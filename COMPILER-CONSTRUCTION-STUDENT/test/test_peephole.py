@@ -0,0 +1,53 @@
+from common.wasm import *
+from common.peephole import *
+
+x = WasmId('$x')
+loop = WasmId('$loop')
+
+def optimize(instrs: list[WasmInstr], level: int = maxOptLevel) -> tuple[list[WasmInstr], Stats]:
+    stats = Stats()
+    return (optimizeInstrs(instrs, rulesForLevel(level), stats), stats)
+
+def test_setGetToTee():
+    (res, stats) = optimize([WasmInstrConst('i64', 1), WasmInstrVarLocal('set', x),
+                             WasmInstrVarLocal('get', x)])
+    assert res == [WasmInstrConst('i64', 1), WasmInstrVarLocal('tee', x)]
+    assert stats.hits == {'setGetToTee': 1}
+
+def test_ifToBrIfInLoop():
+    instrs: list[WasmInstr] = [WasmInstrLoop(loop, [
+        WasmInstrVarLocal('get', x),
+        WasmInstrConst('i64', 10),
+        WasmInstrIntRelOp('i64', 'lt_s'),
+        WasmInstrIf(None, [], [WasmInstrBranch(loop, False)]),
+        WasmInstrBranch(loop, False),
+        WasmInstrDrop()
+    ])]
+    (res, stats) = optimize(instrs, 1)
+    assert res == [WasmInstrLoop(loop, [
+        WasmInstrVarLocal('get', x),
+        WasmInstrConst('i64', 10),
+        WasmInstrIntRelOp('i64', 'ge_s'),
+        WasmInstrBranch(loop, True),
+        WasmInstrBranch(loop, False)
+    ])]
+    assert stats.hits == {'ifToBrIf': 1, 'deadCode': 1}
+
+def test_foldConstants():
+    (res, _) = optimize([WasmInstrConst('i64', 3), WasmInstrConvOp('i32.wrap_i64'),
+                         WasmInstrConst('i32', 8), WasmInstrNumBinOp('i32', 'mul'),
+                         WasmInstrConst('i32', 4), WasmInstrNumBinOp('i32', 'add')])
+    assert res == [WasmInstrConst('i32', 28)]
+    (res, _) = optimize([WasmInstrConst('i32', 2**31 - 1), WasmInstrConst('i32', 1),
+                         WasmInstrNumBinOp('i32', 'add')])
+    assert res == [WasmInstrConst('i32', -2**31)]
+    (res, _) = optimize([WasmInstrConst('i32', -1), WasmInstrConst('i32', 0),
+                         WasmInstrIntRelOp('i32', 'gt_u'),
+                         WasmInstrIf(None, [WasmInstrTrap()], [WasmInstrDrop()])])
+    assert res == [WasmInstrTrap()]
+
+def test_levelZero():
+    instrs: list[WasmInstr] = [WasmInstrVarLocal('set', x), WasmInstrVarLocal('get', x)]
+    (res, stats) = optimize(instrs, 0)
+    assert res == instrs
+    assert stats.total() == 0
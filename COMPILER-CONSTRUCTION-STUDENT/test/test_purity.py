@@ -0,0 +1,47 @@
+from lang_fun.fun_ast import *
+import lang_fun.fun_ast as fun_ast
+import lang_fun.fun_tychecker as fun_tychecker
+from lang_fun.fun_purity import memoizableFuns
+import common.genericParser as genericParser
+from pathlib import Path
+
+src = '''
+def fib(n: int) -> int:
+    if n < 2:
+        return n
+    return fib(n - 1) + fib(n - 2)
+
+def sumFibs(n: int) -> int:
+    xs = n * [0]
+    i = 0
+    s = 0
+    while i < len(xs):
+        s = s + fib(i)
+        i = i + 1
+    return s
+
+def fill(n: int) -> int:
+    xs = n * [0]
+    xs[0] = 1
+    return xs[0]
+
+def noisy(n: int) -> int:
+    print(n)
+    return fib(n)
+
+def callsNoisy(b: bool) -> bool:
+    return noisy(1) > 0 and b
+
+def first(xs: list[int]) -> int:
+    return xs[0]
+
+def apply(f: Callable[[int], int], x: int) -> int:
+    return f(x)
+'''
+
+def test_memoizableFuns(tmp_path: Path):
+    f = tmp_path / 'prog.py'
+    f.write_text(src)
+    m = genericParser.parseFile(str(f), fun_ast)
+    fun_tychecker.tycheckModule(m)
+    assert {x.name for x in memoizableFuns(m)} == {'fib', 'sumFibs'}
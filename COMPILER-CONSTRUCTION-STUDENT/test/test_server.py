@@ -0,0 +1,33 @@
+import shell
+import common.utils as utils
+import common.constants as constants
+from common.server import Client
+import subprocess
+
+def test_serverMatchesCli(tmp_path: str):
+    ok = shell.pjoin(tmp_path, 'lang_fun', 'ok.py')
+    bad = shell.pjoin(tmp_path, 'lang_fun', 'bad.py')
+    shell.mkdirs(shell.dirname(ok))
+    utils.writeTextFile(ok, 'def inc(x: int) -> int:\n    return x + 1\nprint(inc(input_int()))\n')
+    utils.writeTextFile(bad, 'x = 1\nx = True\n')
+    requests: list[tuple[list[str], str|None]] = [
+        (['interp', ok], '41\n'),
+        (['pyrun', ok], '1\n'),
+        (['interp', ok], ''),
+        (['compile', '--output', shell.pjoin(tmp_path, 'bad.wasm'), bad], None),
+        (['parse', ok], None),
+    ]
+    with Client(timeout=10) as client:
+        results = [client.run(argv, input) for argv, input in requests]
+    for (argv, input), res in zip(requests, results):
+        # shell.run passes an empty input as None, which would inherit stdin
+        proc = subprocess.run(['python', 'src/main.py'] + argv, input=input or '',
+                              capture_output=True, text=True)
+        cli = shell.RunResult(proc.stdout, proc.stderr, proc.returncode)
+        if argv[0] != 'parse':
+            assert res.exitcode == cli.exitcode
+            assert res.stdout == cli.stdout
+    assert [r.exitcode for r in results] == [0, 0, constants.RUN_ERROR_EXIT_CODE,
+                                             constants.COMPILE_ERROR_EXIT_CODE, 1]
+    assert results[0].stdout == '42\n'
+    assert 'not available in server mode' in results[4].stderr
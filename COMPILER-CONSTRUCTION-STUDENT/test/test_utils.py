@@ -1,4 +1,5 @@
-from common.utils import splitIf
+from common.utils import splitIf, writeTextFileAtomic, readTextFile
+import os
 
 def test_splitIf():
     l = [1, 2, 3, 4, 5, 6]
@@ -12,3 +13,10 @@ def test_splitIf():
     assert splitIf(empty, lambda x: x == 3, 'left') == ([], [])
     assert splitIf([3], lambda x: x == 3) == ([], [3])
     assert splitIf([3], lambda x: x == 3, 'left') == ([3], [])
+
+def test_writeTextFileAtomic(tmp_path: str):
+    path = os.path.join(tmp_path, 'out.txt')
+    writeTextFileAtomic(path, 'old')
+    writeTextFileAtomic(path, 'new')
+    assert readTextFile(path) == 'new'
+    assert os.listdir(tmp_path) == ['out.txt']
@@ -0,0 +1,45 @@
+from common.wasm import *
+from common.wasmBinary import *
+
+def test_leb128():
+    assert uleb(0) == b'\x00'
+    assert uleb(127) == b'\x7f'
+    assert uleb(128) == b'\x80\x01'
+    assert uleb(624485) == b'\xe5\x8e\x26'
+    assert sleb(0) == b'\x00'
+    assert sleb(63) == b'\x3f'
+    assert sleb(64) == b'\xc0\x00'
+    assert sleb(-1) == b'\x7f'
+    assert sleb(-64) == b'\x40'
+    assert sleb(-65) == b'\xbf\x7f'
+    assert sleb(-123456) == b'\xc0\xbb\x78'
+    assert signed(0xffffffff, 32) == -1
+    assert signed(2**31 - 1, 32) == 2**31 - 1
+
+def test_labelDepth():
+    a = WasmId('$a')
+    b = WasmId('$b')
+    assert labelDepth(a, [a, None, b]) == 2
+    assert labelDepth(b, [a, None, b]) == 0
+    assert labelDepth(a, [a, a]) == 0
+
+def test_encodeModule():
+    f = WasmId('$f')
+    loop = WasmId('$loop')
+    m = WasmModule(imports=[],
+                   exports=[WasmExport('f', WasmExportFunc(f))],
+                   globals=[],
+                   data=[],
+                   funcTable=WasmFuncTable([]),
+                   funcs=[WasmFunc(f, [], 'i32', [], [
+                       WasmInstrLoop(loop, [WasmInstrBranch(loop, False)]),
+                       WasmInstrConst('i32', -1)])])
+    expected = (b'\x00asm\x01\x00\x00\x00'
+                b'\x01\x05\x01\x60\x00\x01\x7f' # type section
+                b'\x03\x02\x01\x00' # function section
+                b'\x04\x05\x01\x70\x01\x00\x00' # table section
+                b'\x07\x05\x01\x01f\x00\x00' # export section
+                b'\x09\x08\x01\x02\x00\x41\x00\x0b\x00\x00' # element section
+                b'\x0a\x0b\x01\x09\x00\x03\x40\x0c\x00\x0b\x41\x7f\x0b' # code section
+                b'\x00\x0b\x04name\x01\x04\x01\x00\x01f') # name section
+    assert encodeModule(m) == expected
@@ -0,0 +1,50 @@
+import io
+from common.wasm import *
+from common.watWriter import writeModule
+
+def test_writeModule():
+    f = WasmId('$f')
+    loop = WasmId('$loop')
+    m = WasmModule(imports=[WasmImport('env', 'memory', WasmImportMemory(1, None))],
+                   exports=[WasmExport('f', WasmExportFunc(f))],
+                   globals=[WasmGlobal(WasmId('$g'), 'i32', True, [WasmInstrConst('i32', 100)])],
+                   data=[WasmData(0, 'Error')],
+                   funcTable=WasmFuncTable([f]),
+                   funcs=[WasmFunc(f, [(WasmId('$x'), 'i64')], 'i32', [(WasmId('$y'), 'i32')], [
+                       WasmInstrLoop(loop, [
+                           WasmInstrConst('i32', 1),
+                           WasmInstrIf(None, [WasmInstrBranch(loop, False)], [])
+                       ]),
+                       WasmInstrConst('i32', -1)])])
+    out = io.StringIO()
+    writeModule(m, out)
+    assert out.getvalue() == '''(module
+  (import "env" "memory" (memory 1))
+  (export "f" (func $f))
+  (global $g (mut i32) (i32.const 100))
+  (data (i32.const 0) "Error")
+  (table funcref (elem $f))
+  (func $f (param $x i64) (result i32)
+    (local $y i32)
+    loop $loop
+      i32.const 1
+      if
+        br $loop
+      else
+      end
+    end
+    i32.const -1
+  )
+)
+'''
+
+def test_writeModuleEscapesStrings():
+    m = WasmModule(imports=[], exports=[WasmExport('fü', WasmExportFunc(WasmId('$f')))],
+                   globals=[], data=[WasmData(0, 'a"\\ä\n\x01')], funcTable=WasmFuncTable([]),
+                   funcs=[WasmFunc(WasmId('$f'), [], None, [], [])])
+    out = io.StringIO()
+    writeModule(m, out)
+    text = out.getvalue()
+    assert '(export "f\\c3\\bc" (func $f))' in text
+    assert '(data (i32.const 0) "a\\22\\5c\\c3\\a4\\0a\\01")' in text
+    assert text.isascii()
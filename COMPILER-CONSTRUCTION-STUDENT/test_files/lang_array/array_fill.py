@@ -0,0 +1,24 @@
+# Array initialization: zero, memory.fill (-1), doubling copies, static data segments
+a = 5 * [7]
+b = 3 * [-1]
+c = 0 * [3]
+d = 4 * [True]
+e = 6 * [0]
+n = 1
+f = 7 * [n]
+g = [1, 2, 3]
+h = [True, False]
+k = [n, 0, 5]
+m = 3 * [g]
+g[0] = 9
+print(a[0] + a[4] + b[2] + len(c) + e[5] + f[6] + f[0])
+print(d[3])
+print(g[0] + g[2] + k[0] + k[1] + k[2] + m[2][0] + m[1][2])
+print(h[0])
+print(h[1])
+i = 0
+while i < 3:
+    g = [1, 2, 3]
+    print(g[0])
+    g[0] = 5
+    i = i + 1
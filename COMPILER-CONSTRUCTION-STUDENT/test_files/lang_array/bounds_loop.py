@@ -0,0 +1,13 @@
+# The subscripts inside the loops need no bounds checks.
+a = 10 * [0]
+i = 0
+while i < len(a):
+    a[i] = i * i
+    i = i + 1
+s = 0
+j = 0
+while len(a) > j and s < 100:
+    s = s + a[j]
+    j = j + 1
+print(s)
+print(j)
@@ -0,0 +1,18 @@
+# Allocates much more memory than available (see gc_loop.args), but only a few arrays
+# are reachable at the same time.
+keep = 4 * [[0]]
+sum = 0
+i = 0
+j = 0
+while i < 2000:
+    a = 100 * [i]
+    b = [a, [i, i + 1]]
+    keep[j] = b[1]
+    sum = sum + a[99] + len(b) + keep[0][1]
+    i = i + 1
+    j = j + 1
+    if j == 4:
+        j = 0
+print(sum)
+print(keep[0][0])
+print(keep[3][1])
@@ -0,0 +1,5 @@
+# We have 65536 bytes of mem, and a bool takes 4 bytes
+
+arr = 16000 * [True]
+print(len(arr))
+print(arr[15999])
@@ -0,0 +1,7 @@
+### run error: IndexError
+# The bounds check must not be dropped: i changes after the loop condition.
+arr = [1, 2, 3]
+i = 0
+while i < len(arr):
+    i = i + 1
+    arr[i] = 0
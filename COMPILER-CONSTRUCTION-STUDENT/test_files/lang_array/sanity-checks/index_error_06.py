@@ -0,0 +1,10 @@
+### run error: IndexError
+# The bounds check must not be dropped: adding the constants wraps around in 64-bit
+# arithmetic, so x is negative in the loop.
+a = [1, 2, 3]
+k = 1
+x = k + 9223372036854775807
+x = x + 9223372036854775807
+while x < len(a):
+    print(a[x])
+    x = x + 1
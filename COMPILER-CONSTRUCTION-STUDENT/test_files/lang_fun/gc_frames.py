@@ -0,0 +1,55 @@
+def garbage(n: int) -> int:
+    i = 0
+    s = 0
+    while i < n:
+        a = 100 * [i]
+        s = s + a[99]
+        i = i + 1
+    return s
+
+def build(depth: int, keep: list[int]) -> list[list[int]]:
+    mine = [depth, depth + 1, depth + 2]
+    if depth == 0:
+        g = garbage(300)
+        res = 2 * [keep]
+        return res
+    inner = build(depth - 1, mine)
+    check = keep[0] + mine[2] + inner[0][0]
+    print(check)
+    return [mine, inner[1]]
+
+def apply(f: Callable[[int], int], xs: list[int]) -> list[int]:
+    out = len(xs) * [0]
+    i = 0
+    while i < len(xs):
+        out[i] = f(xs[i])
+        i = i + 1
+    return out
+
+def alloc_sq(x: int) -> int:
+    tmp = 200 * [x]
+    return tmp[0] * tmp[199]
+
+def is_pos(x: int) -> bool:
+    junk = 50 * [x]
+    print(x)
+    return junk[0] > 0
+
+r = build(20, [7, 8, 9])
+print(r[0][0])
+print(r[1][2])
+ys = apply(alloc_sq, [1, 2, 3, 4, 5])
+i = 0
+round = 0
+while round < 30:
+    ys = apply(alloc_sq, [1, 2, 3, 4, 5])
+    round = round + 1
+while i < len(ys):
+    print(ys[i])
+    i = i + 1
+k = 0
+while is_pos(3 - k) and is_pos(10 - k):
+    k = k + 1
+print(k)
+print(is_pos(-1) or is_pos(5))
+print(-1 > 0 and is_pos(99))
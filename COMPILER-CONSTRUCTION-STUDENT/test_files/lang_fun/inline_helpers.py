@@ -0,0 +1,57 @@
+def abs(x: int) -> int:
+    if x < 0:
+        return -x
+    return x
+
+def max(x: int, y: int) -> int:
+    if x > y:
+        return x
+    else:
+        return y
+
+def get(xs: list[int], i: int) -> int:
+    return xs[i]
+
+def swap(xs: list[int], i: int, j: int) -> None:
+    tmp = xs[i]
+    xs[i] = xs[j]
+    xs[j] = tmp
+
+def fresh(xs: list[int]) -> list[int]:
+    xs[0] = 42
+    xs = [7, 7]
+    return xs
+
+def next(n: int) -> int:
+    n = n + 1
+    print(n)
+    return n
+
+def fact(n: int) -> int:
+    if n <= 1:
+        return 1
+    return n * fact(n - 1)
+
+def apply(f: Callable[[int], int], x: int) -> int:
+    return f(x)
+
+xs = [3, -5, 8, -1]
+i = 0
+m = 0
+while i < len(xs) and max(m, abs(get(xs, i))) < 10:
+    m = max(m, abs(get(xs, i)))
+    i = i + 1
+print(m)
+swap(xs, 0, 3)
+print(xs[0])
+print(xs[3])
+ys = xs
+zs = fresh(xs)
+print(ys[0])
+print(zs[0])
+k = input_int()
+print(next(k) + next(k))
+print(abs(k - 10) + max(k, 2))
+print(apply(abs, -3) + apply(fact, 5))
+b = k > 100 and abs(k) > 0
+print(b)
@@ -0,0 +1,34 @@
+def map(f: Callable[[int], int], xs: list[int]) -> list[int]:
+    ys = len(xs) * [0]
+    i = 0
+    while i < len(xs):
+        ys[i] = f(xs[i])
+        i = i + 1
+    return ys
+
+def fold(f: Callable[[int, int], int], xs: list[int], acc: int) -> int:
+    i = 0
+    while i < len(xs):
+        acc = f(acc, xs[i])
+        i = i + 1
+    return acc
+
+def square(x: int) -> int:
+    return x * x
+
+def add(x: int, y: int) -> int:
+    return x + y
+
+def mul(x: int, y: int) -> int:
+    return x * y
+
+def pick(b: bool) -> Callable[[int, int], int]:
+    if b:
+        return add
+    return mul
+
+xs = [1, 2, 3, 4]
+print(fold(add, map(square, xs), 0))
+op = pick(input_int() > 0)
+print(op(6, 7))
+print(fold(op, xs, 1))
@@ -0,0 +1,35 @@
+# The right-hand side of an assignment to an array element is evaluated before the
+# array. The index is evaluated before both of them, so it only changes a counter here.
+def arr(a: list[int], i: int) -> list[int]:
+    print(i)
+    return a
+
+def arr2(m: list[list[int]], i: int) -> list[list[int]]:
+    print(i)
+    return m
+
+def idx(count: list[int], i: int) -> int:
+    count[0] = count[0] + 1
+    return i
+
+def val(i: int) -> int:
+    print(i)
+    return i
+
+count = [0]
+a = [0, 0, 0]
+arr(a, 7)[idx(count, 1)] = val(2)
+print(a[1])
+
+m = [[0, 0], [0, 0]]
+arr2(m, 3)[idx(count, 0)][idx(count, 1)] = val(5)
+print(m[0][1])
+print(count[0])
+
+def swap(m: list[list[int]]) -> int:
+    m[0] = m[1]
+    return 9
+
+m[0][0] = swap(m)
+print(m[0][0])
+print(m[1][0])
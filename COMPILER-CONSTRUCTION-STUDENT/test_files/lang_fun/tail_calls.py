@@ -0,0 +1,62 @@
+def sum(n: int, acc: int) -> int:
+    if n == 0:
+        return acc
+    return sum(n - 1, acc + n)
+
+def gcd(a: int, b: int) -> int:
+    if b == 0:
+        return a
+    if a < b:
+        return gcd(b, a)
+    return gcd(a - b, b)
+
+def countdown(n: int) -> None:
+    if n < 0:
+        return
+    print(n)
+    countdown(n - 3)
+
+def fill(xs: list[int], i: int, v: int) -> list[int]:
+    if i >= len(xs):
+        return xs
+    xs[i] = v
+    return fill(xs, i + 1, v * 2)
+
+def grow(xs: list[int], n: int) -> list[int]:
+    if n == 0:
+        return xs
+    ys = (len(xs) + 1) * [n]
+    ys[0] = xs[0] + 1
+    return grow(ys, n - 1)
+
+def fib(n: int, a: int, b: int) -> int:
+    if n == 0:
+        return a
+    else:
+        if n == 1:
+            print(b)
+        return fib(n - 1, b, a + b)
+
+def collatz(n: int, steps: int) -> int:
+    if n == 1:
+        return steps
+    half = 0
+    while 2 * half < n:
+        half = half + 1
+    if 2 * half == n:
+        return collatz(half, steps + 1)
+    return collatz(3 * n + 1, steps + 1) + 0
+
+print(sum(500, 0))
+print(gcd(84, 36))
+countdown(10)
+a = [0, 0, 0, 0, 0]
+b = fill(a, 1, 3)
+print(a[4])
+print(b is a)
+g = grow([0], 20)
+print(len(g))
+print(g[0])
+print(g[len(g) - 1])
+print(fib(30, 0, 1))
+print(collatz(27, 0))